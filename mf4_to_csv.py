@@ -21,100 +21,184 @@ Program Flow Description for MF4 to CSV Converter:
 6. Output:
    - The final CSV file is saved to a specified location. This file now contains only the necessary information as structured data, making it easier for further analysis or reporting.
 
+7. Batch Mode:
+   - Running `python mf4_to_csv.py --batch` skips all prompts and converts every MF4 file under `paths.data_files`.
+   - The files are converted in parallel over a process pool. The number of workers is set with `batch.workers` in the settings or `--workers`.
+
+8. Streaming Mode:
+   - With `streaming.enabled` (or `--stream`) the raw frames are read and decoded `streaming.chunk_records` at a time and appended to the exports, so memory use does not grow with the size of the log. Reading, decoding, formatting and writing overlap on separate threads, with at most `pipeline.depth` chunks queued between them.
+
+9. Raw Frame Store:
+   - With `export_settings.raw_frame_store` the raw frames are also kept as memory-mappable `.npy` arrays. `python mf4_to_csv.py --redecode <export_dir>/raw_frames_<name>` decodes them again with the current DBCs without the MF4 file.
+
+10. Signal Profiles:
+   - `decoding.profiles` (or `--profile <name>`) narrows the DBC messages to the signals of the named profiles in the `[profiles]` section before decoding, so routine jobs only decode and export the signals they use.
+
+11. Metrics:
+   - Every conversion writes `metrics_<name>.json` next to its exports with the wall time, CPU time, peak memory, frames, signals and bytes written of each stage. `--profiler cprofile` (or `pyinstrument`) also profiles the whole conversion to `profile_<name>.prof` (or `.html`).
+
+12. Conversion Daemon:
+   - `python -m src.daemon serve` keeps the converter and the parsed DBCs loaded and converts the logs sent with `python -m src.daemon submit <file.mf4>` or dropped into `daemon.watch_dir`, without paying for the imports and DBC loading on every run.
+
+13. Incremental Conversion:
+   - `manifest_<name>.json` records the hashes and settings each export was made from. Running the converter again only redoes the exports whose inputs changed and skips up-to-date logs (`--force` converts everything again). Interrupted streaming conversions resume from their last checkpoint.
+
+14. Derived Channels:
+   - Channels defined in the `[derived]` section, such as power or energy, are computed from the decoded signals, matched as-of in time, and exported with them.
+
+15. Stats Index:
+   - `stats_<name>.parquet` holds per-second statistics of every signal. `python -m src.stats_index` and the dashboard use it to find threshold crossings, fast changes and outliers, reading only the matching time windows of the exports.
+
+16. Frame Search:
+   - `python -m src.frame_search` searches a raw frame store by arbitration ID, payload bytes with wildcards and message timing (period, jitter, missing frames), using the per-ID index saved with the store.
+
+17. Static Reports:
+   - `python -m src.reports` renders a PNG or PDF page per converted log with its indicators and temperature, power and SOC plots, headless and over a process pool, with every line decimated to the plot's resolution.
+
 This structured approach ensures that only pertinent data is extracted, reducing processing time and improving clarity in the resulting dataset.
 """
 
-from typing import Dict, Iterable, List
-import can
-from asammdf import MDF, types
-import cantools
-import pandas as pd
-import numpy as np
-from rich import print, spinner
-from rich.console import Console
+import argparse
+import json
 import os
-import src.visualisation as vis
+from rich import print
+from rich.console import Console
+import pandas as pd
 import src.mf4_helpers as mf4_helpers
+import src.converter as converter
+import src.metrics as metrics
 
 console = Console()
 
 
-mf4_file = None
-while mf4_file is None:
-    text = input("Input the path to the mf4 file you would like to parse:\n")
-    if os.path.splitext(text)[1].lower() != ".mf4":
-        print("[red bold]The file path you have given is not an mf4")
-        continue
-    if not os.path.exists(text):
-        print("[red bold]The path you have given does not exist")
-        continue
-
-    mf4_file = text
+def interactive_convert(config):
+    mf4_file = None
+    while mf4_file is None:
+        text = input("Input the path to the mf4 file you would like to parse:\n")
+        if os.path.splitext(text)[1].lower() != ".mf4":
+            print("[red bold]The file path you have given is not an mf4")
+            continue
+        if not os.path.exists(text):
+            print("[red bold]The path you have given does not exist")
+            continue
 
-name_input = os.path.splitext(os.path.basename(mf4_file))[0]
+        mf4_file = text
 
-config = mf4_helpers.get_config()
-paths = config.get("paths", {})
-if type(paths) is not dict:
-    print(
-        "[yellow]⚠️Paths not setup in the settings. Using defaults. Otherwise, add a [paths] section to include."
-    )
-    paths: Dict[str, str] = {}
+    paths = mf4_helpers.get_paths(config)
 
-export_dir = paths.get("export_dir", "./processed_files/")
-os.makedirs(export_dir, exist_ok=True)
+    export_dir = paths["export_dir"]
+    os.makedirs(export_dir, exist_ok=True)
 
-dbc_database_dir = paths.get("dbcs_dir", "./DBCs/")
+    dbc_database_dir = paths["dbcs_dir"]
 
-print(f"[bold yellow]Importing all DBCs from:\n{os.path.abspath(dbc_database_dir)}")
+    print(f"[bold yellow]Importing all DBCs from:\n{os.path.abspath(dbc_database_dir)}")
 
-# with spinner.Spinner(name="spnr_dbc", text="Loading DBCs", style='aesthetic') as spinner:
-with console.status("Loading DBCs") as status:
-    dbc_files: List[types.DbcFileType] = []
-    import os
+    with console.status("Loading DBCs") as status:
+        dbcs = mf4_helpers.load_dbc_files(dbc_database_dir)
 
-    for root, dirs, files in os.walk(dbc_database_dir):
-        for file in files:
-            if file.endswith(".dbc"):
-                dbc_files.append((os.path.join(root, file), 0))
+    with console.status("Converting MF4 File:") as status:
+        outputs, df_mdf_filtered = converter.convert_file(
+            mf4_file, dbcs=dbcs, config=config, export_dir=export_dir
+        )
 
-    dbcs: Dict[types.BusType, Iterable[types.DbcFileType]] = {
-        "CAN": dbc_files,
-        "LIN": [],
-    }
+    if "metrics" in outputs:
+        with open(outputs["metrics"]) as f:
+            metrics.print_report(json.load(f))
 
+    if df_mdf_filtered is None:
+        print(
+            "[yellow]Converted in streaming mode or already up to date, "
+            "skipping the preview."
+        )
+        print(f"[green]Your files have been saved to: [bold]{export_dir}")
+        return
 
-with console.status("Loading MF4 File:") as status:
-    mdf = MDF(mf4_file)
-    df_raw_mdf = mf4_helpers.mdf_to_df(mdf, config=config)
-    mf4_helpers.mdf_to_raw_bytes(df_mf4=df_raw_mdf, config=config).to_csv(
-        os.path.join(export_dir, f"raw_bytes_{name_input}.csv")
-    )
+    print("Messages in dataframe:", df_mdf_filtered.columns)
 
-with console.status("Filtering for messages from DBCs") as status:
-    filtered_bus = mdf.extract_bus_logging(database_files=dbcs)
-    df_mdf_filtered = mf4_helpers.mdf_to_df(filtered_bus, config=config)
-    df_mdf_filtered.to_csv(os.path.join(export_dir, f"filtered_{name_input}.csv"))
+    # if input("Would you like to preview the data? <y/n> \n").lower() == 'y':
+    # vis.rich_display_dataframe(df_mdf_filtered)
+    print("[yellow]Messages in the file:")
+    first_col = df_mdf_filtered.columns[0]
+    console.print(df_mdf_filtered[pd.notna(df_mdf_filtered[first_col])].head(20))
 
+    cols = input(
+        "If you would like to generate a plot, input the column names separated by commas. e.g. voltage, current, DC_MaxCurrentHV1. Otherwise, press <enter> to skip:\n"
+    ).split(",")
+    if len(cols) >= 0 and cols[0]:
+        cols = [c.strip() for c in cols]
+        print("[green]Displaying the following columns:", cols)
+        # Matplotlib, seaborn and panel take seconds to import, so only when plotting.
+        import src.visualisation as vis
 
-print("Messages in dataframe:", df_mdf_filtered.columns)
+        fig = vis.plot_lines(sampled_df=df_mdf_filtered, interesting_cols=cols)
 
-# if input("Would you like to preview the data? <y/n> \n").lower() == 'y':
-# vis.rich_display_dataframe(df_mdf_filtered)
-print("[yellow]Messages in the file:")
-first_col = df_mdf_filtered.columns[0]
-console.print(df_mdf_filtered[pd.notna(df_mdf_filtered[first_col])].head(20))
+        if input("Save figure? <y/n>").lower() == "y":
+            path = input("Enter the path to save to:")
+            fig.savefig(path, format="png", dpi=300)
 
-cols = input(
-    "If you would like to generate a plot, input the column names separated by commas. e.g. voltage, current, DC_MaxCurrentHV1. Otherwise, press <enter> to skip:\n"
-).split(",")
-if len(cols) >= 0 and cols[0]:
-    cols = [c.strip() for c in cols]
-    print("[green]Displaying the following columns:", cols)
-    fig = vis.plot_lines(sampled_df=df_mdf_filtered, interesting_cols=cols)
+    print(f"[green]Your files have been saved to: [bold]{export_dir}")
 
-    if input("Save figure? <y/n>").lower() == "y":
-        path = input("Enter the path to save to:")
-        fig.savefig(path, format="png", dpi=300)
 
-print(f"[green]Your files have been saved to: [bold]{export_dir}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decode MF4 CAN logs with DBC files.")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Convert every mf4 file in paths.data_files without prompting.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes for --batch. Defaults to batch.workers.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Convert in bounded-memory chunks. Same as streaming.enabled = true.",
+    )
+    parser.add_argument(
+        "--redecode",
+        metavar="RAW_FRAMES_DIR",
+        default=None,
+        help="Decode a raw_frames_<name> store again with the current DBCs.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        default=None,
+        help="Only decode the signals of this profile. Same as decoding.profiles.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert again even if the manifest says the outputs are up to date.",
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=metrics.PROFILERS,
+        default=None,
+        help="Profile each conversion. Same as metrics.profiler.",
+    )
+    parser.add_argument("--config", default="./settings.toml")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = mf4_helpers.get_config(args.config)
+    if args.stream:
+        config.setdefault("streaming", {})["enabled"] = True
+    if args.profile:
+        config.setdefault("decoding", {})["profiles"] = args.profile
+    if args.force:
+        config.setdefault("manifest", {})["force"] = True
+    if args.profiler:
+        config.setdefault("metrics", {})["profiler"] = args.profiler
+    if args.redecode:
+        path = converter.redecode_store(args.redecode, config)
+        print(f"[green]Decoded {args.redecode} to: [bold]{path}")
+    elif args.batch:
+        converter.batch_convert(config, workers=args.workers)
+    else:
+        interactive_convert(config)
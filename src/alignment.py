@@ -0,0 +1,299 @@
+"""
+Aligning signals sampled at different times, and channels derived from them.
+
+Signals of a decoded log come from different messages, each with its own timestamps,
+so two signals are rarely present on the same row of an export. Multiplying two columns
+row by row, as in `voltage * current`, then only keeps the few rows where both messages
+happen to share a timestamp. Here every signal is matched as-of instead: each target
+timestamp takes the latest sample of the signal at or before it, found for all targets
+at once with `np.searchsorted`, and left out (NaN) when that sample is more than
+`tolerance` seconds old.
+
+    align(df, ["BMS_Pack_Inst_Voltage", "BMS_Pack_Current"], period=0.1)
+
+puts any set of signals on a regular grid, on given timestamps or, by default, on the
+union of their sample times.
+
+Derived channels (power, energy, efficiency, ...) are defined in the `[derived]`
+section of the settings:
+
+    [derived.channels.Battery_Power]
+    op = "product"
+    inputs = ["BMS_Pack_Inst_Voltage", "BMS_Pack_Current"]
+
+The converter computes them once with `DerivedChannels`, chunk after chunk, and stores
+them next to the decoded signals, so the dashboard, the indicators and the reports read
+them like any other signal. A derived channel has a sample at every sample time of its
+inputs. `integral` channels hold the running integral of their input, each sample
+counting until the next one as in the indicators. Derived channels can be the inputs
+of the channels defined after them.
+
+This module does not import any other module of the package, so that the converter and
+the dashboard can both import it.
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from rich import print
+
+DEFAULT_TOLERANCE_S = 1.0
+
+# op -> (number of inputs, function of the aligned inputs)
+OPS: Dict[str, Tuple[int, Optional[Callable]]] = {
+    "product": (2, np.multiply),
+    "ratio": (2, np.divide),
+    "sum": (2, np.add),
+    "difference": (2, np.subtract),
+    "integral": (1, None),
+}
+
+# (timestamps in seconds, values) of the samples of one signal
+Samples = Tuple[np.ndarray, np.ndarray]
+
+
+def get_derived_settings(config: Dict) -> Dict:
+    derived = config.get("derived", {})
+    if type(derived) is not dict:
+        print("[red]Config file has bad derived settings. Using defaults instead.")
+        derived = {}
+    channels = derived.get("channels", {})
+    if type(channels) is not dict:
+        print("[red]Config file has bad derived channels. Using none instead.")
+        channels = {}
+
+    valid = {}
+    for name, channel in channels.items():
+        op = channel.get("op") if type(channel) is dict else None
+        inputs = channel.get("inputs", []) if type(channel) is dict else []
+        if op not in OPS or len(inputs) != OPS[op][0]:
+            print(f"[red]Derived channel {name} is not valid, skipping it.")
+            continue
+        valid[name] = {
+            "op": op,
+            "inputs": [str(i) for i in inputs],
+            "scale": float(channel.get("scale", 1.0)),
+            "offset": float(channel.get("offset", 0.0)),
+        }
+    return {
+        "enabled": bool(derived.get("enabled", True)),
+        "tolerance_s": float(derived.get("tolerance_s", DEFAULT_TOLERANCE_S)),
+        "channels": valid,
+    }
+
+
+def to_seconds(values: np.ndarray) -> np.ndarray:
+    """Float seconds of an index, datetimes counting from the epoch."""
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]").astype(np.int64) / 1e9
+    return values.astype(np.float64)
+
+
+def from_seconds(seconds: np.ndarray, like: np.ndarray) -> np.ndarray:
+    """Seconds from `to_seconds` back in the dtype of the index `like` they came from."""
+    like = np.asarray(like)
+    if like.dtype.kind == "M":
+        return np.round(seconds * 1e9).astype("datetime64[ns]").astype(like.dtype)
+    return seconds
+
+
+def samples(source, name: str, seconds: Optional[np.ndarray] = None) -> Samples:
+    """
+    Timestamps and values of the samples of one signal of a DataFrame or SignalStore.
+    `seconds` is the DataFrame index as given by `to_seconds`, when already known.
+    """
+    if hasattr(source, "raw"):
+        t, v = source.raw(name)
+        return to_seconds(t), np.asarray(v, dtype=np.float64)
+    if seconds is None:
+        seconds = to_seconds(source.index.values)
+    values = pd.to_numeric(source[name], errors="coerce").to_numpy(np.float64)
+    present = ~np.isnan(values)
+    return seconds[present], values[present]
+
+
+def asof_positions(
+    targets: np.ndarray, times: np.ndarray, tolerance: Optional[float] = None
+) -> np.ndarray:
+    """
+    Position in the sorted `times` of the latest sample at or before each target, -1
+    where there is none or it is more than `tolerance` seconds older than the target.
+    """
+    positions = np.searchsorted(times, targets, side="right") - 1
+    if tolerance is not None:
+        found = positions >= 0
+        stale = np.zeros(len(positions), dtype=bool)
+        stale[found] = targets[found] - times[positions[found]] > tolerance
+        positions[stale] = -1
+    return positions
+
+
+def asof(
+    targets: np.ndarray,
+    times: np.ndarray,
+    values: np.ndarray,
+    tolerance: Optional[float] = None,
+) -> np.ndarray:
+    """Values of the sorted samples (`times`, `values`) as-of each target, else NaN."""
+    positions = asof_positions(targets, times, tolerance)
+    aligned = np.full(len(targets), np.nan)
+    found = positions >= 0
+    aligned[found] = values[positions[found]]
+    return aligned
+
+
+def grid(start: float, end: float, period: float) -> np.ndarray:
+    """Regular timestamps every `period` seconds from `start` up to `end` included."""
+    return start + np.arange(int(np.floor((end - start) / period)) + 1) * period
+
+
+def align(
+    source,
+    names: Iterable[str],
+    period: Optional[float] = None,
+    targets: Optional[np.ndarray] = None,
+    tolerance: Optional[float] = DEFAULT_TOLERANCE_S,
+    method: str = "previous",
+) -> pd.DataFrame:
+    """
+    Signals of a DataFrame or SignalStore on common timestamps: the given `targets`, a
+    grid of `period` seconds over their time range, or else the union of their samples.
+    `method` is "previous" (as-of) or "linear", interpolating between the samples
+    around each target. Targets with no sample within `tolerance` before are NaN.
+    """
+    series = {name: samples(source, name) for name in names}
+    if targets is None:
+        present = [t for t, _ in series.values() if len(t)]
+        if not present:
+            targets = np.array([], dtype=np.float64)
+        elif period:
+            start = min(t[0] for t in present)
+            end = max(t[-1] for t in present)
+            targets = grid(start, end, period)
+        else:
+            targets = np.unique(np.concatenate(present))
+    targets = np.asarray(targets, dtype=np.float64)
+
+    columns = {}
+    for name, (t, v) in series.items():
+        if method == "linear":
+            aligned = (
+                np.interp(targets, t, v) if len(t) else np.full(len(targets), np.nan)
+            )
+            aligned[asof_positions(targets, t, tolerance) < 0] = np.nan
+            # Past the last sample there is nothing to interpolate towards.
+            if len(t):
+                aligned[targets > t[-1]] = np.nan
+        else:
+            aligned = asof(targets, t, v, tolerance)
+        columns[name] = aligned
+    return pd.DataFrame(columns, index=pd.Index(targets, name="timestamps"))
+
+
+class DerivedChannels:
+    """
+    Derived channels of one log, given one chunk after the other.
+
+    `names` are the channels of `settings` whose inputs are all among `columns` (or
+    derived before them) and that are not decoded signals themselves. The last sample
+    of every input and channel is carried over to the next chunk, so a chunk starts
+    as-of the end of the previous one and integrals keep running.
+    """
+
+    def __init__(self, settings: Dict, columns: Iterable[str]):
+        self.tolerance = settings["tolerance_s"]
+        self.channels = settings["channels"] if settings["enabled"] else {}
+        known = set(columns)
+        self.names: List[str] = []
+        for name, channel in self.channels.items():
+            if name not in known and all(i in known for i in channel["inputs"]):
+                self.names.append(name)
+                known.add(name)
+        self.last: Dict[str, Tuple[float, float]] = {}
+
+    def _carried(self, name: str, t: np.ndarray, v: np.ndarray) -> Samples:
+        """The samples of a chunk, after the last one of the chunks before."""
+        last = self.last.get(name)
+        if last is None or (len(t) and t[0] <= last[0]):
+            return t, v
+        return np.concatenate([[last[0]], t]), np.concatenate([[last[1]], v])
+
+    def compute(
+        self, source, seconds: Optional[np.ndarray] = None
+    ) -> Dict[str, Samples]:
+        """Samples of every derived channel in the next chunk, a DataFrame or SignalStore."""
+        chunk: Dict[str, Samples] = {}
+
+        def get(name: str) -> Samples:
+            if name not in chunk:
+                chunk[name] = samples(source, name, seconds)
+            return chunk[name]
+
+        for name in self.names:
+            channel = self.channels[name]
+            inputs = [get(i) for i in channel["inputs"]]
+            if channel["op"] == "integral":
+                ((t, v),) = inputs
+                previous = self.last.get(channel["inputs"][0])
+                if len(t):
+                    dt = np.diff(t, prepend=t[0] if previous is None else previous[0])
+                else:
+                    dt = t
+                # The offset is the starting value, so it is only added once.
+                total = self.last[name][1] if name in self.last else channel["offset"]
+                values = total + np.cumsum(v * dt) * channel["scale"]
+            else:
+                t = np.unique(np.concatenate([t for t, _ in inputs]))
+                aligned = [
+                    asof(t, *self._carried(i, *samples_i), self.tolerance)
+                    for i, samples_i in zip(channel["inputs"], inputs)
+                ]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    values = OPS[channel["op"]][1](*aligned)
+                values = values * channel["scale"] + channel["offset"]
+                keep = np.isfinite(values)
+                t, values = t[keep], values[keep]
+            chunk[name] = (t, values)
+
+        self._remember(chunk)
+        return {name: chunk[name] for name in self.names}
+
+    def _remember(self, chunk: Dict[str, Samples]) -> None:
+        for name, (t, v) in chunk.items():
+            if len(t):
+                self.last[name] = (float(t[-1]), float(v[-1]))
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the derived channels of the next chunk to it as columns, NaN where a row has
+        no sample. Columns already there (the NaN padding of a chunk) are filled in.
+        """
+        if not self.names:
+            return df
+        seconds = to_seconds(df.index.values)
+        for name, (t, v) in self.compute(df, seconds).items():
+            column = np.full(len(df), np.nan)
+            # Every sample time is the time of a row, found back in the sorted index.
+            column[np.searchsorted(seconds, t)] = v
+            if name in df.columns:
+                df[name] = column
+            elif "date" in df.columns:
+                # Keep the date column last, as in the exports without derived channels.
+                df.insert(df.columns.get_loc("date"), name, column)
+            else:
+                df[name] = column
+        return df
+
+    def observe(self, df: pd.DataFrame) -> None:
+        """Carry on from a chunk whose channels were derived before, such as a saved segment."""
+        if not self.names:
+            return
+        seconds = to_seconds(df.index.values)
+        wanted = set(self.names).union(
+            *(self.channels[n]["inputs"] for n in self.names)
+        )
+        self._remember(
+            {name: samples(df, name, seconds) for name in wanted if name in df.columns}
+        )
@@ -0,0 +1,316 @@
+"""
+Reproducible benchmark of the conversion pipeline and the dashboard.
+
+A synthetic log is generated with `src.synthetic` (or an existing MF4 and DBC folder is
+used) and every stage of the pipeline is timed on its own:
+
+    dbc_load            parse the DBCs (cantools, for the NumPy decoder)
+    mdf_load            MDF(...)
+    mdf_to_df           raw frames to a dataframe
+    mdf_to_raw_bytes    format the payloads as hex strings
+    extract_bus_logging decode with asammdf, as `convert_file` does by default
+    decode_numpy        decode with `src.decoder`
+    export              write the decoded table in `export_settings.file_format`
+    get_indicators      the dashboard indicator cards
+    plots               build and render the dashboard plots with bokeh
+
+For each stage the wall and CPU time, the throughput in frames per second and the peak
+resident memory are written to a JSON report. Generated logs are kept under
+`paths.cache_dir`, so runs with the same arguments measure the same file. Compare two
+reports with `--compare`:
+
+    python -m src.benchmark --duration 600 --rate 2000 --out before.json
+    python -m src.benchmark --duration 600 --rate 2000 --out after.json --compare before.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from asammdf import MDF
+from rich import print
+from rich.table import Table
+
+import src.dbc_cache as dbc_cache
+import src.decoder as decoder
+import src.exporters as exporters
+import src.metrics as metrics
+import src.mf4_helpers as mf4_helpers
+import src.synthetic as synthetic
+
+STAGES = (
+    "dbc_load",
+    "mdf_load",
+    "mdf_to_df",
+    "mdf_to_raw_bytes",
+    "extract_bus_logging",
+    "decode_numpy",
+    "export",
+    "get_indicators",
+    "plots",
+)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict:
+    import asammdf
+    import numpy
+    import pandas
+    import pyarrow
+
+    return {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "asammdf": asammdf.__version__,
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "pyarrow": pyarrow.__version__,
+    }
+
+
+def synthetic_log(cache_dir: str, **params) -> Dict:
+    """Generate a synthetic log, or reuse the one generated with the same parameters."""
+    key = hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    out_dir = os.path.join(cache_dir, "benchmark", key)
+    info_path = os.path.join(out_dir, "info.json")
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            return json.load(f)
+    print(f"[yellow]Generating a synthetic log in: {out_dir}")
+    info = synthetic.generate(out_dir, **params)
+    with open(info_path, "w") as f:
+        json.dump(info, f, indent=2)
+    return info
+
+
+def _dashboard_modules():
+    """
+    The dashboard imports its modules from `src/` directly (`panel serve src/webapp.py`),
+    so they are imported the same way here.
+    """
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    if src_dir not in sys.path:
+        sys.path.insert(0, src_dir)
+    import hvplot.pandas  # registers .hvplot on pandas objects, as in webapp.py
+    import utils
+    import visualisation
+
+    return utils, visualisation
+
+
+def run_benchmark(
+    mf4_file: str,
+    dbcs_dir: str,
+    config: Dict,
+    frames: Optional[int] = None,
+    stages: Optional[List[str]] = None,
+) -> Dict:
+    """Time every stage of `STAGES` (or only `stages`) on one log."""
+    stages = list(stages or STAGES)
+    if frames is None:
+        mdf = MDF(mf4_file)
+        frames = sum(
+            mdf.groups[g].channel_group.cycles_nr
+            for g in mf4_helpers.can_data_groups(mdf)
+        )
+        mdf.close()
+    timer = metrics.Metrics("benchmark")
+    export_format = exporters.get_file_format(config)
+    dbcs = mf4_helpers.load_dbc_files(dbcs_dir)
+    results = {}
+
+    def run(name: str, step: Callable):
+        if name in stages:
+            with timer.stage(name, frames=frames):
+                results[name] = step()
+        elif name in ("mdf_load", "decode_numpy", "dbc_load"):
+            # Later stages need these even when they are not measured.
+            results[name] = step()
+
+    # Parse the DBCs without the persistent cache, to time the parsing itself.
+    run(
+        "dbc_load",
+        lambda: decoder.message_lookup(decoder.compile_dbc_files(dbcs, cache=None)),
+    )
+    run("mdf_load", lambda: MDF(mf4_file))
+    mdf = results["mdf_load"]
+    try:
+        run("mdf_to_df", lambda: mf4_helpers.mdf_to_df(mdf, config=config))
+        if "mdf_to_df" in results:
+            run(
+                "mdf_to_raw_bytes",
+                lambda: mf4_helpers.mdf_to_raw_bytes(results["mdf_to_df"], config),
+            )
+        results.pop("mdf_to_df", None)
+        results.pop("mdf_to_raw_bytes", None)
+
+        def extract():
+            filtered = mdf.extract_bus_logging(
+                database_files=dbc_cache.canmatrix_dbcs(dbcs, None)
+            )
+            df = mf4_helpers.mdf_to_df(filtered, config=config)
+            filtered.close()
+            return df
+
+        run("extract_bus_logging", extract)
+        results.pop("extract_bus_logging", None)
+        run(
+            "decode_numpy",
+            lambda: decoder.decode_mdf(mdf, results["dbc_load"], config=config),
+        )
+    finally:
+        mdf.close()
+    df = results["decode_numpy"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"filtered{export_format['file_format']}")
+        run(
+            "export",
+            lambda: exporters.write_table(
+                df, path, compression=export_format["compression"]
+            ),
+        )
+        if "export" in stages:
+            timer.count("export", bytes_written=os.path.getsize(path))
+
+    if "get_indicators" in stages or "plots" in stages:
+        utils, vis = _dashboard_modules()
+        run("get_indicators", lambda: utils.get_indicators(df))
+
+        def plots():
+            import holoviews as hv
+
+            figures = [
+                vis.plot_temperatures(df),
+                vis.power_plot(df, "BMS_Pack_Inst_Voltage", "BMS_Pack_Current"),
+                vis.battery_soc_plot(df),
+            ]
+            # Rendering runs the decimation callbacks of the dynamic plots.
+            return [hv.render(figure, backend="bokeh") for figure in figures]
+
+        run("plots", plots)
+
+    measured = timer.to_dict()["stages"]
+    return {
+        "frames": frames,
+        "signals": len(df.columns.drop("date", errors="ignore")),
+        "stages": measured,
+        "total_wall_s": round(sum(s["wall_s"] for s in measured.values()), 6),
+        "peak_rss_mb": max((s["peak_rss_mb"] for s in measured.values()), default=0.0),
+    }
+
+
+def compare(report: Dict, baseline: Dict) -> None:
+    """Print the stage timings of a report next to those of a baseline report."""
+    table = Table(title="Benchmark vs baseline")
+    for column in ("Stage", "Baseline (s)", "Now (s)", "Speed-up", "Peak RSS (MB)"):
+        table.add_column(column, justify="left" if column == "Stage" else "right")
+    for name, stage in report["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None or not stage["wall_s"]:
+            table.add_row(name, "-", f"{stage['wall_s']:.3f}", "-", "-")
+            continue
+        speedup = before["wall_s"] / stage["wall_s"]
+        colour = "green" if speedup >= 1.05 else "red" if speedup <= 0.95 else "white"
+        table.add_row(
+            name,
+            f"{before['wall_s']:.3f}",
+            f"{stage['wall_s']:.3f}",
+            f"[{colour}]{speedup:.2f}x",
+            f"{before['peak_rss_mb']:.0f} → {stage['peak_rss_mb']:.0f}",
+        )
+    print(table)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion pipeline.")
+    parser.add_argument("--config", default="./settings.toml")
+    parser.add_argument(
+        "--mf4", default=None, help="Benchmark this log instead of a synthetic one."
+    )
+    parser.add_argument("--dbcs", default=None, help="DBC folder for --mf4.")
+    parser.add_argument("--duration", type=float, default=600, help="Seconds.")
+    parser.add_argument("--rate", type=float, default=2000, help="Frames per second.")
+    parser.add_argument("--messages", type=int, default=40, help="Filler messages.")
+    parser.add_argument("--extended", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", default=None, help="Comma separated stages.")
+    parser.add_argument("--out", default="benchmark.json")
+    parser.add_argument("--compare", default=None, help="Baseline report to compare.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = mf4_helpers.get_config(args.config) if os.path.exists(args.config) else {}
+
+    if args.mf4:
+        dbcs_dir = args.dbcs or mf4_helpers.get_paths(config)["dbcs_dir"]
+        log = {"mf4_file": args.mf4, "dbcs_dir": dbcs_dir}
+        frames = None
+    else:
+        log = synthetic_log(
+            mf4_helpers.get_paths(config)["cache_dir"],
+            duration=args.duration,
+            frames_per_s=args.rate,
+            n_messages=args.messages,
+            extended_fraction=args.extended,
+            seed=args.seed,
+        )
+        dbcs_dir = os.path.dirname(log["dbc_file"])
+        frames = log["frames"]
+
+    result = run_benchmark(
+        log["mf4_file"],
+        dbcs_dir,
+        config,
+        frames=frames,
+        stages=args.stages.split(",") if args.stages else None,
+    )
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "log": log,
+        **result,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+
+    table = Table(title=f"{result['frames']:,} frames")
+    for column in ("Stage", "Wall (s)", "CPU (s)", "Frames/s", "Peak RSS (MB)"):
+        table.add_column(column, justify="left" if column == "Stage" else "right")
+    for name, stage in result["stages"].items():
+        table.add_row(
+            name,
+            f"{stage['wall_s']:.3f}",
+            f"{stage['cpu_s']:.3f}",
+            f"{stage['frames_per_s']:,.0f}",
+            f"{stage['peak_rss_mb']:.0f}",
+        )
+    print(table)
+    print(f"[green]Report saved to: [bold]{args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
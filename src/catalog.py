@@ -0,0 +1,256 @@
+"""
+SQLite catalog of the converted logs.
+
+Every conversion adds (or replaces) one entry in `<export_dir>/catalog.sqlite` with:
+
+- the source MF4, the vehicle (the folder the log was found in under `data_files`) and
+  the exports written for it,
+- the recording start time and the time span of the decoded signals,
+- every decoded signal with its number of samples,
+- the dashboard indicators, both as sortable columns and as the saved
+  `IndicatorAccumulator` state so that fleet totals can be merged exactly.
+
+The dashboard lists, filters and sorts the logs and shows fleet totals from this index
+alone, without opening any export. SQLite in WAL mode lets the batch workers add their
+entries concurrently.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import pandas as pd
+from rich import print
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    vehicle TEXT NOT NULL DEFAULT '',
+    source_file TEXT NOT NULL,
+    export_file TEXT NOT NULL UNIQUE,
+    start_time TEXT,
+    t_start REAL,
+    t_end REAL,
+    runtime_s REAL,
+    consumed_kwh REAL,
+    generated_kwh REAL,
+    distance_km REAL,
+    n_signals INTEGER,
+    n_samples INTEGER,
+    indicators TEXT,
+    converted_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_vehicle ON logs (vehicle, start_time);
+CREATE TABLE IF NOT EXISTS signals (
+    log_id INTEGER NOT NULL REFERENCES logs (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    samples INTEGER NOT NULL,
+    PRIMARY KEY (log_id, name)
+);
+CREATE INDEX IF NOT EXISTS signals_name ON signals (name);
+"""
+
+SORT_COLUMNS = (
+    "start_time",
+    "name",
+    "vehicle",
+    "runtime_s",
+    "consumed_kwh",
+    "generated_kwh",
+    "distance_km",
+    "n_signals",
+    "n_samples",
+    "converted_at",
+)
+
+
+def get_catalog_settings(config: Dict, export_dir: str) -> Dict:
+    catalog = config.get("catalog", {})
+    if type(catalog) is not dict:
+        print("[red]Config file has bad catalog settings. Using defaults instead.")
+        catalog = {}
+    return {
+        "enabled": bool(catalog.get("enabled", True)),
+        "path": os.path.join(export_dir, catalog.get("file", "catalog.sqlite")),
+    }
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path, timeout=60)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def vehicle_for(mf4_file: str, data_dir: str) -> str:
+    """First folder of the log's path under `data_dir`, or its parent folder's name."""
+    folder = os.path.dirname(os.path.abspath(mf4_file))
+    relative = os.path.relpath(folder, os.path.abspath(data_dir))
+    if relative == ".":
+        return ""
+    if relative.startswith(".."):
+        return os.path.basename(folder)
+    return relative.split(os.sep)[0]
+
+
+def record_log(
+    path: str,
+    mf4_file: str,
+    export_file: str,
+    vehicle: str,
+    start_time: Optional[datetime],
+    signal_counts: Dict[str, int],
+    accumulator=None,
+) -> int:
+    """Add or replace the catalog entry of one converted log. Returns its id."""
+    results = accumulator.results() if accumulator is not None else {}
+    row = {
+        "name": os.path.splitext(os.path.basename(mf4_file))[0],
+        "vehicle": vehicle,
+        "source_file": os.path.abspath(mf4_file),
+        "export_file": os.path.abspath(export_file),
+        "start_time": start_time.isoformat() if start_time is not None else None,
+        "t_start": getattr(accumulator, "start", None),
+        "t_end": getattr(accumulator, "end", None),
+        "runtime_s": results.get("runtime_s"),
+        "consumed_kwh": results.get("consumed_kwh"),
+        "generated_kwh": results.get("generated_kwh"),
+        "distance_km": results.get("distance_km"),
+        "n_signals": sum(1 for n in signal_counts.values() if n),
+        "n_samples": int(sum(signal_counts.values())),
+        "indicators": (
+            json.dumps(accumulator.to_dict()) if accumulator is not None else None
+        ),
+        "converted_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    # NaN (no samples) is stored as NULL.
+    row = {k: None if isinstance(v, float) and v != v else v for k, v in row.items()}
+
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute(
+                "DELETE FROM logs WHERE export_file = ?", (row["export_file"],)
+            )
+            cursor = connection.execute(
+                f"INSERT INTO logs ({', '.join(row)}) "
+                f"VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values()),
+            )
+            log_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO signals (log_id, name, samples) VALUES (?, ?, ?)",
+                [(log_id, name, int(n)) for name, n in signal_counts.items() if n],
+            )
+    finally:
+        connection.close()
+    return log_id
+
+
+def _where(
+    vehicle: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    signal: Optional[str] = None,
+    search: Optional[str] = None,
+):
+    clauses, params = [], []
+    if vehicle:
+        clauses.append("vehicle = ?")
+        params.append(vehicle)
+    if since:
+        clauses.append("start_time >= ?")
+        params.append(since)
+    if until:
+        clauses.append("start_time <= ?")
+        params.append(until)
+    if signal:
+        clauses.append(
+            "id IN (SELECT log_id FROM signals WHERE name = ? AND samples > 0)"
+        )
+        params.append(signal)
+    if search:
+        clauses.append("name LIKE ?")
+        params.append(f"%{search}%")
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def list_logs(
+    path: str,
+    order_by: str = "start_time",
+    descending: bool = True,
+    limit: Optional[int] = None,
+    **filters,
+) -> pd.DataFrame:
+    """
+    Catalog entries as a table, filtered by `vehicle`, `since`/`until` (ISO start times),
+    `signal` (logs holding that signal) or `search` (part of the log name).
+    """
+    if order_by not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort the catalog by '{order_by}'")
+    where, params = _where(**filters)
+    query = (
+        "SELECT id, name, vehicle, start_time, runtime_s, consumed_kwh, generated_kwh, "
+        "distance_km, n_signals, n_samples, export_file, source_file FROM logs"
+        f"{where} ORDER BY {order_by} {'DESC' if descending else 'ASC'}"
+    )
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    connection = connect(path)
+    try:
+        return pd.read_sql_query(query, connection, params=params, index_col="id")
+    finally:
+        connection.close()
+
+
+def vehicles(path: str) -> List[str]:
+    connection = connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT DISTINCT vehicle FROM logs ORDER BY vehicle"
+        ).fetchall()
+    finally:
+        connection.close()
+    return [r[0] for r in rows]
+
+
+def signal_names(path: str) -> List[str]:
+    connection = connect(path)
+    try:
+        rows = connection.execute(
+            "SELECT DISTINCT name FROM signals ORDER BY name"
+        ).fetchall()
+    finally:
+        connection.close()
+    return [r[0] for r in rows]
+
+
+def log_signals(path: str, log_id: int) -> pd.DataFrame:
+    connection = connect(path)
+    try:
+        return pd.read_sql_query(
+            "SELECT name, samples FROM signals WHERE log_id = ? ORDER BY name",
+            connection,
+            params=(log_id,),
+        )
+    finally:
+        connection.close()
+
+
+def indicator_states(path: str, **filters) -> List[Dict]:
+    """
+    Saved `IndicatorAccumulator` states of the matching logs, to be merged into fleet
+    totals with `IndicatorAccumulator.from_dict(...).merge(...)`.
+    """
+    where, params = _where(**filters)
+    where += " AND indicators IS NOT NULL" if where else " WHERE indicators IS NOT NULL"
+    connection = connect(path)
+    try:
+        rows = connection.execute(f"SELECT indicators FROM logs{where}", params)
+        return [json.loads(state) for (state,) in rows.fetchall()]
+    finally:
+        connection.close()
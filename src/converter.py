@@ -0,0 +1,454 @@
+"""
+Conversion of recorded MF4 logs into export files.
+
+`convert_file` runs the whole pipeline for one log: load the MF4, export the raw bytes,
+decode the messages with the DBCs and export the decoded signals.
+`batch_convert` does the same for every log under `paths.data_files`, fanning the files
+out over a process pool so that a night's worth of fleet logs uses every core.
+"""
+
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+from asammdf import MDF, types
+from rich import print
+from rich.console import Console
+from rich.progress import Progress
+from rich.table import Table
+
+import src.alignment as alignment
+import src.dbc_cache as dbc_cache
+import src.decoder as decoder
+import src.exporters as exporters
+import src.indicators as indicators
+import src.manifest as manifest
+import src.metrics as metrics
+import src.mf4_helpers as mf4_helpers
+import src.parallel_decode as parallel_decode
+import src.pipeline as pipeline
+import src.profiles as profiles
+import src.pyramid as pyramid
+import src.raw_store as raw_store
+import src.stats_index as stats_index
+import src.streaming as streaming
+
+console = Console()
+
+DbcMapping = Dict[types.BusType, Iterable[types.DbcFileType]]
+
+
+def convert_file(
+    mf4_file: str, dbcs: DbcMapping, config: Dict, export_dir: str
+) -> Tuple[Dict[str, str], Optional[pd.DataFrame]]:
+    """
+    Convert a single MF4 log.
+
+    Returns the paths of the files that were written and the decoded dataframe.
+    With `streaming.enabled` the log is converted chunk by chunk and no dataframe is
+    kept, so `None` is returned in its place. With `metrics.enabled` the time, memory
+    and counts of each stage are saved to `metrics_<name>.json` next to the exports.
+
+    Only the outputs whose inputs changed since the last conversion are written again
+    (see `src.manifest`). When every output is up to date nothing is done and `None`
+    is returned in place of the dataframe as well.
+    """
+    name_input = os.path.splitext(os.path.basename(mf4_file))[0]
+    log_manifest = manifest.Manifest(mf4_file, dbcs, config, export_dir)
+    if log_manifest.up_to_date():
+        # Saved again to record that nothing was redone, and the log's latest mtime.
+        outputs = dict(log_manifest.outputs)
+        outputs["manifest"] = log_manifest.save(outputs, redone=())
+        return outputs, None
+    log_manifest.invalidate()
+
+    metrics_settings = metrics.get_metrics_settings(config)
+    run_metrics = metrics.Metrics(name_input, sample_memory=metrics_settings["enabled"])
+    profiler = metrics_settings["profiler"]
+    profile_file = profiler and metrics.profile_path(export_dir, name_input, profiler)
+
+    df_mdf_filtered = None
+    with metrics.profiled(profiler, profile_file):
+        if streaming.get_streaming_settings(config)["enabled"]:
+            outputs = streaming.stream_convert_file(
+                mf4_file,
+                dbcs=dbcs,
+                config=config,
+                export_dir=export_dir,
+                run_metrics=run_metrics,
+                log_manifest=log_manifest,
+            )
+        else:
+            outputs, df_mdf_filtered = _convert_in_memory(
+                mf4_file, dbcs, config, export_dir, run_metrics, log_manifest
+            )
+    run_metrics.finish()
+
+    if metrics_settings["enabled"]:
+        for stage, path in outputs.items():
+            run_metrics.count(stage, bytes_written=metrics.path_bytes(path))
+    redone = set(outputs)
+    outputs = dict(log_manifest.outputs, **outputs)
+    if log_manifest.settings["enabled"]:
+        outputs["manifest"] = log_manifest.save(outputs, redone)
+    if metrics_settings["enabled"]:
+        outputs["metrics"] = run_metrics.save(
+            metrics.metrics_path(export_dir, name_input)
+        )
+    if profile_file:
+        outputs["profile"] = profile_file
+    return outputs, df_mdf_filtered
+
+
+def _convert_in_memory(
+    mf4_file: str,
+    dbcs: DbcMapping,
+    config: Dict,
+    export_dir: str,
+    run_metrics: metrics.Metrics,
+    log_manifest: manifest.Manifest,
+) -> Tuple[Dict[str, str], Optional[pd.DataFrame]]:
+    """
+    Load the whole log and decode it at once, redoing only the stages in
+    `log_manifest.todo`. Each stage is timed under the key of the output it writes, so
+    the bytes written can be added to it afterwards.
+
+    The exports are formatted and written on a pipeline thread, so the raw bytes are
+    written while the log is decoded, and the decoded export while the indicators and
+    pyramid are computed.
+    """
+    todo = log_manifest.todo
+    outputs = {stage: log_manifest.outputs[stage] for stage in todo}
+    export_format = exporters.get_file_format(config)
+
+    with run_metrics.stage("mf4_load"):
+        if todo & set(manifest.SOURCE_STAGES):
+            mdf = MDF(mf4_file)
+        else:
+            # Only the start time is needed when the log itself is not read again.
+            mdf = MDF(mf4_file, process_bus_logging=False)
+    df_mdf_filtered = None
+
+    def write_export(export) -> None:
+        stage, df = export
+        counts = {"frames": frames} if stage == "raw_bytes" else {}
+        with run_metrics.stage(stage, **counts):
+            if stage == "raw_bytes":
+                df = mf4_helpers.mdf_to_raw_bytes(df_mf4=df, config=config)
+            exporters.write_table(
+                df, outputs[stage], compression=export_format["compression"]
+            )
+
+    parallel = None
+    exports = pipeline.Pipeline(pipeline.get_pipeline_settings(config)["depth"])
+    exports.stage("write", write_export)
+    try:
+        if "filtered" in todo:
+            cache = dbc_cache.open_cache(config)
+            patterns = profiles.active_patterns(config)
+            decoding = decoder.get_decoding_settings(config)
+            with run_metrics.stage("dbc_load"):
+                if decoding["engine"] == "numpy":
+                    lookup = decoder.message_lookup(
+                        decoder.compile_dbc_files(dbcs, cache)
+                    )
+                    lookup = profiles.narrow_lookup(lookup, patterns)
+                else:
+                    databases = profiles.narrow_dbcs(
+                        dbc_cache.canmatrix_dbcs(dbcs, cache), patterns
+                    )
+            if decoding["engine"] == "numpy":
+                # Started before the export thread, so the workers are not forked
+                # while it writes.
+                parallel = parallel_decode.ParallelDecoder(
+                    decoder.decode_frames, lookup, decoding["workers"]
+                )
+
+        with exports:
+            frames = sum(
+                mdf.groups[group].channel_group.cycles_nr
+                for group in mf4_helpers.can_data_groups(mdf)
+            )
+            if "raw_bytes" in todo:
+                with run_metrics.stage("read", frames=frames):
+                    df_raw_mdf = mf4_helpers.mdf_to_df(mdf, config=config)
+                exports.put(("raw_bytes", df_raw_mdf))
+                del df_raw_mdf
+
+            if "raw_frames" in todo:
+                with run_metrics.stage("raw_frames", frames=frames):
+                    raw_store.write_store(
+                        mdf,
+                        outputs["raw_frames"],
+                        source=mf4_file,
+                        chunk_records=streaming.get_streaming_settings(config)[
+                            "chunk_records"
+                        ],
+                    )
+
+            if "filtered" in todo:
+                if parallel is not None:
+                    with run_metrics.stage("decode", frames=frames):
+                        df_mdf_filtered = decoder.decode_mdf(
+                            mdf, lookup, config=config, decode=parallel.decode
+                        )
+                else:
+                    with run_metrics.stage("decode", frames=frames):
+                        filtered_bus = mdf.extract_bus_logging(database_files=databases)
+                        df_mdf_filtered = mf4_helpers.mdf_to_df(
+                            filtered_bus, config=config
+                        )
+                        filtered_bus.close()
+                derived = alignment.DerivedChannels(
+                    alignment.get_derived_settings(config), df_mdf_filtered.columns
+                )
+                if derived.names:
+                    with run_metrics.stage("derived"):
+                        derived.apply(df_mdf_filtered)
+                signals = len(df_mdf_filtered.columns.drop("date", errors="ignore"))
+                run_metrics.count("decode", signals=signals)
+                run_metrics.count("filtered", signals=signals)
+                # Written while the indicators and pyramid read it. The shallow copy
+                # gives the writer its own block manager over the same arrays, so
+                # pandas never rearranges the blocks under the other thread.
+                exports.put(("filtered", df_mdf_filtered.copy(deep=False)))
+            elif todo & set(manifest.DERIVED_STAGES):
+                # Only the indicators or the pyramid changed, rebuild them from the export.
+                with run_metrics.stage("read_filtered"):
+                    df_mdf_filtered = exporters.read_table(
+                        log_manifest.outputs["filtered"]
+                    )
+
+            accumulator = None
+            if "indicators" in todo:
+                with run_metrics.stage("indicators"):
+                    accumulator = indicators.accumulator_from_settings(
+                        indicators.get_indicator_settings(config)
+                    )
+                    accumulator.update(df_mdf_filtered).save(outputs["indicators"])
+            if "filtered" in todo or "indicators" in todo:
+                with run_metrics.stage("catalog"):
+                    streaming.record_conversion(
+                        config,
+                        export_dir,
+                        mf4_file,
+                        log_manifest.outputs["filtered"],
+                        start_time=mdf.start_time,
+                        signal_counts=df_mdf_filtered.select_dtypes("number").count(),
+                        accumulator=accumulator,
+                    )
+
+            if "lod" in todo:
+                with run_metrics.stage("lod"):
+                    pyramid.build_pyramid(
+                        df_mdf_filtered,
+                        outputs["lod"],
+                        pyramid.get_pyramid_settings(config),
+                    )
+            if "stats" in todo:
+                with run_metrics.stage("stats"):
+                    stats_index.build_stats_index(
+                        df_mdf_filtered,
+                        outputs["stats"],
+                        stats_index.get_stats_settings(config),
+                        export_file=log_manifest.outputs["filtered"],
+                    )
+    finally:
+        mdf.close()
+        if parallel is not None:
+            parallel.close()
+
+    return outputs, df_mdf_filtered
+
+
+def redecode_store(store_dir: str, config: Dict) -> str:
+    """
+    Decode a raw frame store again with the DBCs currently in `paths.dbcs_dir` and write
+    a new filtered export next to it.
+    """
+    paths = mf4_helpers.get_paths(config)
+    dbcs = mf4_helpers.load_dbc_files(paths["dbcs_dir"])
+    name = os.path.basename(os.path.normpath(store_dir)).removeprefix("raw_frames_")
+    export_format = exporters.get_file_format(config)
+    export_dir = os.path.dirname(os.path.normpath(store_dir))
+    return raw_store.decode_store(
+        store_dir,
+        dbcs=dbcs,
+        config=config,
+        export_path=exporters.export_path(
+            export_dir, "filtered", name, export_format["file_format"]
+        ),
+    )
+
+
+def _convert_job(mf4_file: str, dbcs: DbcMapping, config: Dict, export_dir: str):
+    """
+    Worker entry point for the batch mode. Never raises, so that one broken log does not
+    take the rest of the batch down with it. Only the small report is sent back to the
+    parent process, not the dataframe.
+    """
+    start = time.perf_counter()
+    report = {"file": mf4_file, "status": "ok", "outputs": {}, "error": None}
+    try:
+        report["outputs"], _ = convert_file(
+            mf4_file, dbcs=dbcs, config=config, export_dir=export_dir
+        )
+        if "manifest" in report["outputs"]:
+            with open(report["outputs"]["manifest"]) as f:
+                report["redone"] = json.load(f)["redone"]
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = f"{type(e).__name__}: {e}"
+        report["traceback"] = traceback.format_exc()
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def warm_dbc_cache(dbcs: DbcMapping, config: Dict) -> None:
+    """
+    Parse any new or changed DBCs once in the parent, so the workers all load them from
+    the cache instead of each parsing them again.
+    """
+    cache = dbc_cache.open_cache(config)
+    if cache is None:
+        return
+    dbc_cache.prune(cache, dbcs)
+    if decoder.get_decoding_settings(config)["engine"] == "numpy":
+        decoder.compile_dbc_files(dbcs, cache)
+    elif streaming.get_streaming_settings(config)["enabled"]:
+        streaming.load_can_databases(dbcs, cache)
+    else:
+        dbc_cache.canmatrix_dbcs(dbcs, cache)
+    cache.close()
+
+
+def get_batch_settings(config: Dict) -> Dict:
+    batch = config.get("batch", {})
+    if type(batch) is not dict:
+        print("[red]Config file has bad batch settings. Using defaults instead.")
+        batch = {}
+    workers = batch.get("workers", 0)
+    return {
+        "workers": int(workers) if workers else (os.cpu_count() or 1),
+        "report_file": batch.get("report_file", "batch_report.json"),
+    }
+
+
+def print_batch_summary(reports: List[Dict]) -> None:
+    table = Table(title="Batch conversion")
+    table.add_column("File")
+    table.add_column("Status")
+    table.add_column("Time (s)", justify="right")
+    table.add_column("Error")
+    for report in reports:
+        if report["status"] != "ok":
+            status = "[red]failed"
+        elif report.get("redone") == []:
+            status = "[dim]up to date"
+        else:
+            status = "[green]ok"
+        table.add_row(
+            os.path.basename(report["file"]),
+            status,
+            f"{report['seconds']:.1f}",
+            report["error"] or "",
+        )
+    console.print(table)
+
+
+def print_fleet_totals(reports: List[Dict], config: Dict) -> None:
+    """Sum the indicators saved for every converted log, without reading the exports."""
+    states = []
+    for report in reports:
+        path = report["outputs"].get("indicators")
+        if report["status"] == "ok" and path is not None:
+            with open(path) as f:
+                states.append(json.load(f))
+    fleet = indicators.merge_states(states)
+    if fleet is None:
+        return
+
+    settings = indicators.get_indicator_settings(config)
+    results = fleet.results(diesel_cost_per_litre=settings["diesel_cost_per_litre"])
+    table = Table(title=f"Fleet totals ({fleet.logs} logs)")
+    table.add_column("Indicator")
+    table.add_column("Total", justify="right")
+    table.add_row("Runtime (h)", f"{results['runtime_s'] / 3600:,.2f}")
+    table.add_row("Power Consumed (kWh)", f"{results['consumed_kwh']:,.3f}")
+    table.add_row("Power Generated (kWh)", f"{results['generated_kwh']:,.6f}")
+    table.add_row("Distance Travelled (km)", f"{results['distance_km']:,.2f}")
+    table.add_row("CO2 Emmisions Saved (kg)", f"{results['co2_saved_kg']:,.2f}")
+    table.add_row("Diesel Cost Saved (chf)", f"{results['diesel_cost_saved']:,.2f}")
+    console.print(table)
+
+
+def batch_convert(
+    config: Dict, workers: Optional[int] = None, files: Optional[List[str]] = None
+) -> List[Dict]:
+    """
+    Convert every MF4 file under `paths.data_files` without any prompts.
+
+    The DBC list is loaded once in the parent and handed to each worker. Every file
+    gets its own line in the progress output and its own entry in the JSON report
+    that is written to the export directory.
+    """
+    paths = mf4_helpers.get_paths(config)
+    batch_settings = get_batch_settings(config)
+    workers = workers or batch_settings["workers"]
+
+    export_dir = paths["export_dir"]
+    os.makedirs(export_dir, exist_ok=True)
+
+    if files is None:
+        files = mf4_helpers.find_mf4_files(paths["data_files"])
+    if not files:
+        print(f"[yellow]No mf4 files found in: [bold]{paths['data_files']}")
+        return []
+
+    with console.status("Loading DBCs"):
+        dbcs = mf4_helpers.load_dbc_files(paths["dbcs_dir"])
+        warm_dbc_cache(dbcs, config)
+    print(
+        f"[bold yellow]Converting {len(files)} files with {workers} workers "
+        f"using {len(dbcs['CAN'])} DBCs"
+    )
+
+    reports = []
+    with Progress(console=console) as progress, ProcessPoolExecutor(
+        max_workers=workers
+    ) as pool:
+        task = progress.add_task("Converting", total=len(files))
+        futures = {
+            pool.submit(_convert_job, f, dbcs, config, export_dir): f for f in files
+        }
+        for future in as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            if report["status"] == "ok":
+                progress.console.print(
+                    f"[green]✅ {report['file']} ({report['seconds']:.1f}s)"
+                )
+            else:
+                progress.console.print(
+                    f"[red bold]❌ {report['file']}: {report['error']}"
+                )
+            progress.advance(task)
+
+    reports.sort(key=lambda r: r["file"])
+    report_path = os.path.join(export_dir, batch_settings["report_file"])
+    with open(report_path, "w") as f:
+        json.dump(reports, f, indent=2)
+
+    print_batch_summary(reports)
+    print_fleet_totals(reports, config)
+    n_failed = sum(r["status"] != "ok" for r in reports)
+    colour = "red" if n_failed else "green"
+    print(
+        f"[{colour}]{len(reports) - n_failed}/{len(reports)} files converted. "
+        f"Report saved to: [bold]{report_path}"
+    )
+    return reports
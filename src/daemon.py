@@ -0,0 +1,301 @@
+"""
+Warm conversion daemon.
+
+A fresh `mf4_to_csv.py` run spends seconds importing asammdf, pandas and cantools and
+loading every DBC before it converts anything. The daemon pays for that once. It imports
+the converter, keeps the parsed DBCs in memory (`dbc_cache.keep_resident`) and then
+converts the jobs it is sent, one after the other, with the same `convert_file` as the
+batch mode.
+
+Jobs come in two ways:
+
+- over a Unix socket (`daemon.socket`, by default `converter.sock` in `paths.cache_dir`),
+  from the thin client below, which only imports the standard library:
+
+      python -m src.daemon serve
+      python -m src.daemon submit path/to/log.mf4 --wait
+      python -m src.daemon status
+      python -m src.daemon stop
+
+- from a watched folder (`daemon.watch_dir`). Every MF4 file that appears in it is
+  converted once its size has stopped changing between two polls, so files still being
+  copied are left alone. Files whose filtered export is newer than the log are skipped.
+
+The socket speaks one JSON object per line: a request such as
+`{"action": "convert", "files": [...], "wait": true}`, then one reply.
+The daemon reads `settings.toml` once at start, so restart it after changing the
+settings. DBC edits are picked up without a restart.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import tomllib
+from typing import Dict, List, Optional
+
+
+def get_daemon_settings(config: Dict) -> Dict:
+    daemon = config.get("daemon", {})
+    if type(daemon) is not dict:
+        print("Config file has bad daemon settings. Using defaults instead.")
+        daemon = {}
+    paths = config.get("paths", {}) if type(config.get("paths")) is dict else {}
+    return {
+        "socket": daemon.get("socket")
+        or os.path.join(paths.get("cache_dir", "./.cache/"), "converter.sock"),
+        "watch_dir": daemon.get("watch_dir") or None,
+        "poll_s": float(daemon.get("poll_s", 2.0)),
+    }
+
+
+class Job:
+    def __init__(self, job_id: int, files: List[str], export_dir: str):
+        self.id = job_id
+        self.files = files
+        self.export_dir = export_dir
+        self.reports: List[Dict] = []
+        self.done = threading.Event()
+
+
+class ConversionDaemon:
+    """Converts queued jobs on one worker thread with the DBCs kept in memory."""
+
+    def __init__(self, config: Dict):
+        # The heavy imports happen here, once, and not in the client.
+        import src.converter as converter
+        import src.dbc_cache as dbc_cache
+        import src.exporters as exporters
+        import src.mf4_helpers as mf4_helpers
+        from rich import print
+
+        self.print = print
+        self.converter = converter
+        self.exporters = exporters
+        self.mf4_helpers = mf4_helpers
+        self.config = config
+        self.settings = get_daemon_settings(config)
+        self.paths = mf4_helpers.get_paths(config)
+        self.jobs: "queue.Queue[Optional[Job]]" = queue.Queue()
+        self.ids = itertools.count(1)
+        self.running: Optional[str] = None
+        self.converted = 0
+        self.started = time.time()
+        self.stopping = threading.Event()
+
+        dbc_cache.keep_resident()
+        self.dbcs = mf4_helpers.load_dbc_files(self.paths["dbcs_dir"])
+        converter.warm_dbc_cache(self.dbcs, config)
+
+    def submit(self, files: List[str], export_dir: Optional[str] = None) -> Job:
+        job = Job(next(self.ids), files, export_dir or self.paths["export_dir"])
+        self.jobs.put(job)
+        return job
+
+    def work(self) -> None:
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            os.makedirs(job.export_dir, exist_ok=True)
+            # Walking the folder is cheap and picks up added DBCs. The parsed tables
+            # stay resident, so only new or edited files are parsed.
+            self.dbcs = self.mf4_helpers.load_dbc_files(self.paths["dbcs_dir"])
+            for mf4_file in job.files:
+                self.running = mf4_file
+                report = self.converter._convert_job(
+                    mf4_file, self.dbcs, self.config, job.export_dir
+                )
+                self.running = None
+                self.converted += 1
+                job.reports.append(report)
+                if report["status"] == "ok":
+                    self.print(f"[green]✅ {mf4_file} ({report['seconds']:.1f}s)")
+                else:
+                    self.print(f"[red bold]❌ {mf4_file}: {report['error']}")
+            job.done.set()
+
+    def status(self) -> Dict:
+        return {
+            "status": "ok",
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "queued": self.jobs.qsize(),
+            "running": self.running,
+            "converted": self.converted,
+        }
+
+    def handle(self, request: Dict) -> Dict:
+        action = request.get("action")
+        if action == "status":
+            return self.status()
+        if action == "stop":
+            self.stopping.set()
+            return {"status": "stopping"}
+        if action != "convert":
+            return {"status": "error", "error": f"Unknown action: {action}"}
+
+        files = [os.path.abspath(f) for f in request.get("files", [])]
+        missing = [f for f in files if not os.path.exists(f)]
+        if not files or missing:
+            return {"status": "error", "error": f"Files not found: {missing or files}"}
+        job = self.submit(files, request.get("export_dir"))
+        if not request.get("wait"):
+            return {"status": "queued", "job": job.id, "position": self.jobs.qsize()}
+        job.done.wait()
+        return {"status": "done", "job": job.id, "reports": job.reports}
+
+    def watch(self) -> None:
+        """Queue the MF4 files appearing in the watched folder once they are complete."""
+        watch_dir = self.settings["watch_dir"]
+        export_format = self.exporters.get_file_format(self.config)
+        previous: Dict[str, tuple] = {}
+        queued: Dict[str, tuple] = {}
+        while not self.stopping.wait(self.settings["poll_s"]):
+            current = {}
+            for mf4_file in self.mf4_helpers.find_mf4_files(watch_dir):
+                try:
+                    stat = os.stat(mf4_file)
+                except OSError:
+                    continue
+                current[mf4_file] = (stat.st_size, stat.st_mtime_ns)
+            for mf4_file, signature in current.items():
+                if (
+                    previous.get(mf4_file) != signature
+                    or queued.get(mf4_file) == signature
+                ):
+                    continue
+                queued[mf4_file] = signature
+                name = os.path.splitext(os.path.basename(mf4_file))[0]
+                export = self.exporters.export_path(
+                    self.paths["export_dir"],
+                    "filtered",
+                    name,
+                    export_format["file_format"],
+                )
+                if (
+                    os.path.exists(export)
+                    and os.stat(export).st_mtime_ns >= signature[1]
+                ):
+                    continue
+                self.submit([mf4_file])
+            previous = current
+
+    def serve(self) -> None:
+        path = self.settings["socket"]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            if ping(path):
+                raise SystemExit(f"A daemon is already listening on {path}")
+            os.remove(path)
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                try:
+                    reply = daemon.handle(json.loads(line))
+                except ValueError as e:
+                    reply = {"status": "error", "error": f"Bad request: {e}"}
+                self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        server.daemon_threads = True
+        threads = [
+            threading.Thread(target=self.work, daemon=True),
+            threading.Thread(target=server.serve_forever, daemon=True),
+        ]
+        if self.settings["watch_dir"]:
+            threads.append(threading.Thread(target=self.watch, daemon=True))
+            self.print(f"[yellow]Watching: [bold]{self.settings['watch_dir']}")
+        for thread in threads:
+            thread.start()
+        self.print(
+            f"[green]Converter ready with {len(self.dbcs.get('CAN', []))} DBCs, "
+            f"listening on: [bold]{path}"
+        )
+        try:
+            self.stopping.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            self.jobs.put(None)
+            threads[0].join()
+            os.remove(path)
+        self.print("[yellow]Converter stopped.")
+
+
+def request(path: str, message: Dict, timeout: Optional[float] = None) -> Dict:
+    """Send one request to the daemon at `path` and return its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall(json.dumps(message).encode() + b"\n")
+        with client.makefile("rb") as reply:
+            return json.loads(reply.readline())
+
+
+def ping(path: str) -> bool:
+    try:
+        request(path, {"action": "status"}, timeout=5)
+    except OSError:
+        return False
+    return True
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Warm MF4 conversion daemon.")
+    parser.add_argument("command", choices=("serve", "submit", "status", "stop"))
+    parser.add_argument("files", nargs="*", help="MF4 files to convert (submit).")
+    parser.add_argument(
+        "--wait", action="store_true", help="Wait for the job and print its reports."
+    )
+    parser.add_argument("--export-dir", default=None, help="Defaults to export_dir.")
+    parser.add_argument("--config", default="./settings.toml")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, "rb") as f:
+            config = tomllib.load(f)
+    path = get_daemon_settings(config)["socket"]
+    if args.command == "serve":
+        ConversionDaemon(config).serve()
+        raise SystemExit(0)
+
+    message = {"action": args.command}
+    if args.command == "submit":
+        message = {
+            "action": "convert",
+            "files": [os.path.abspath(f) for f in args.files],
+            "export_dir": args.export_dir and os.path.abspath(args.export_dir),
+            "wait": args.wait,
+        }
+    try:
+        reply = request(path, message)
+    except OSError as e:
+        raise SystemExit(f"No converter daemon at {path} ({e}). Start one with: serve")
+
+    if reply["status"] == "error":
+        raise SystemExit(reply["error"])
+    if reply["status"] == "done":
+        for report in reply["reports"]:
+            if report["status"] == "ok":
+                print(f"✅ {report['file']} ({report['seconds']:.1f}s)")
+            else:
+                print(f"❌ {report['file']}: {report['error']}")
+        if any(r["status"] != "ok" for r in reply["reports"]):
+            raise SystemExit(1)
+    else:
+        print(reply)
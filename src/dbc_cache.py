@@ -0,0 +1,149 @@
+"""
+Persistent cache of parsed DBC files.
+
+Parsing every DBC under `dbcs_dir` (including the large `DBCs/4QT` submodule) takes
+seconds on every run. The parsed tables are pickled into a `diskcache.Cache` under
+`paths.cache_dir`, one entry per (parser, DBC path). An entry is reused straight away
+when the file's mtime and size are unchanged. If they changed, the file is hashed and the
+entry is only reparsed when the content hash differs too. The cache is a SQLite backed
+directory, so batch workers, the dashboard and any other process share it safely.
+
+A long-running process such as the conversion daemon (`src.daemon`) calls
+`keep_resident()` to also keep the parsed tables in memory. They are then reused without
+unpickling them for every job, still keyed on the file's mtime and size.
+"""
+
+import hashlib
+import os
+from typing import Callable, Dict, Optional
+
+from asammdf.blocks.utils import load_can_database
+from diskcache import Cache
+from rich import print
+
+import src.mf4_helpers as mf4_helpers
+
+# Bump when the layout of the cached tables changes so old entries are not reused.
+CACHE_VERSION = 1
+
+# Parsed tables kept in memory by `keep_resident`, None while it is off.
+_resident: Optional[Dict] = None
+
+
+def get_cache_settings(config: Dict) -> Dict:
+    dbc_cache = config.get("dbc_cache", {})
+    if type(dbc_cache) is not dict:
+        print("[red]Config file has bad dbc_cache settings. Using defaults instead.")
+        dbc_cache = {}
+    return {
+        "enabled": bool(dbc_cache.get("enabled", True)),
+        "directory": os.path.join(mf4_helpers.get_paths(config)["cache_dir"], "dbc"),
+    }
+
+
+def open_cache(config: Dict) -> Optional[Cache]:
+    settings = get_cache_settings(config)
+    if not settings["enabled"]:
+        return None
+    return Cache(settings["directory"])
+
+
+def keep_resident(enabled: bool = True) -> None:
+    """Keep every table returned by `cached_parse` in memory from now on."""
+    global _resident
+    _resident = {} if enabled else None
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached_parse(
+    cache: Optional[Cache], path: str, parser: str, parse: Callable[[str], object]
+):
+    """
+    Return `parse(path)`, reusing the cached result while the file is unchanged.
+    `parser` names the kind of table being cached, as one DBC is parsed by both
+    cantools (for the NumPy decoder) and canmatrix (for asammdf).
+    """
+    key = (CACHE_VERSION, parser, os.path.abspath(path))
+    if _resident is None:
+        return _cached_parse(cache, key, path, parse)
+
+    stat = os.stat(path)
+    resident = _resident.get(key)
+    if resident is not None and resident[0] == (stat.st_mtime_ns, stat.st_size):
+        return resident[1]
+    data = _cached_parse(cache, key, path, parse)
+    if data is not None:
+        _resident[key] = ((stat.st_mtime_ns, stat.st_size), data)
+    return data
+
+
+def _cached_parse(cache: Optional[Cache], key: tuple, path: str, parse: Callable):
+    if cache is None:
+        return parse(path)
+
+    stat = os.stat(path)
+    entry = cache.get(key)
+
+    if entry is not None and (entry["mtime"], entry["size"]) == (
+        stat.st_mtime_ns,
+        stat.st_size,
+    ):
+        return entry["data"]
+
+    digest = content_hash(path)
+    if entry is not None and entry["sha256"] == digest:
+        # Touched but not edited, keep the parsed tables and note the new mtime.
+        entry.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+        cache.set(key, entry)
+        return entry["data"]
+
+    data = parse(path)
+    if data is not None:
+        cache.set(
+            key,
+            {
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": digest,
+                "data": data,
+            },
+        )
+    return data
+
+
+def canmatrix_dbcs(dbcs: Dict, cache: Optional[Cache]) -> Dict:
+    """
+    Same mapping as `mf4_helpers.load_dbc_files` with each path swapped for its cached
+    `CanMatrix`, which `MDF.extract_bus_logging` accepts in place of a file name.
+    """
+    if cache is None and _resident is None:
+        return dbcs
+
+    resolved = {}
+    for bus_type, files in dbcs.items():
+        resolved[bus_type] = []
+        for dbc_name, bus_channel in files:
+            dbc = cached_parse(cache, dbc_name, "canmatrix", load_can_database)
+            if dbc is None:
+                print(f"[yellow]⚠️Could not load DBC: {dbc_name}")
+                continue
+            resolved[bus_type].append((dbc, bus_channel))
+    return resolved
+
+
+def prune(cache: Cache, dbcs: Dict) -> int:
+    """Drop entries for DBC files that are no longer in the mapping."""
+    current = {os.path.abspath(name) for files in dbcs.values() for name, _ in files}
+    removed = 0
+    for key in list(cache.iterkeys()):
+        if key[0] != CACHE_VERSION or key[2] not in current:
+            cache.delete(key)
+            removed += 1
+    return removed
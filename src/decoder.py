@@ -0,0 +1,406 @@
+"""
+Vectorised NumPy CAN signal decoder.
+
+An alternative to asammdf's `extract_bus_logging`. The DBCs are parsed once with cantools
+and compiled into plain tables holding, for every signal, the byte window it lives in
+and the shift, mask, sign, scale and offset needed to pull it out. Raw frames are then
+grouped by (bus, IDE, arbitration ID) and every signal of a message is extracted from the
+(N, 64) uint8 payload matrix of that group with a handful of whole-array operations,
+instead of looping over frames.
+
+Select it with `engine = "numpy"` in the `[decoding]` section of `settings.toml`.
+With `workers` above 1 there, large blocks of frames are decoded over several processes
+(see `src.parallel_decode`).
+Run `python -m src.decoder <file.mf4>` to check its output against asammdf.
+"""
+
+import argparse
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import cantools
+import numpy as np
+import pandas as pd
+from asammdf import MDF
+from diskcache import Cache
+from rich import print
+
+import src.dbc_cache as dbc_cache
+import src.mf4_helpers as mf4_helpers
+
+PAYLOAD_WIDTH = 64
+ENGINES = ("asammdf", "numpy")
+
+# (bus channel, arbitration id, IDE flag)
+FrameKey = Tuple[int, int, int]
+
+
+def get_decoding_settings(config: Dict) -> Dict:
+    decoding = config.get("decoding", {})
+    if type(decoding) is not dict:
+        print("[red]Config file has bad decoding settings. Using defaults instead.")
+        decoding = {}
+    engine = decoding.get("engine", "asammdf")
+    if engine not in ENGINES:
+        print(f"[red]Unknown decoding engine '{engine}'. Using asammdf instead.")
+        engine = "asammdf"
+    workers = int(decoding.get("workers", 1))
+    return {"engine": engine, "workers": workers if workers else (os.cpu_count() or 1)}
+
+
+def compile_signal(signal) -> Dict:
+    """Precompute where a cantools signal sits in the payload."""
+    big_endian = signal.byte_order == "big_endian"
+    if big_endian:
+        # DBC start bit of a Motorola signal is its MSB in sawtooth numbering.
+        # Convert to a linear position counting from the MSB of byte 0.
+        first_bit = (signal.start // 8) * 8 + 7 - signal.start % 8
+    else:
+        first_bit = signal.start
+    first_byte = first_bit // 8
+    bit_offset = first_bit - first_byte * 8
+
+    return {
+        "name": signal.name,
+        "length": signal.length,
+        "big_endian": big_endian,
+        "first_bit": first_bit,
+        "first_byte": first_byte,
+        "bit_offset": bit_offset,
+        "fits_window": bit_offset + signal.length <= 64,
+        "is_signed": bool(signal.is_signed),
+        "is_float": bool(signal.is_float),
+        "scale": signal.scale,
+        "offset": signal.offset,
+        "multiplexer_ids": (
+            list(signal.multiplexer_ids) if signal.multiplexer_ids else None
+        ),
+        "multiplexer_signal": signal.multiplexer_signal,
+    }
+
+
+def compile_message(message, bus_channel: int) -> Dict:
+    return {
+        "name": message.name,
+        "frame_id": message.frame_id,
+        "is_extended": bool(message.is_extended_frame),
+        "length": message.length,
+        "bus_channel": bus_channel,
+        "signals": [compile_signal(s) for s in message.signals],
+    }
+
+
+def compile_dbc_file(dbc_name: str) -> List[Dict]:
+    db = cantools.database.load_file(dbc_name, strict=False)
+    return [compile_message(m, bus_channel=0) for m in db.messages]
+
+
+def compile_dbc_files(dbcs: Dict, cache: Optional[Cache] = None) -> List[Dict]:
+    """
+    Parse every CAN DBC in the mapping from `mf4_helpers.load_dbc_files`. With a cache
+    from `dbc_cache.open_cache` unchanged files are loaded from disk instead.
+    """
+    messages = []
+    for dbc_name, bus_channel in dbcs.get("CAN", []):
+        try:
+            compiled = dbc_cache.cached_parse(
+                cache, dbc_name, "numpy", compile_dbc_file
+            )
+        except Exception as e:
+            print(f"[yellow]⚠️Could not load DBC {dbc_name}: {e}")
+            continue
+        messages.extend(dict(m, bus_channel=bus_channel) for m in compiled)
+    return messages
+
+
+def message_lookup(messages: List[Dict]) -> Dict[Tuple[int, bool], List[Dict]]:
+    lookup = {}
+    for message in messages:
+        key = (message["frame_id"], message["is_extended"])
+        lookup.setdefault(key, []).append(message)
+    return lookup
+
+
+def _find_message(lookup: Dict, key: FrameKey) -> Optional[Dict]:
+    bus_id, msg_id, is_extended = key
+    for message in lookup.get((msg_id, bool(is_extended)), []):
+        if not message["bus_channel"] or message["bus_channel"] == bus_id:
+            return message
+    return None
+
+
+def signal_columns(
+    lookup: Dict, keys: Optional[Iterable[FrameKey]] = None
+) -> List[str]:
+    """
+    Signal names, in DBC order, of the messages seen under the given frame keys, or of
+    every message when `keys` is None.
+    """
+    present = None
+    if keys is not None:
+        present = {
+            message["name"]
+            for message in (_find_message(lookup, key) for key in keys)
+            if message is not None
+        }
+    columns = []
+    for candidates in lookup.values():
+        for message in candidates:
+            if present is None or message["name"] in present:
+                columns.extend(
+                    s["name"] for s in message["signals"] if s["name"] not in columns
+                )
+    return columns
+
+
+def frame_codes(bus: np.ndarray, ids: np.ndarray, ide: np.ndarray) -> np.ndarray:
+    """One integer per frame that sorts by bus, then IDE, then arbitration id."""
+    return (
+        bus.astype(np.uint64) << np.uint64(30)
+        | ide.astype(np.uint64) << np.uint64(29)
+        | ids.astype(np.uint64)
+    )
+
+
+def group_frames(
+    bus: np.ndarray, ids: np.ndarray, ide: np.ndarray
+) -> Iterator[Tuple[FrameKey, np.ndarray]]:
+    """
+    Yield the frame indexes of every (bus, arbitration id, IDE) group, in time order
+    within each group. A single stable sort replaces a boolean mask per ID.
+    """
+    keys = frame_codes(bus, ids, ide)
+    order = np.argsort(keys, kind="stable")
+    unique_keys, starts = np.unique(keys[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    for key, start, end in zip(unique_keys.tolist(), starts, ends):
+        frame_key = (key >> 30, key & 0x1FFFFFFF, (key >> 29) & 1)
+        yield frame_key, order[start:end]
+
+
+def _pad_payload(payload: np.ndarray) -> np.ndarray:
+    """Pad to the CAN FD width plus one spare 8 byte window for the shifted views."""
+    width = PAYLOAD_WIDTH + 8
+    if payload.shape[1] >= width:
+        return payload
+    padded = np.zeros((len(payload), width), dtype=np.uint8)
+    padded[:, : payload.shape[1]] = payload
+    return padded
+
+
+def extract_raw(payload: np.ndarray, signal: Dict) -> np.ndarray:
+    """Raw unsigned value of a signal for every row of a padded payload matrix."""
+    length = signal["length"]
+    mask = np.uint64((1 << length) - 1)
+
+    if signal["fits_window"]:
+        first_byte = signal["first_byte"]
+        window = np.ascontiguousarray(payload[:, first_byte : first_byte + 8])
+        if signal["big_endian"]:
+            words = window.view(">u8").ravel()
+            shift = 64 - signal["bit_offset"] - length
+        else:
+            words = window.view("<u8").ravel()
+            shift = signal["bit_offset"]
+        return (words >> np.uint64(shift)) & mask
+
+    # Long unaligned signals can span 9 bytes, fall back to unpacking the bits.
+    bitorder = "big" if signal["big_endian"] else "little"
+    bits = np.unpackbits(payload, axis=1, bitorder=bitorder)
+    bits = bits[:, signal["first_bit"] : signal["first_bit"] + length]
+    if signal["big_endian"]:
+        bits = bits[:, ::-1]
+    raw = np.zeros(len(payload), dtype=np.uint64)
+    for i in range(length):
+        raw |= bits[:, i].astype(np.uint64) << np.uint64(i)
+    return raw
+
+
+def to_physical(raw: np.ndarray, signal: Dict) -> np.ndarray:
+    length = signal["length"]
+    if signal["is_float"]:
+        values = (
+            raw.astype(np.uint32).view(np.float32)
+            if length == 32
+            else raw.view(np.float64)
+        )
+    elif signal["is_signed"]:
+        if length == 64:
+            values = raw.view(np.int64)
+        else:
+            values = raw.astype(np.int64)
+            values = np.where(
+                values >= 1 << (length - 1), values - (1 << length), values
+            )
+    else:
+        values = raw
+
+    if signal["scale"] != 1 or signal["offset"] != 0:
+        values = values * signal["scale"] + signal["offset"]
+    return values
+
+
+def decode_message(payload: np.ndarray, message: Dict) -> Dict[str, np.ndarray]:
+    """
+    Decode every signal of one message for all of its frames.
+
+    Multiplexed signals are NaN on the rows where their multiplexer selects another
+    page, so every returned array has one value per frame.
+    """
+    raws = {s["name"]: extract_raw(payload, s) for s in message["signals"]}
+    by_name = {s["name"]: s for s in message["signals"]}
+    selections = {}
+
+    def selected(signal: Dict) -> Optional[np.ndarray]:
+        name = signal["name"]
+        if name not in selections:
+            mux_name = signal["multiplexer_signal"]
+            if mux_name is None or signal["multiplexer_ids"] is None:
+                selections[name] = None
+            else:
+                rows = np.isin(raws[mux_name], signal["multiplexer_ids"])
+                parent = selected(by_name[mux_name])
+                selections[name] = rows if parent is None else rows & parent
+        return selections[name]
+
+    decoded = {}
+    for signal in message["signals"]:
+        values = to_physical(raws[signal["name"]], signal)
+        rows = selected(signal)
+        if rows is not None:
+            values = np.where(rows, values, np.nan)
+        decoded[signal["name"]] = values
+    return decoded
+
+
+def merge_message_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """One row per timestamp, one column per signal, like `MDF.to_dataframe`."""
+    if not frames:
+        return pd.DataFrame(index=pd.Index([], name="timestamps"))
+    df = pd.concat(frames).sort_index(kind="stable")
+    if not df.index.is_unique:
+        df = df.groupby(level=0, sort=False).first()
+    return df
+
+
+def decode_frames(
+    t: np.ndarray,
+    bus: np.ndarray,
+    ids: np.ndarray,
+    ide: np.ndarray,
+    payload: np.ndarray,
+    lookup: Dict,
+) -> pd.DataFrame:
+    """Decode a block of raw frames into one row per timestamp, one column per signal."""
+    payload = _pad_payload(payload)
+    frames = []
+    for key, idx in group_frames(bus, ids, ide):
+        message = _find_message(lookup, key)
+        if message is None:
+            continue
+        frames.append(pd.DataFrame(decode_message(payload[idx], message), index=t[idx]))
+    return merge_message_frames(frames)
+
+
+def frame_keys(bus: np.ndarray, ids: np.ndarray, ide: np.ndarray) -> Set[FrameKey]:
+    return {key for key, _ in group_frames(bus, ids, ide)}
+
+
+def decode_mdf(
+    mdf: MDF, lookup: Dict, config: Dict, decode: Callable = decode_frames
+) -> pd.DataFrame:
+    """
+    NumPy counterpart of `mdf_to_df(mdf.extract_bus_logging(...))`. `decode` can be
+    replaced by `ParallelDecoder.decode` to decode each group over several processes.
+    """
+    export_settings = mf4_helpers.get_export_settings(config)
+    groups = mf4_helpers.can_data_groups(mdf)
+    origin = mf4_helpers.first_timestamp(mdf, groups)
+
+    frames = []
+    for group in groups:
+        chunk = mdf.get(mf4_helpers.CAN_FRAME_CHANNEL, group=group)
+        frames.append(decode(*mf4_helpers.frame_arrays(chunk), lookup))
+    df = merge_message_frames(frames)
+    df.index = mf4_helpers.export_index(
+        df.index.values, origin, mdf.start_time, export_settings
+    )
+    if len(df):
+        df = mf4_helpers.add_date_column(df, mdf.start_time)
+    return df
+
+
+def verify_against_asammdf(mf4_file: str, dbcs: Dict, config: Dict) -> pd.DataFrame:
+    """
+    Decode a file with both engines and report, per signal, the sample counts and the
+    largest absolute difference in values and in timestamps.
+    """
+    mdf = MDF(mf4_file)
+    try:
+        lookup = message_lookup(compile_dbc_files(dbcs, dbc_cache.open_cache(config)))
+        frames = []
+        for group in mf4_helpers.can_data_groups(mdf):
+            chunk = mdf.get(mf4_helpers.CAN_FRAME_CHANNEL, group=group)
+            frames.append(decode_frames(*mf4_helpers.frame_arrays(chunk), lookup))
+        df_numpy = merge_message_frames(frames)
+
+        filtered_bus = mdf.extract_bus_logging(database_files=dbcs)
+        df_asammdf = filtered_bus.to_dataframe(
+            time_from_zero=False, use_interpolation=False
+        )
+        filtered_bus.close()
+    finally:
+        mdf.close()
+
+    rows = []
+    for col in df_asammdf.columns:
+        expected = df_asammdf[col].dropna()
+        if col not in df_numpy.columns:
+            rows.append({"signal": col, "asammdf": len(expected), "numpy": 0})
+            continue
+        actual = df_numpy[col].dropna()
+        row = {"signal": col, "asammdf": len(expected), "numpy": len(actual)}
+        if expected.dtype == object and len(expected):
+            # asammdf hands back signals wider than 8 bytes as byte arrays
+            row["note"] = "not numeric in asammdf"
+        elif len(expected) == len(actual):
+            row["max_abs_diff"] = float(
+                np.max(
+                    np.abs(expected.values.astype("f8") - actual.values.astype("f8")),
+                    initial=0,
+                )
+            )
+            row["max_time_diff"] = float(
+                np.max(np.abs(expected.index.values - actual.index.values), initial=0)
+            )
+        rows.append(row)
+    columns = ["signal", "asammdf", "numpy", "max_abs_diff", "max_time_diff", "note"]
+    return pd.DataFrame(rows, columns=columns).set_index("signal")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the NumPy decoder against asammdf on recorded logs."
+    )
+    parser.add_argument("mf4_files", nargs="+")
+    parser.add_argument("--config", default="./settings.toml")
+    args = parser.parse_args()
+
+    config = mf4_helpers.get_config(args.config)
+    dbcs = mf4_helpers.load_dbc_files(mf4_helpers.get_paths(config)["dbcs_dir"])
+    for mf4_file in args.mf4_files:
+        report = verify_against_asammdf(mf4_file, dbcs, config)
+        if report.empty:
+            print(f"[yellow]{mf4_file}: asammdf decoded no signals, nothing to compare")
+            continue
+        mismatched = report[
+            (report["asammdf"] != report["numpy"])
+            | (report["max_abs_diff"] > 1e-9)
+            | (report["max_time_diff"] > 1e-9)
+        ]
+        print(f"[bold]{mf4_file}")
+        print(report)
+        if len(mismatched):
+            print(f"[red bold]{len(mismatched)} signals differ from asammdf")
+        else:
+            print("[green]✅ All signals match asammdf")
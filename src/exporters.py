@@ -0,0 +1,225 @@
+"""
+Writers and readers for the exported tables.
+
+The format is picked from the file extension: `.csv`, `.parquet` or `.feather`/`.arrow`
+(Arrow IPC). Parquet and Feather keep the column dtypes and compress the mostly empty
+columns of the decoded tables down to almost nothing. They can also be read back one
+column at a time, which the dashboard uses to only load the signals being shown.
+
+`export_settings.file_format` in `settings.toml` chooses the format for new exports.
+"""
+
+import os
+import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from rich import print
+
+INDEX_NAME = "timestamps"
+FILE_FORMATS = (".parquet", ".feather", ".arrow", ".csv")
+
+
+def get_file_format(config: Dict) -> Dict[str, Optional[str]]:
+    export_settings = config.get("export_settings", {})
+    if type(export_settings) is not dict:
+        export_settings = {}
+    file_format = str(export_settings.get("file_format", ".parquet")).lower()
+    if not file_format.startswith("."):
+        file_format = f".{file_format}"
+    if file_format not in FILE_FORMATS:
+        print(f"[red]Unknown file format '{file_format}'. Using .parquet instead.")
+        file_format = ".parquet"
+    return {
+        "file_format": file_format,
+        "compression": export_settings.get("compression", "zstd"),
+    }
+
+
+def export_path(export_dir: str, prefix: str, name: str, file_format: str) -> str:
+    return os.path.join(export_dir, f"{prefix}_{name}{file_format}")
+
+
+def _to_arrow(df: pd.DataFrame, schema: Optional[pa.Schema] = None) -> pa.Table:
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    if schema is not None and not table.schema.equals(schema):
+        table = table.select(schema.names).cast(schema, safe=False)
+    return table
+
+
+class TableWriter:
+    """
+    Write a dataframe to one file in one or more chunks.
+
+    The first chunk fixes the columns and dtypes. Later chunks are cast to match, so the
+    streaming converter can append chunk after chunk to a single Parquet or Arrow file.
+    """
+
+    def __init__(self, path: str, compression: Optional[str] = "zstd"):
+        self.path = path
+        self.file_format = os.path.splitext(path)[1].lower()
+        if self.file_format not in FILE_FORMATS:
+            raise ValueError(f"Cannot export to '{path}', unknown file format")
+        self.compression = compression
+        self.schema = None
+        self._writer = None
+        self.rows = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.file_format == ".csv":
+            df.to_csv(self.path, mode="a" if self.rows else "w", header=not self.rows)
+            self.rows += len(df)
+            return
+
+        table = _to_arrow(df, self.schema)
+        if self._writer is None:
+            self.schema = table.schema
+            if self.file_format == ".parquet":
+                self._writer = pq.ParquetWriter(
+                    self.path, self.schema, compression=self.compression
+                )
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                self._writer = pa.ipc.new_file(self.path, self.schema, options=options)
+        self._writer.write_table(table)
+        self.rows += len(df)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_table(df: pd.DataFrame, path: str, compression: Optional[str] = "zstd"):
+    with TableWriter(path, compression=compression) as writer:
+        writer.write(df)
+    return path
+
+
+def concat_files(parts: List[str], path: str, compression: Optional[str] = "zstd"):
+    """
+    Join exports written in parts (such as the segments of a resumable streaming
+    conversion) into one file. Only one part is read at a time, and Parquet and Arrow
+    parts are copied as Arrow tables without going through pandas.
+    """
+    file_format = os.path.splitext(path)[1].lower()
+    if file_format == ".csv":
+        with open(path, "wb") as out:
+            for i, part in enumerate(parts):
+                with open(part, "rb") as f:
+                    if i:
+                        f.readline()  # Only the first part keeps its header.
+                    shutil.copyfileobj(f, out)
+        return path
+
+    writer, schema = None, None
+    try:
+        for part in parts:
+            if file_format == ".parquet":
+                table = pq.read_table(part)
+            else:
+                with pa.memory_map(part) as source:
+                    table = pa.ipc.open_file(source).read_all()
+            if writer is None:
+                schema = table.schema
+                if file_format == ".parquet":
+                    writer = pq.ParquetWriter(path, schema, compression=compression)
+                else:
+                    options = pa.ipc.IpcWriteOptions(compression=compression)
+                    writer = pa.ipc.new_file(path, schema, options=options)
+            elif not table.schema.equals(schema):
+                table = table.select(schema.names).cast(schema, safe=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def iter_table(path: str, chunk_rows: int = 500_000) -> Iterator[pd.DataFrame]:
+    """
+    Read an export back in pieces, indexed by timestamps like `read_table`: one row
+    group at a time for Parquet, one record batch for Arrow, `chunk_rows` rows for CSV.
+    """
+    file_format = os.path.splitext(path)[1].lower()
+    if file_format == ".parquet":
+        parquet = pq.ParquetFile(path)
+        for i in range(parquet.num_row_groups):
+            yield parquet.read_row_group(i).to_pandas()
+        return
+
+    if file_format in (".feather", ".arrow"):
+        with pa.memory_map(path) as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                table = pa.Table.from_batches(
+                    [reader.get_batch(i)], schema=reader.schema
+                )
+                yield table.to_pandas()
+        return
+
+    for df in pd.read_csv(path, chunksize=chunk_rows):
+        yield df.set_index(INDEX_NAME) if INDEX_NAME in df.columns else df
+
+
+def read_columns(path: str) -> List[str]:
+    """Column names of an export, without reading any of its data."""
+    file_format = os.path.splitext(path)[1].lower()
+    if file_format == ".parquet":
+        names = pq.read_schema(path).names
+    elif file_format in (".feather", ".arrow"):
+        with pa.memory_map(path) as source:
+            names = pa.ipc.open_file(source).schema.names
+    else:
+        names = list(pd.read_csv(path, nrows=0).columns)
+    return [n for n in names if n != INDEX_NAME and not n.startswith("__index_level")]
+
+
+def read_table(
+    path: str,
+    columns: Optional[List[str]] = None,
+    time_range: Optional[Tuple[float, float]] = None,
+) -> pd.DataFrame:
+    """
+    Load an export indexed by timestamps. Only the listed columns are read from
+    Parquet and Arrow files; CSV still has to be scanned but only keeps those columns.
+    With `time_range` only the rows between the two timestamps are returned, which
+    Parquet filters on while reading.
+    """
+    file_format = os.path.splitext(path)[1].lower()
+    if columns is not None:
+        available = set(read_columns(path))
+        columns = [c for c in dict.fromkeys(columns) if c in available]
+    if time_range is not None and None in time_range:
+        time_range = None
+
+    if file_format == ".parquet":
+        filters = None
+        if time_range is not None:
+            filters = [
+                (INDEX_NAME, ">=", time_range[0]),
+                (INDEX_NAME, "<=", time_range[1]),
+            ]
+        return pd.read_parquet(path, columns=columns, filters=filters)
+
+    if file_format in (".feather", ".arrow"):
+        read = None if columns is None else [INDEX_NAME, *columns]
+        df = feather.read_table(path, columns=read, memory_map=True).to_pandas()
+    else:
+        usecols = None if columns is None else [INDEX_NAME, *columns]
+        df = pd.read_csv(path, usecols=usecols)
+
+    if INDEX_NAME in df.columns:
+        df = df.set_index(INDEX_NAME)
+    if time_range is not None:
+        df = df.loc[(df.index >= time_range[0]) & (df.index <= time_range[1])]
+    return df
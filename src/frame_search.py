@@ -0,0 +1,362 @@
+"""
+Search the raw CAN frames of a raw frame store by ID, payload pattern and timing.
+
+The frames of a store (see `src.raw_store`) are in recording order, so the frames of one
+ID are spread over the whole log. The converter sorts the frames by (bus, IDE,
+arbitration id, time) once it has written a store, and keeps that order next to it
+(stores without it are indexed on their first search):
+
+    id_order.npy    int64 (N,)   frame positions, grouped by ID and in time order
+    id_groups.npy   (K,)         per ID: frame key, first position in id_order, count
+
+The frames of any ID are then one slice of `id_order`, and every query only touches
+the rows of that ID in the memory-mapped arrays:
+
+    store = FrameStore("processed_files/raw_frames_log")
+    store.match(0x18FF50E5, pattern="A0 ?? 1? FF")      # payload byte mask/value
+    store.timing(0x100)                                 # period and jitter
+    store.gaps(0x100, factor=3)                         # missing messages
+
+Payload patterns are hex bytes where `?` stands for any nibble, or an explicit `mask` and
+`value`: a frame matches when `payload & mask == value` on every byte. Timestamps are in
+seconds from the first frame of the log, like the exports. From the command line:
+
+    python -m src.frame_search processed_files/raw_frames_log ids
+    python -m src.frame_search processed_files/raw_frames_log match --id 0x100 --pattern "A0 ?? CE"
+    python -m src.frame_search processed_files/raw_frames_log gaps --id 0x100 --factor 3
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from rich import print
+from rich.console import Console
+
+import src.mf4_helpers as mf4_helpers
+import src.raw_store as raw_store
+
+# Data length of each CAN (FD) data length code.
+DLC_LENGTHS = np.array(
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64], dtype=np.uint8
+)
+
+
+def _index_is_current(directory: str, n_frames: int) -> bool:
+    paths = [
+        os.path.join(directory, name)
+        for name in (raw_store.ORDER_FILE, raw_store.GROUPS_FILE)
+    ]
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    built = min(os.stat(path).st_mtime_ns for path in paths)
+    stored = os.stat(os.path.join(directory, "ids.npy")).st_mtime_ns
+    order = np.load(paths[0], mmap_mode="r")
+    return built >= stored and len(order) == n_frames
+
+
+def parse_pattern(pattern: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (mask, value) bytes of a pattern such as "A0 ?? 1? FF", where `?` matches any
+    nibble. Bytes may also be written together ("A0??1?FF") or with a 0x prefix.
+    """
+    text = "".join(pattern.replace("0x", "").replace("0X", "").split())
+    if len(text) % 2:
+        raise ValueError(f"Pattern {pattern!r} does not hold whole bytes")
+    mask = np.zeros(len(text) // 2, dtype=np.uint8)
+    value = np.zeros(len(text) // 2, dtype=np.uint8)
+    for i in range(len(mask)):
+        for nibble, shift in ((text[2 * i], 4), (text[2 * i + 1], 0)):
+            if nibble == "?":
+                continue
+            mask[i] |= 0xF << shift
+            value[i] |= int(nibble, 16) << shift
+    return mask, value
+
+
+def _parse_bytes(text: str) -> np.ndarray:
+    text = "".join(text.replace("0x", "").replace("0X", "").split())
+    return np.frombuffer(bytes.fromhex(text), dtype=np.uint8)
+
+
+class FrameStore:
+    """
+    A raw frame store opened for searching. The arrays stay memory-mapped, so opening
+    it reads nothing but the small ID table, and the ID index is built on first use.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.arrays, self.meta = raw_store.load_store(directory)
+        self.origin = float(self.meta["origin"])
+        if not _index_is_current(directory, len(self.arrays["timestamps"])):
+            print(f"[yellow]Indexing the frames of {directory} by ID")
+            raw_store.build_id_index(directory, self.arrays)
+        self.order = np.load(
+            os.path.join(directory, raw_store.ORDER_FILE), mmap_mode="r"
+        )
+        self.groups = np.load(os.path.join(directory, raw_store.GROUPS_FILE))
+
+    def __len__(self) -> int:
+        return len(self.arrays["timestamps"])
+
+    def _select(
+        self, arbitration_id: int, bus: Optional[int] = None, ide: Optional[int] = None
+    ) -> np.ndarray:
+        keys = self.groups["key"]
+        selected = (keys & np.uint64(0x1FFFFFFF)) == np.uint64(arbitration_id)
+        if bus is not None:
+            selected &= (keys >> np.uint64(30)) == np.uint64(bus)
+        if ide is not None:
+            selected &= ((keys >> np.uint64(29)) & np.uint64(1)) == np.uint64(ide)
+        return self.groups[selected]
+
+    def rows(
+        self, arbitration_id: int, bus: Optional[int] = None, ide: Optional[int] = None
+    ) -> np.ndarray:
+        """Positions of the frames of an ID in the store, in time order."""
+        groups = self._select(arbitration_id, bus, ide)
+        if len(groups) == 1:
+            start, count = int(groups["start"][0]), int(groups["count"][0])
+            return np.asarray(self.order[start : start + count])
+        rows = np.concatenate(
+            [self.order[g["start"] : g["start"] + g["count"]] for g in groups]
+            or [np.array([], dtype=np.int64)]
+        )
+        # The same ID on several buses: merge them back into time order.
+        return rows[np.argsort(self.arrays["timestamps"][rows], kind="stable")]
+
+    def times(self, rows: np.ndarray) -> np.ndarray:
+        """Timestamps of the given frames, in seconds from the first frame of the log."""
+        return self.arrays["timestamps"][rows] - self.origin
+
+    def ids(self) -> pd.DataFrame:
+        """Every ID of the log with its frame count, first and last time and period."""
+        groups = self.groups
+        first = self.order[groups["start"]]
+        last = self.order[groups["start"] + groups["count"] - 1]
+        t_first, t_last = self.times(first), self.times(last)
+        counts = groups["count"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            period = np.where(counts > 1, (t_last - t_first) / (counts - 1), np.nan)
+        keys = groups["key"]
+        return pd.DataFrame(
+            {
+                "bus": (keys >> np.uint64(30)).astype(np.uint8),
+                "id": (keys & np.uint64(0x1FFFFFFF)).astype(np.uint32),
+                "ide": ((keys >> np.uint64(29)) & np.uint64(1)).astype(np.uint8),
+                "frames": counts,
+                "first": t_first,
+                "last": t_last,
+                "mean_period": period,
+            }
+        )
+
+    def frames(self, rows: np.ndarray) -> pd.DataFrame:
+        """The given frames as a table, with their data bytes in hex like the exports."""
+        dlc = self.arrays["dlc"][rows]
+        width = int(DLC_LENGTHS[dlc & 0xF].max()) if len(rows) else 0
+        payload = self.arrays["payload"][rows, :width]
+        return pd.DataFrame(
+            {
+                "row": rows,
+                "bus": self.arrays["bus"][rows],
+                "id": self.arrays["ids"][rows],
+                "ide": self.arrays["ide"][rows],
+                "dlc": dlc,
+                "data": mf4_helpers.hex_payload(payload),
+            },
+            index=pd.Index(self.times(rows), name="timestamps"),
+        )
+
+    def _in_range(
+        self, rows: np.ndarray, time_range: Optional[Tuple[float, float]]
+    ) -> np.ndarray:
+        if time_range is None:
+            return rows
+        t = self.times(rows)
+        start, end = time_range
+        lo = 0 if start is None else np.searchsorted(t, start, side="left")
+        hi = len(t) if end is None else np.searchsorted(t, end, side="right")
+        return rows[lo:hi]
+
+    def match(
+        self,
+        arbitration_id: int,
+        pattern: Optional[str] = None,
+        mask=None,
+        value=None,
+        bus: Optional[int] = None,
+        ide: Optional[int] = None,
+        time_range: Optional[Tuple[float, float]] = None,
+    ) -> pd.DataFrame:
+        """
+        Frames of an ID whose payload matches `pattern`, or `mask` and `value` (hex
+        strings or byte arrays, the mask defaulting to all ones), in time order.
+        Without either, every frame of the ID in `time_range`.
+        """
+        if mask is not None and value is None and pattern is None:
+            raise ValueError("--mask needs --value")
+        rows = self._in_range(self.rows(arbitration_id, bus, ide), time_range)
+        if pattern is not None:
+            mask, value = parse_pattern(pattern)
+        elif value is not None:
+            value = _parse_bytes(value) if isinstance(value, str) else value
+            if mask is None:
+                mask = np.full(len(value), 0xFF, dtype=np.uint8)
+            mask = _parse_bytes(mask) if isinstance(mask, str) else mask
+        if value is not None and len(rows):
+            mask = np.asarray(mask, dtype=np.uint8)
+            value = np.asarray(value, dtype=np.uint8)
+            if len(mask) != len(value):
+                raise ValueError("The mask and value must have the same length")
+            payload = self.arrays["payload"][rows, : len(mask)]
+            rows = rows[((payload & mask) == (value & mask)).all(axis=1)]
+        return self.frames(rows)
+
+    def intervals(
+        self,
+        arbitration_id: int,
+        bus: Optional[int] = None,
+        ide: Optional[int] = None,
+        time_range: Optional[Tuple[float, float]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Timestamps of the frames of an ID and the time since the frame before each."""
+        t = self.times(self._in_range(self.rows(arbitration_id, bus, ide), time_range))
+        return t, np.diff(t)
+
+    def timing(
+        self,
+        arbitration_id: int,
+        bus: Optional[int] = None,
+        ide: Optional[int] = None,
+        time_range: Optional[Tuple[float, float]] = None,
+    ) -> Dict[str, float]:
+        """
+        Period of an ID (median time between frames) and its jitter: the standard
+        deviation and the largest deviation of the intervals from the period.
+        """
+        t, dt = self.intervals(arbitration_id, bus, ide, time_range)
+        if not len(dt):
+            return {"frames": len(t)}
+        period = float(np.median(dt))
+        deviation = np.abs(dt - period)
+        return {
+            "frames": len(t),
+            "period_s": period,
+            "mean_interval_s": float(dt.mean()),
+            "jitter_std_s": float(dt.std()),
+            "jitter_p99_s": float(np.percentile(deviation, 99)),
+            "jitter_max_s": float(deviation.max()),
+            "min_interval_s": float(dt.min()),
+            "max_interval_s": float(dt.max()),
+        }
+
+    def gaps(
+        self,
+        arbitration_id: int,
+        factor: float = 2.0,
+        min_gap_s: Optional[float] = None,
+        bus: Optional[int] = None,
+        ide: Optional[int] = None,
+        time_range: Optional[Tuple[float, float]] = None,
+    ) -> pd.DataFrame:
+        """
+        Gaps in the frames of an ID: intervals longer than `factor` times its period,
+        or than `min_gap_s` when given, with about how many frames are missing.
+        """
+        t, dt = self.intervals(arbitration_id, bus, ide, time_range)
+        if not len(dt):
+            return pd.DataFrame(columns=["start", "end", "duration", "missing"])
+        period = float(np.median(dt))
+        limit = min_gap_s if min_gap_s is not None else factor * period
+        at = np.flatnonzero(dt > limit)
+        missing = np.rint(dt[at] / period).astype(np.int64) - 1 if period else 0
+        return pd.DataFrame(
+            {
+                "start": t[at],
+                "end": t[at + 1],
+                "duration": dt[at],
+                "missing": missing,
+            }
+        )
+
+
+def _int(text: str) -> int:
+    return int(text, 0)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Search the raw CAN frames of a raw_frames_<name> store."
+    )
+    parser.add_argument("store", help="A raw_frames_<name> folder.")
+    parser.add_argument("query", choices=("ids", "match", "timing", "gaps"))
+    parser.add_argument("--id", type=_int, default=None, help="e.g. 0x100 or 256.")
+    parser.add_argument("--bus", type=int, default=None)
+    parser.add_argument("--pattern", default=None, help='Payload, e.g. "A0 ?? 1? FF".')
+    parser.add_argument("--mask", default=None, help="Payload mask in hex.")
+    parser.add_argument("--value", default=None, help="Payload value in hex.")
+    parser.add_argument("--factor", type=float, default=2.0, help="Gaps: x period.")
+    parser.add_argument("--min-gap", type=float, default=None, help="Gaps: seconds.")
+    parser.add_argument("--start", type=float, default=None, help="Seconds from start.")
+    parser.add_argument("--end", type=float, default=None, help="Seconds from start.")
+    parser.add_argument(
+        "--out", default=None, help="Save the result (.parquet, .feather or .csv)."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import src.exporters as exporters
+
+    args = parse_args()
+    store = FrameStore(args.store)
+    if args.query != "ids" and args.id is None:
+        raise SystemExit(f"{args.query} needs an --id")
+    if args.mask is not None and args.value is None and args.pattern is None:
+        raise SystemExit("--mask needs --value")
+    time_range = None
+    if args.start is not None or args.end is not None:
+        time_range = (args.start, args.end)
+
+    started = time.perf_counter()
+    if args.query == "ids":
+        result = store.ids()
+    elif args.query == "match":
+        result = store.match(
+            args.id,
+            pattern=args.pattern,
+            mask=args.mask,
+            value=args.value,
+            bus=args.bus,
+            time_range=time_range,
+        )
+    elif args.query == "timing":
+        result = pd.Series(store.timing(args.id, bus=args.bus, time_range=time_range))
+    else:
+        result = store.gaps(
+            args.id,
+            factor=args.factor,
+            min_gap_s=args.min_gap,
+            bus=args.bus,
+            time_range=time_range,
+        )
+    elapsed = time.perf_counter() - started
+
+    # Without markup, so brackets in the table are printed as they are.
+    Console().print(
+        result.to_string() if len(result) < 50 else str(result), markup=False
+    )
+    print(
+        f"[green]{len(result)} rows in {elapsed * 1000:.1f} ms over {len(store):,} frames"
+    )
+    if args.out:
+        exporters.write_table(
+            result if isinstance(result, pd.DataFrame) else result.to_frame("value"),
+            args.out,
+        )
+        print(f"[green]Saved to: [bold]{args.out}")
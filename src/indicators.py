@@ -0,0 +1,268 @@
+"""
+Single-pass, mergeable accumulators for the dashboard indicators.
+
+An `IndicatorAccumulator` takes a decoded log one chunk at a time (a DataFrame or a
+SignalStore) and keeps running totals for the runtime, the energy consumed and generated,
+and the distance travelled. CO2 and diesel savings are derived from the energy at the end.
+Each chunk is reduced with a handful of vectorised NumPy operations, and only the last
+timestamp of each integrated signal is carried over to the next chunk.
+
+Accumulators can be merged. Within one log (`contiguous=True`) the gap between the two
+parts is integrated as well. Across logs or vehicles the totals are simply added. The
+converter saves the state of each log to `indicators_<name>.json`, so fleet totals and
+the dashboard cards never need to read the exports again.
+
+This module does not import any other module of the package, so that the converter and
+the dashboard can both import it.
+"""
+
+import json
+import os
+import re
+from math import pi
+from typing import Dict, List, Optional
+
+import numpy as np
+from rich import print
+
+# VEHICLE_EFFICIENCY = 0.25  # for a litres per kwh of 0.459 for the vehicle.
+VEHICLE_EFFICIENCY = 0.4  # for an engine of good efficiency
+DIESEL_KWH_P_LITRE = 9.8
+GEAR_RATIO = 2 * pi / 60 / (6 * 2.741 * 4.75) * 0.5 * 3.6
+ELECTRICITY_COST_CHF_PER_KWh = 98 / 1000
+
+DEFAULT_COLUMNS = {
+    "voltage_col": "BMS_Pack_Inst_Voltage",
+    "current_col": "BMS_Pack_Current",
+    "gen_vol_col": "NLG_DcHvVoltAct",
+    "gen_cur_col": "NLG_DcHvCurrAct",
+    "speed_col": "EMB_Speed1",
+    # Derived channels (see src.alignment), used instead of voltage * current if present.
+    "power_col": "Battery_Power",
+    "gen_power_col": "Generator_Power",
+}
+
+
+def litres_diesel_to_co2_kg(litres: float):
+    """
+    From: https://connectedfleet.michelin.com/blog/calculate-co2-emissions/#:~:text=One%20litre%20of%20diesel%20creates,has%20emitted%20in%20a%20month.
+        - One litre of diesel creates 2.54kg of CO2. So you can simply multiply the number of litres you’ve used by 2.54 to work out how many kilograms of CO2 your fleet has emitted in a month
+    """
+    return litres * 2.54
+
+
+def kwh_to_l_diesel(kilowatt_hours: float):
+    # 9,8 kWh/Liter
+    return kilowatt_hours / (DIESEL_KWH_P_LITRE * VEHICLE_EFFICIENCY)
+
+
+def kwh_to_co2_saved(kilowatt_hours):
+    return litres_diesel_to_co2_kg(
+        litres=kwh_to_l_diesel(kilowatt_hours=kilowatt_hours)
+    )
+
+
+def get_indicator_settings(config: Dict) -> Dict:
+    indicators = config.get("indicators", {})
+    if type(indicators) is not dict:
+        print("[red]Config file has bad indicators settings. Using defaults instead.")
+        indicators = {}
+    return {
+        "enabled": bool(indicators.get("enabled", True)),
+        "diesel_cost_per_litre": float(indicators.get("diesel_cost_per_litre", 2)),
+        **{key: indicators.get(key, col) for key, col in DEFAULT_COLUMNS.items()},
+    }
+
+
+def indicators_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f"indicators_{name}.json")
+
+
+def indicators_for_export(export_file: str) -> Optional[str]:
+    """The indicators saved alongside a `filtered_<name>` export, if there are any."""
+    base = os.path.splitext(os.path.basename(export_file))[0]
+    name = re.sub(r"^filtered_", "", base)
+    path = indicators_path(os.path.dirname(export_file), name)
+    return path if os.path.exists(path) else None
+
+
+def _seconds(values: np.ndarray) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        return values.astype("datetime64[ns]").astype(np.int64) / 1e9
+    return values.astype(np.float64)
+
+
+class IndicatorAccumulator:
+    """
+    Running totals of one or more logs.
+
+    Each integrated quantity is summed as value * time since the previous sample of the
+    same quantity, the first sample of a log counting for nothing. `edges` keeps the
+    first sample and the last timestamp of each quantity so that two accumulators of
+    consecutive parts of one log can be merged exactly.
+    """
+
+    QUANTITIES = ("consumed_ws", "generated_ws", "distance_km")
+
+    def __init__(self, gear_ratio: float = GEAR_RATIO, **columns):
+        self.columns = {**DEFAULT_COLUMNS, **columns}
+        self.gear_ratio = gear_ratio
+        self.start = np.nan
+        self.end = np.nan
+        self.runtime_s = 0.0
+        self.logs = 0
+        self.totals = {q: 0.0 for q in self.QUANTITIES}
+        self.seen = {q: False for q in self.QUANTITIES}
+        self.edges: Dict[str, list] = {}
+
+    def _integrate(self, quantity: str, t: np.ndarray, v: np.ndarray, scale=1.0):
+        if not len(t):
+            return
+        self.seen[quantity] = True
+        edge = self.edges.get(quantity)
+        previous = t[0] if edge is None else edge[2]
+        dt = np.diff(t, prepend=previous)
+        self.totals[quantity] += float(np.dot(v, dt)) * scale
+        if edge is None:
+            self.edges[quantity] = [float(t[0]), float(v[0]) * scale, float(t[-1])]
+        else:
+            edge[2] = float(t[-1])
+
+    def update(self, chunk) -> "IndicatorAccumulator":
+        """Add the next chunk of the same log, given as a DataFrame or SignalStore."""
+        if not len(chunk):
+            return self
+        if hasattr(chunk, "time_range"):
+            start, end = chunk.time_range()
+        else:
+            start, end = _seconds(chunk.index.values[[0, -1]])
+        if self.logs == 0:
+            self.logs = 1
+        self.start = np.fmin(self.start, float(start))
+        self.end = np.fmax(self.end, float(end))
+        self.runtime_s = self.end - self.start
+
+        columns = chunk.columns
+        for quantity, (pwr, vol, cur) in (
+            ("consumed_ws", ("power_col", "voltage_col", "current_col")),
+            ("generated_ws", ("gen_power_col", "gen_vol_col", "gen_cur_col")),
+        ):
+            pwr, vol, cur = self.columns[pwr], self.columns[vol], self.columns[cur]
+            if pwr in columns:
+                # Voltage and current matched as-of by the converter.
+                power = chunk[pwr].dropna()
+            elif vol in columns and cur in columns:
+                power = (chunk[vol] * chunk[cur]).dropna()
+            else:
+                continue
+            self._integrate(quantity, _seconds(power.index.values), power.values)
+
+        speed_col = self.columns["speed_col"]
+        if speed_col in columns:
+            speed = chunk[speed_col].dropna()
+            self._integrate(
+                "distance_km",
+                _seconds(speed.index.values),
+                np.abs(speed.values),
+                scale=self.gear_ratio / 3600,
+            )
+        return self
+
+    def merge(
+        self, other: "IndicatorAccumulator", contiguous: bool = False
+    ) -> "IndicatorAccumulator":
+        """
+        Add the totals of `other`. With `contiguous`, `other` is the part of the same log
+        that directly follows this one, and the time between the two is integrated too.
+        """
+        for quantity in self.QUANTITIES:
+            self.totals[quantity] += other.totals[quantity]
+            self.seen[quantity] |= other.seen[quantity]
+            mine, theirs = self.edges.get(quantity), other.edges.get(quantity)
+            if contiguous and mine is not None and theirs is not None:
+                self.totals[quantity] += theirs[1] * (theirs[0] - mine[2])
+                mine[2] = theirs[2]
+            elif theirs is not None and (mine is None or not contiguous):
+                self.edges[quantity] = list(theirs)
+
+        if contiguous:
+            self.logs = max(self.logs, other.logs)
+            self.start = np.fmin(self.start, other.start)
+            self.end = np.fmax(self.end, other.end)
+            self.runtime_s = self.end - self.start
+        else:
+            self.logs += other.logs
+            self.start = np.fmin(self.start, other.start)
+            self.end = np.fmax(self.end, other.end)
+            self.runtime_s += other.runtime_s
+        return self
+
+    def results(self, diesel_cost_per_litre: float = 2) -> Dict[str, float]:
+        """Indicator values, -1 for the ones whose signals were never seen."""
+        consumed_kwh = self.totals["consumed_ws"] / 1000 / 60 / 60
+        generated_kwh = self.totals["generated_ws"] / 1000 / 60 / 60
+        if not self.seen["consumed_ws"]:
+            consumed_kwh = -1
+        if not self.seen["generated_ws"]:
+            generated_kwh = -1
+        distance_km = self.totals["distance_km"] if self.seen["distance_km"] else -1
+        return {
+            "runtime_s": self.runtime_s,
+            "consumed_kwh": consumed_kwh,
+            "generated_kwh": generated_kwh,
+            "distance_km": distance_km,
+            "co2_saved_kg": kwh_to_co2_saved(consumed_kwh),
+            "diesel_saved_l": kwh_to_l_diesel(consumed_kwh),
+            "diesel_cost_saved": kwh_to_l_diesel(consumed_kwh) * diesel_cost_per_litre,
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            "columns": self.columns,
+            "gear_ratio": self.gear_ratio,
+            "start": None if np.isnan(self.start) else self.start,
+            "end": None if np.isnan(self.end) else self.end,
+            "runtime_s": self.runtime_s,
+            "logs": self.logs,
+            "totals": self.totals,
+            "seen": self.seen,
+            "edges": self.edges,
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "IndicatorAccumulator":
+        acc = cls(gear_ratio=state["gear_ratio"], **state["columns"])
+        acc.start = np.nan if state["start"] is None else state["start"]
+        acc.end = np.nan if state["end"] is None else state["end"]
+        acc.runtime_s = state["runtime_s"]
+        acc.logs = state["logs"]
+        acc.totals.update(state["totals"])
+        acc.seen.update(state["seen"])
+        acc.edges = {q: list(e) for q, e in state["edges"].items()}
+        return acc
+
+    def save(self, path: str) -> str:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> "IndicatorAccumulator":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def accumulator_from_settings(settings: Dict) -> IndicatorAccumulator:
+    return IndicatorAccumulator(
+        **{key: settings[key] for key in DEFAULT_COLUMNS if key in settings}
+    )
+
+
+def merge_states(states: List[Dict]) -> Optional[IndicatorAccumulator]:
+    """Fleet totals of several logs from their saved states, None if there are none."""
+    fleet = None
+    for state in states:
+        log = IndicatorAccumulator.from_dict(state)
+        fleet = log if fleet is None else fleet.merge(log)
+    return fleet
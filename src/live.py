@@ -0,0 +1,304 @@
+"""
+Live CAN ingestion for bench and test-track work.
+
+A `LiveSession` reads frames from a python-can bus on a background thread, decodes them
+with the DBCs (cantools) and appends every signal to its own fixed-size `RingBuffer`.
+Memory stays constant however long the session runs: once a buffer is full the oldest
+samples are overwritten. Readers such as the dashboard's live view keep a cursor per
+signal and only pick up the samples written since their last read.
+
+Any python-can interface works. The `virtual` interface is a stand-in for a real bus,
+and `simulate_traffic` fills it with random frames of every DBC message:
+
+    python -m src.live --simulate --rate 8000 --duration 10
+
+prints the frame rate, decode rate and latency that the live view would see.
+"""
+
+import argparse
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import can
+import cantools
+import numpy as np
+import toml
+from rich import print
+
+
+def get_live_settings(config: Dict) -> Dict:
+    live = config.get("live", {})
+    if type(live) is not dict:
+        print("[red]Config file has bad live settings. Using defaults instead.")
+        live = {}
+    paths = config.get("paths", {}) if type(config.get("paths")) is dict else {}
+    return {
+        "dbcs_dir": paths.get("dbcs_dir", "./DBCs/"),
+        "interface": live.get("interface", "virtual"),
+        "channel": live.get("channel", "vcan0"),
+        "bitrate": live.get("bitrate", 500_000),
+        "buffer_samples": int(live.get("buffer_samples", 20_000)),
+        "update_ms": int(live.get("update_ms", 50)),
+    }
+
+
+def find_dbc_files(dbcs_dir: str) -> List[str]:
+    dbc_files = []
+    for root, dirs, files in os.walk(dbcs_dir):
+        for file in sorted(files):
+            if file.endswith(".dbc"):
+                dbc_files.append(os.path.join(root, file))
+    return dbc_files
+
+
+def load_messages(dbc_files: Iterable[str]) -> Dict[Tuple[int, bool], object]:
+    """cantools messages of all the DBCs keyed by (arbitration id, is extended)."""
+    messages = {}
+    for dbc_file in dbc_files:
+        try:
+            db = cantools.database.load_file(dbc_file, strict=False)
+        except Exception as e:
+            print(f"[yellow]⚠️Could not load DBC: {dbc_file} ({e})")
+            continue
+        for message in db.messages:
+            key = (message.frame_id, bool(message.is_extended_frame))
+            messages.setdefault(key, message)
+    return messages
+
+
+class RingBuffer:
+    """
+    Fixed-capacity (timestamp, value) buffer. `written` counts every sample ever
+    appended, so readers can ask for whatever arrived after the count they last saw.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.t = np.full(capacity, np.nan)
+        self.v = np.full(capacity, np.nan)
+        self.written = 0
+
+    def append(self, t: float, v: float) -> None:
+        i = self.written % self.capacity
+        self.t[i] = t
+        self.v[i] = v
+        self.written += 1
+
+    def since(self, cursor: int) -> Tuple[np.ndarray, np.ndarray, int]:
+        """Samples written after `cursor` (at most a full buffer) and the new cursor."""
+        written = self.written
+        start = max(cursor, written - self.capacity)
+        idx = np.arange(start, written) % self.capacity
+        return self.t[idx], self.v[idx], written
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        t, v, _ = self.since(0)
+        return t, v
+
+    @property
+    def nbytes(self) -> int:
+        return self.t.nbytes + self.v.nbytes
+
+
+class LiveSession:
+    """
+    Decode frames from a python-can bus into one ring buffer per signal.
+
+    `signals` limits decoding to the messages holding those signals; all DBC signals
+    are kept by default. Buffers are created for every signal of the decoded messages
+    up front, so no memory is allocated while the session runs.
+    """
+
+    def __init__(
+        self,
+        dbc_files: Iterable[str],
+        interface: str = "virtual",
+        channel: str = "vcan0",
+        bitrate: Optional[int] = None,
+        capacity: int = 20_000,
+        signals: Optional[Iterable[str]] = None,
+    ):
+        self.messages = load_messages(dbc_files)
+        if signals is not None:
+            wanted = set(signals)
+            self.messages = {
+                key: message
+                for key, message in self.messages.items()
+                if wanted & {s.name for s in message.signals}
+            }
+        self.buffers: Dict[str, RingBuffer] = {
+            s.name: RingBuffer(capacity)
+            for message in self.messages.values()
+            for s in message.signals
+        }
+        self.bus_kwargs = {"interface": interface, "channel": channel}
+        if bitrate and interface != "virtual":
+            self.bus_kwargs["bitrate"] = bitrate
+        self.capacity = capacity
+        self.frames = 0
+        self.decoded = 0
+        self.errors = 0
+        self.latency_s = 0.0
+        self.start_time = None
+        self._bus = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def signals(self) -> List[str]:
+        return list(self.buffers)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.nbytes for b in self.buffers.values())
+
+    def start(self) -> "LiveSession":
+        if self.running:
+            return self
+        self._bus = can.Bus(**self.bus_kwargs)
+        self._stop.clear()
+        self.start_time = time.time()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        if self._bus is not None:
+            self._bus.shutdown()
+            self._bus = None
+
+    def _run(self) -> None:
+        bus, messages, buffers = self._bus, self.messages, self.buffers
+        while not self._stop.is_set():
+            frame = bus.recv(timeout=0.1)
+            if frame is None or frame.is_error_frame or frame.is_remote_frame:
+                continue
+            self.frames += 1
+            message = messages.get((frame.arbitration_id, bool(frame.is_extended_id)))
+            if message is None:
+                continue
+            try:
+                values = message.decode(
+                    frame.data, decode_choices=False, allow_truncated=True
+                )
+            except Exception:
+                self.errors += 1
+                continue
+            t = frame.timestamp - self.start_time
+            for name, value in values.items():
+                buffers[name].append(t, float(value))
+            self.decoded += 1
+            self.latency_s = time.time() - frame.timestamp
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = time.time() - self.start_time if self.start_time else 0.0
+        return {
+            "frames": self.frames,
+            "decoded": self.decoded,
+            "errors": self.errors,
+            "frames_per_s": self.frames / elapsed if elapsed else 0.0,
+            "latency_ms": self.latency_s * 1000,
+            "buffer_mb": self.nbytes / 1024**2,
+        }
+
+
+def simulate_traffic(
+    messages: Iterable,
+    channel: str = "vcan0",
+    rate: float = 1000,
+    stop: Optional[threading.Event] = None,
+    duration: Optional[float] = None,
+) -> threading.Thread:
+    """
+    Send random frames of the given cantools messages on a virtual bus at about `rate`
+    frames per second, from a background thread, until `stop` is set or `duration` is
+    up.
+    """
+    messages = list(messages)
+    stop = stop or threading.Event()
+    rng = np.random.default_rng()
+
+    def run():
+        bus = can.Bus(interface="virtual", channel=channel)
+        # A random walk per byte keeps the signals readable on the plots.
+        payloads = [rng.integers(0, 256, m.length, dtype=np.uint8) for m in messages]
+        tick = 0.01
+        per_tick = max(int(rate * tick), 1)
+        end = time.time() + duration if duration else None
+        sent = 0
+        try:
+            while not stop.is_set() and (end is None or time.time() < end):
+                started = time.time()
+                for _ in range(per_tick):
+                    i = sent % len(messages)
+                    step = rng.integers(-1, 2, len(payloads[i]))
+                    payloads[i] = (payloads[i].astype(np.int16) + step).astype(np.uint8)
+                    bus.send(
+                        can.Message(
+                            arbitration_id=messages[i].frame_id,
+                            is_extended_id=messages[i].is_extended_frame,
+                            is_fd=messages[i].length > 8,
+                            data=payloads[i].tobytes(),
+                        )
+                    )
+                    sent += 1
+                time.sleep(max(tick - (time.time() - started), 0))
+        finally:
+            bus.shutdown()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Decode a live CAN bus.")
+    parser.add_argument("--config", default="./settings.toml")
+    parser.add_argument("--interface", default=None)
+    parser.add_argument("--channel", default=None)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="Send random frames of the DBC messages on the virtual bus.",
+    )
+    parser.add_argument("--rate", type=float, default=8000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(args.config) as f:
+        settings = get_live_settings(toml.load(f))
+    dbc_files = find_dbc_files(settings["dbcs_dir"])
+    session = LiveSession(
+        dbc_files,
+        interface=args.interface or settings["interface"],
+        channel=args.channel or settings["channel"],
+        bitrate=settings["bitrate"],
+        capacity=settings["buffer_samples"],
+    ).start()
+    if args.simulate:
+        simulate_traffic(
+            session.messages.values(), session.bus_kwargs["channel"], rate=args.rate
+        )
+
+    end = time.time() + args.duration
+    while time.time() < end:
+        time.sleep(1)
+        stats = session.stats()
+        print(
+            f"{stats['frames']:>9} frames  {stats['frames_per_s']:>7.0f} frames/s  "
+            f"{stats['decoded']:>9} decoded  latency {stats['latency_ms']:.1f} ms  "
+            f"buffers {stats['buffer_mb']:.1f} MB"
+        )
+    session.stop()
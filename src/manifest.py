@@ -0,0 +1,308 @@
+"""
+Incremental and resumable conversion.
+
+Every conversion writes `manifest_<name>.json` next to its exports. It records the
+content hash of the MF4 log, the hash of the DBC set and, for each output, a key made
+from the hashes and settings that output depends on:
+
+    raw_bytes   the log, the export settings and file format
+    raw_frames  the log
+    filtered    the log, the DBCs, the export settings, decoding engine, profiles and
+                derived channels
+    indicators  the filtered key and the [indicators] settings
+    lod         the filtered key and the [lod_pyramid] settings
+    stats       the filtered key and the [stats_index] settings
+
+When the converter runs again, an output is only redone when its key changed or the
+file is missing. A log whose outputs are all up to date is skipped without being
+opened, so re-syncing a folder of converted logs takes seconds. Content hashes are
+reused while a file's mtime and size match the manifest, like in `src.dbc_cache`.
+
+Streaming conversions of large logs also save their progress with a `Checkpoint` every
+`manifest.checkpoint_chunks` chunks. The exports are then written as segments under
+`.partial_<name>/` and joined once the last chunk is done. An interrupted conversion
+picks up again after the last saved chunk instead of starting over.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from rich import print
+
+import src.alignment as alignment
+import src.dbc_cache as dbc_cache
+import src.decoder as decoder
+import src.exporters as exporters
+import src.indicators as indicators
+import src.mf4_helpers as mf4_helpers
+import src.profiles as profiles
+import src.pyramid as pyramid
+import src.raw_store as raw_store
+import src.stats_index as stats_index
+
+# Bump when the meaning of the stage keys changes, so every log is converted again.
+MANIFEST_VERSION = 1
+
+# Stages that read the MF4 log, the others are derived from the filtered export.
+SOURCE_STAGES = ("raw_bytes", "raw_frames", "filtered")
+DERIVED_STAGES = ("indicators", "lod", "stats")
+
+# Content hashes of the files seen by this process: path -> ((mtime, size), sha256).
+_hashes: Dict[str, tuple] = {}
+
+
+def get_manifest_settings(config: Dict) -> Dict:
+    manifest = config.get("manifest", {})
+    if type(manifest) is not dict:
+        print("[red]Config file has bad manifest settings. Using defaults instead.")
+        manifest = {}
+    return {
+        "enabled": bool(manifest.get("enabled", True)),
+        "force": bool(manifest.get("force", False)),
+        "checkpoint_chunks": max(int(manifest.get("checkpoint_chunks", 50)), 0),
+    }
+
+
+def manifest_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f"manifest_{name}.json")
+
+
+def partial_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f".partial_{name}")
+
+
+def file_hash(path: str, known: Optional[Dict] = None) -> Dict:
+    """
+    Size, mtime and sha256 of a file. The hash is only computed when the mtime or size
+    differ from `known` (an earlier result) and from the last time this process saw it.
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    if known is not None and (known.get("mtime"), known.get("size")) == signature:
+        digest = known["sha256"]
+    else:
+        cached = _hashes.get(os.path.abspath(path))
+        if cached is not None and cached[0] == signature:
+            digest = cached[1]
+        else:
+            digest = dbc_cache.content_hash(path)
+    _hashes[os.path.abspath(path)] = (signature, digest)
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest}
+
+
+def dbc_set_hash(dbcs: Dict) -> str:
+    """One hash for the content and bus channels of every DBC in the mapping."""
+    digest = hashlib.sha256()
+    for bus_type in sorted(dbcs):
+        for name, bus_channel in sorted(dbcs[bus_type], key=lambda f: str(f[0])):
+            digest.update(f"{bus_type}:{bus_channel}:".encode())
+            digest.update(file_hash(name)["sha256"].encode())
+    return digest.hexdigest()
+
+
+def _key(*parts) -> str:
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def stage_keys(config: Dict, mf4_digest: str, dbc_digest: str) -> Dict[str, str]:
+    """Key of each enabled output, from everything that output depends on."""
+    export_settings = mf4_helpers.get_export_settings(config)
+    export_format = exporters.get_file_format(config)
+    keys = {
+        "raw_bytes": _key("raw_bytes", mf4_digest, export_settings, export_format),
+        "filtered": _key(
+            "filtered",
+            mf4_digest,
+            dbc_digest,
+            export_settings,
+            export_format,
+            # Only the engine changes the output, not the number of workers.
+            {"engine": decoder.get_decoding_settings(config)["engine"]},
+            profiles.active_patterns(config),
+            alignment.get_derived_settings(config),
+        ),
+    }
+    if raw_store.store_enabled(config):
+        keys["raw_frames"] = _key("raw_frames", mf4_digest)
+    indicator_settings = indicators.get_indicator_settings(config)
+    if indicator_settings["enabled"]:
+        keys["indicators"] = _key("indicators", keys["filtered"], indicator_settings)
+    lod_settings = pyramid.get_pyramid_settings(config)
+    if lod_settings["enabled"]:
+        keys["lod"] = _key("lod", keys["filtered"], lod_settings)
+    stats_settings = stats_index.get_stats_settings(config)
+    if stats_settings["enabled"]:
+        keys["stats"] = _key("stats", keys["filtered"], stats_settings)
+    return keys
+
+
+def stage_outputs(config: Dict, export_dir: str, name: str) -> Dict[str, str]:
+    file_format = exporters.get_file_format(config)["file_format"]
+    return {
+        "raw_bytes": exporters.export_path(export_dir, "raw_bytes", name, file_format),
+        "raw_frames": raw_store.store_path(export_dir, name),
+        "filtered": exporters.export_path(export_dir, "filtered", name, file_format),
+        "indicators": indicators.indicators_path(export_dir, name),
+        "lod": pyramid.pyramid_path(export_dir, name),
+        "stats": stats_index.stats_path(export_dir, name),
+    }
+
+
+class Manifest:
+    """
+    What a conversion of one log has to redo. `todo` holds the stages whose key changed
+    or whose output is missing, all of them when the manifest is off or forced.
+    """
+
+    def __init__(self, mf4_file: str, dbcs: Dict, config: Dict, export_dir: str):
+        self.name = os.path.splitext(os.path.basename(mf4_file))[0]
+        self.settings = get_manifest_settings(config)
+        self.path = manifest_path(export_dir, self.name)
+        self.partial_dir = partial_path(export_dir, self.name)
+        self.source = os.path.abspath(mf4_file)
+        self.previous = None
+        if not self.settings["enabled"]:
+            # Nothing to compare against, so the log is not hashed at all.
+            self.mf4, self.dbcs = None, None
+            self.keys = stage_keys(config, "", "")
+        else:
+            self.previous = self.load()
+            known = self.previous["mf4"] if self.previous else None
+            self.mf4 = file_hash(mf4_file, known)
+            self.dbcs = dbc_set_hash(dbcs)
+            self.keys = stage_keys(config, self.mf4["sha256"], self.dbcs)
+        all_outputs = stage_outputs(config, export_dir, self.name)
+        self.outputs = {stage: all_outputs[stage] for stage in self.keys}
+
+        done = self.previous["stages"] if self.previous else {}
+        self.todo = {
+            stage
+            for stage, key in self.keys.items()
+            if self.settings["force"]
+            or done.get(stage, {}).get("key") != key
+            or not os.path.exists(self.outputs[stage])
+        }
+
+    def load(self) -> Optional[Dict]:
+        try:
+            with open(self.path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if previous.get("version") != MANIFEST_VERSION:
+            return None
+        return previous
+
+    def up_to_date(self) -> bool:
+        return not self.todo
+
+    def checkpoint(self, chunk_records: int, n_chunks: int) -> Optional["Checkpoint"]:
+        """
+        Progress store for a streaming conversion of `n_chunks` chunks. None when
+        checkpoints are off or the log is done before the first one would be saved.
+        """
+        every_chunks = self.settings["checkpoint_chunks"]
+        if not self.settings["enabled"] or not every_chunks or n_chunks <= every_chunks:
+            return None
+        stages = sorted(self.todo & set(SOURCE_STAGES))
+        key = _key([self.keys[s] for s in stages], chunk_records)
+        return Checkpoint(self.partial_dir, key, every_chunks)
+
+    def invalidate(self) -> None:
+        """
+        Drop the stages about to be redone from the saved manifest first, so a run
+        interrupted while rewriting them never leaves them marked as up to date.
+        """
+        if self.previous:
+            self.save({}, redone=())
+
+    def save(self, outputs: Dict[str, str], redone: Iterable[str]) -> Optional[str]:
+        if not self.settings["enabled"]:
+            return None
+        done = self.previous["stages"] if self.previous else {}
+        stages = {}
+        for stage, key in self.keys.items():
+            if stage in redone:
+                stages[stage] = {"key": key, "path": outputs[stage]}
+            elif stage not in self.todo:
+                stages[stage] = done[stage]
+        _write_json(
+            self.path,
+            {
+                "version": MANIFEST_VERSION,
+                "source": self.source,
+                "mf4": self.mf4,
+                "dbcs": self.dbcs,
+                "converted": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                "redone": sorted(redone),
+                "stages": stages,
+            },
+        )
+        return self.path
+
+
+class Checkpoint:
+    """
+    Progress of a streaming conversion: how many chunks are done and which export
+    segments hold them. Kept in `directory` until `finish`, and thrown away when the
+    key (the inputs of the stages being redone) no longer matches.
+    """
+
+    def __init__(self, directory: str, key: str, every_chunks: int):
+        self.directory = directory
+        self.key = key
+        self.every_chunks = every_chunks
+        state = None
+        try:
+            with open(os.path.join(directory, "progress.json")) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if state is None or state.get("key") != key:
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+            state = {"key": key, "chunks": 0, "frames": 0, "segments": {}}
+        self.chunks: int = state["chunks"]
+        self.frames: int = state["frames"]
+        self.segments: Dict[str, List[str]] = state["segments"]
+
+    def segment_path(self, stage: str, file_format: str) -> str:
+        n = len(self.segments.get(stage, []))
+        return os.path.join(self.directory, f"{stage}_{n:05d}{file_format}")
+
+    def due(self, chunks: int) -> bool:
+        return chunks - self.chunks >= self.every_chunks
+
+    def commit(self, chunks: int, frames: int, segments: Dict[str, str]) -> None:
+        """Record that the first `chunks` chunks are written, in these new segments."""
+        for stage, path in segments.items():
+            self.segments.setdefault(stage, []).append(os.path.basename(path))
+        self.chunks, self.frames = chunks, frames
+        _write_json(
+            os.path.join(self.directory, "progress.json"),
+            {
+                "key": self.key,
+                "chunks": chunks,
+                "frames": frames,
+                "segments": self.segments,
+            },
+        )
+
+    def parts(self, stage: str) -> List[str]:
+        return [os.path.join(self.directory, p) for p in self.segments.get(stage, [])]
+
+    def finish(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _write_json(path: str, data: Dict) -> None:
+    """Write through a temporary file, so an interrupted run never leaves half a file."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(temporary, path)
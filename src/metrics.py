@@ -0,0 +1,290 @@
+"""
+Stage-level metrics of conversions and dashboard callbacks.
+
+A `Metrics` collects, for every named stage, the number of calls, wall and CPU time,
+peak resident memory and whatever counts the stage reports (frames, signals, bytes
+written). A stage that runs once per chunk, like decoding in streaming mode, adds up
+over its calls. Each conversion saves its metrics to `metrics_<name>.json` next to the
+exports, so a slow conversion can be traced to DBC loading, MF4 parsing, decoding or
+writing. With `metrics.profiler` set to "cprofile" or "pyinstrument" (or `--profiler`
+on `mf4_to_csv.py`), the whole conversion is also profiled to `profile_<name>.prof`
+or `profile_<name>.html`.
+
+The dashboard wraps its callbacks with `Metrics.timed` and shows their latency in the
+sidebar. CPU time is that of the whole process, so it includes other threads.
+This module does not import any other module of the package, so that the converter and
+the dashboard can both import it.
+"""
+
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from rich import print
+from rich.table import Table
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+def get_metrics_settings(config: Dict) -> Dict:
+    metrics = config.get("metrics", {})
+    if type(metrics) is not dict:
+        print("[red]Config file has bad metrics settings. Using defaults instead.")
+        metrics = {}
+    profiler = metrics.get("profiler", "") or None
+    if profiler is not None and profiler not in PROFILERS:
+        print(f"[red]Unknown profiler '{profiler}'. Not profiling.")
+        profiler = None
+    return {"enabled": bool(metrics.get("enabled", True)), "profiler": profiler}
+
+
+def metrics_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f"metrics_{name}.json")
+
+
+def profile_path(export_dir: str, name: str, profiler: str) -> str:
+    extension = ".prof" if profiler == "cprofile" else ".html"
+    return os.path.join(export_dir, f"profile_{name}{extension}")
+
+
+def path_bytes(path: str) -> int:
+    """Size of a file, or of every file under a directory such as a raw frame store."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def rss_bytes() -> int:
+    """Current resident memory of this process, 0 where it cannot be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # No /proc (macOS): fall back to the high-water mark, in bytes there.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRss:
+    """Highest resident memory seen while the `with` block runs, sampled in a thread."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, rss_bytes())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakRss":
+        self.peak = rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+class Metrics:
+    """
+    Per-stage wall time, CPU time, peak memory and counts of one run, or of every call
+    of a set of callbacks. Safe to use from several threads.
+    """
+
+    COUNTS = ("frames", "signals", "bytes_written")
+
+    def __init__(self, name: str = "", sample_memory: bool = True):
+        self.name = name
+        self.sample_memory = sample_memory
+        self.started = datetime.now(timezone.utc)
+        self.wall_s = None
+        self.stages: Dict[str, Dict] = {}
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def _stage(self, name: str) -> Dict:
+        if name not in self.stages:
+            self.stages[name] = {
+                "calls": 0,
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "max_wall_s": 0.0,
+                "last_wall_s": 0.0,
+                "peak_rss_mb": 0.0,
+            }
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name: str, **counts):
+        """Time the `with` block as (another call of) stage `name`, adding `counts`."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        rss = PeakRss() if self.sample_memory else None
+        if rss is not None:
+            rss.__enter__()
+        try:
+            yield
+        finally:
+            if rss is not None:
+                rss.__exit__(None, None, None)
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            with self._lock:
+                stage = self._stage(name)
+                stage["calls"] += 1
+                stage["wall_s"] += wall
+                stage["cpu_s"] += cpu
+                stage["max_wall_s"] = max(stage["max_wall_s"], wall)
+                stage["last_wall_s"] = wall
+                if rss is not None:
+                    stage["peak_rss_mb"] = max(stage["peak_rss_mb"], rss.peak / 1024**2)
+            self.count(name, **counts)
+
+    def count(self, name: str, **counts) -> None:
+        """Add to the counts of a stage, e.g. `count("write", bytes_written=n)`."""
+        with self._lock:
+            stage = self._stage(name)
+            for key, value in counts.items():
+                stage[key] = stage.get(key, 0) + int(value)
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """Yield from `iterable`, timing each step as a call of stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def timed(self, name: str) -> Callable:
+        """Decorator timing every call of a function as stage `name`."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def finish(self) -> "Metrics":
+        self.wall_s = time.perf_counter() - self._start
+        return self
+
+    def to_dict(self) -> Dict:
+        stages = {}
+        with self._lock:
+            for name, stage in self.stages.items():
+                stage = dict(stage)
+                for key in ("wall_s", "cpu_s", "max_wall_s", "last_wall_s"):
+                    stage[key] = round(stage[key], 6)
+                stage["peak_rss_mb"] = round(stage["peak_rss_mb"], 1)
+                if stage.get("frames") and stage["wall_s"]:
+                    stage["frames_per_s"] = round(stage["frames"] / stage["wall_s"], 1)
+                stages[name] = stage
+        wall_s = self.wall_s
+        if wall_s is None:
+            wall_s = time.perf_counter() - self._start
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_s": round(wall_s, 6),
+            "peak_rss_mb": max((s["peak_rss_mb"] for s in stages.values()), default=0),
+            "stages": stages,
+        }
+
+    def save(self, path: str) -> str:
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return path
+
+    def summary(self) -> str:
+        """One line per stage, for the dashboard."""
+        lines = []
+        for name, stage in self.to_dict()["stages"].items():
+            mean = stage["wall_s"] / stage["calls"] if stage["calls"] else 0
+            lines.append(
+                f"{name}: last {stage['last_wall_s']:.2f} s · mean {mean:.2f} s · "
+                f"max {stage['max_wall_s']:.2f} s ({stage['calls']})"
+            )
+        return "  \n".join(lines)
+
+
+def print_report(report: Dict) -> None:
+    table = Table(title=f"{report['name']} ({report['wall_s']:.2f} s)")
+    for column in ("Stage", "Calls", "Wall (s)", "CPU (s)", "Peak RSS (MB)", "Counts"):
+        table.add_column(
+            column, justify="left" if column in ("Stage", "Counts") else "right"
+        )
+    for name, stage in report["stages"].items():
+        counts = " · ".join(
+            f"{stage[key]:,} {key.replace('_', ' ')}"
+            for key in Metrics.COUNTS
+            if stage.get(key)
+        )
+        table.add_row(
+            name,
+            str(stage["calls"]),
+            f"{stage['wall_s']:.3f}",
+            f"{stage['cpu_s']:.3f}",
+            f"{stage['peak_rss_mb']:.0f}",
+            counts,
+        )
+    print(table)
+
+
+@contextmanager
+def profiled(profiler: Optional[str], path: str):
+    """Profile the `with` block with cProfile or pyinstrument into `path`, if asked to."""
+    if profiler is None:
+        yield
+        return
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("[yellow]⚠️pyinstrument is not installed. Not profiling.")
+            yield
+            return
+        session = Profiler()
+        session.start()
+        try:
+            yield
+        finally:
+            session.stop()
+            with open(path, "w") as f:
+                f.write(session.output_html())
+        return
+
+    session = cProfile.Profile()
+    session.enable()
+    try:
+        yield
+    finally:
+        session.disable()
+        session.dump_stats(path)
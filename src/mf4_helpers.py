@@ -1,10 +1,14 @@
+import os
 from datetime import datetime
-from typing import Dict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
 import pandas as pd
 import toml
-from asammdf import MDF
+from asammdf import MDF, Signal, types
 from rich import print
 
+CAN_FRAME_CHANNEL = "CAN_DataFrame"
+
 
 def get_config(config_path="./settings.toml"):
     with open(config_path, "r") as f:
@@ -13,20 +17,62 @@ def get_config(config_path="./settings.toml"):
     return config
 
 
-def mdf_to_df(mf4: MDF, config: Dict[str, str]):
+def get_paths(config: Dict) -> Dict[str, str]:
+    paths = config.get("paths", {})
+    if type(paths) is not dict:
+        print(
+            "[yellow]⚠️Paths not setup in the settings. Using defaults. Otherwise, add a [paths] section to include."
+        )
+        paths = {}
+    return {
+        "dbcs_dir": paths.get("dbcs_dir", "./DBCs/"),
+        "data_files": paths.get("data_files", "./data_files/"),
+        "export_dir": paths.get("export_dir", "./processed_files/"),
+        "cache_dir": paths.get("cache_dir", "./.cache/"),
+    }
+
+
+def load_dbc_files(
+    dbc_database_dir: str,
+) -> Dict[types.BusType, Iterable[types.DbcFileType]]:
+    """
+    Walk the DBC folder (including submodules) and build the database mapping
+    that `MDF.extract_bus_logging` expects.
+    """
+    dbc_files: List[types.DbcFileType] = []
+    for root, dirs, files in os.walk(dbc_database_dir):
+        for file in sorted(files):
+            if file.endswith(".dbc"):
+                dbc_files.append((os.path.join(root, file), 0))
+
+    return {
+        "CAN": dbc_files,
+        "LIN": [],
+    }
+
+
+def find_mf4_files(data_dir: str) -> List[str]:
+    mf4_files = []
+    for root, dirs, files in os.walk(data_dir):
+        for file in sorted(files):
+            if os.path.splitext(file)[1].lower() == ".mf4":
+                mf4_files.append(os.path.join(root, file))
+    return mf4_files
+
+
+def get_export_settings(config: Dict) -> Dict[str, bool]:
     export_settings = config.get("export_settings", {})
     if type(export_settings) is not dict:
         print("[red]Config file has bad export settings. Using defaults instead.")
         export_settings = {}
-    basenames = bool(export_settings.get("only_basenames", False))
-    interpolate = bool(export_settings.get("use_interpolation", False))
-    date = bool(export_settings.get("timestamps_as_date", False))
+    return {
+        "only_basenames": bool(export_settings.get("only_basenames", False)),
+        "use_interpolation": bool(export_settings.get("use_interpolation", False)),
+        "timestamps_as_date": bool(export_settings.get("timestamps_as_date", False)),
+    }
 
-    df = mf4.to_dataframe(
-        time_as_date=date, only_basenames=basenames, use_interpolation=interpolate
-    )
-    start_time = mf4.start_time
 
+def add_date_column(df: pd.DataFrame, start_time: datetime) -> pd.DataFrame:
     if type(df.index[0]) is datetime:
         deltas = df.index - df.index[0]
     else:
@@ -35,10 +81,120 @@ def mdf_to_df(mf4: MDF, config: Dict[str, str]):
     return df
 
 
+def mdf_to_df(mf4: MDF, config: Dict[str, str]):
+    export_settings = get_export_settings(config)
+
+    df = mf4.to_dataframe(
+        time_as_date=export_settings["timestamps_as_date"],
+        only_basenames=export_settings["only_basenames"],
+        use_interpolation=export_settings["use_interpolation"],
+    )
+    return add_date_column(df, mf4.start_time)
+
+
+# "0xAB " for every byte value, so a payload matrix can be formatted with one lookup.
+_HEX_BYTES = np.frombuffer(
+    "".join(f"0x{b:02X} " for b in range(256)).encode("ascii"), dtype=np.uint8
+).reshape(256, 5)
+
+
+def hex_payload(payload: np.ndarray) -> np.ndarray:
+    """
+    Format an (N, width) uint8 payload matrix as "0xA0 0x0F ..." strings, one per row.
+    The text of every row is built with one table lookup over the whole matrix, and
+    only decoding each row's bytes to a str is left to a Python loop. That was faster
+    than `.astype("U")`, which still has to create a str object per row.
+    """
+    n_rows, width = payload.shape
+    if not n_rows or not width:
+        return np.full(n_rows, "", dtype=object)
+    chars = _HEX_BYTES[payload].reshape(n_rows, width * 5)[:, :-1]
+    rows = np.ascontiguousarray(chars).view(f"S{width * 5 - 1}").ravel()
+    return np.array([row.decode("ascii") for row in rows.tolist()], dtype=object)
+
+
 def mdf_to_raw_bytes(df_mf4: pd.DataFrame, config: Dict[str, str]):
-    # Displaying the data as bytes
-    df_display = df_mf4.copy()
-    df_display["CAN_DataFrame.CAN_DataFrame.DataBytes"] = df_display[
-        "CAN_DataFrame.CAN_DataFrame.DataBytes"
-    ].apply(lambda x: " ".join(f"0x{b:02X}" for b in x))
+    # Displaying the data as bytes. The shallow copy shares every other column with
+    # df_mf4, only the DataBytes column is replaced.
+    df_display = df_mf4.copy(deep=False)
+    data_bytes = df_display["CAN_DataFrame.CAN_DataFrame.DataBytes"]
+    if len(data_bytes):
+        payload = np.stack(data_bytes.values).astype(np.uint8, copy=False)
+        df_display["CAN_DataFrame.CAN_DataFrame.DataBytes"] = hex_payload(payload)
     return df_display
+
+
+def can_data_groups(mdf: MDF) -> List[int]:
+    """Indexes of the channel groups that hold raw CAN data frames."""
+    return [
+        i
+        for i, group in enumerate(mdf.groups)
+        if CAN_FRAME_CHANNEL in [ch.name for ch in group.channels]
+        and group.channel_group.cycles_nr
+    ]
+
+
+def first_timestamp(mdf: MDF, groups: Iterable[int]) -> float:
+    """Earliest timestamp over the given groups, used as the zero for every chunk."""
+    firsts = []
+    for group in groups:
+        master = mdf.get_master(group, record_offset=0, record_count=1)
+        if len(master):
+            firsts.append(master[0])
+    return float(np.amin(firsts)) if firsts else 0.0
+
+
+def iter_raw_chunks(
+    mdf: MDF,
+    chunk_records: int,
+    groups: Optional[List[int]] = None,
+    start_chunk: int = 0,
+) -> Iterator[Signal]:
+    """
+    Yield the structured `CAN_DataFrame` signal `chunk_records` records at a time.
+    Only one chunk is read from the file at once. The first `start_chunk` chunks are
+    skipped without being read.
+    """
+    if groups is None:
+        groups = can_data_groups(mdf)
+    index = 0
+    for group in groups:
+        cycles = mdf.groups[group].channel_group.cycles_nr
+        for record_offset in range(0, cycles, chunk_records):
+            index += 1
+            if index <= start_chunk:
+                continue
+            yield mdf.get(
+                CAN_FRAME_CHANNEL,
+                group=group,
+                record_offset=record_offset,
+                record_count=min(chunk_records, cycles - record_offset),
+            )
+
+
+def frame_arrays(
+    chunk: Signal,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Split a structured `CAN_DataFrame` chunk into t, bus, id, ide and payload arrays."""
+    samples = chunk.samples
+    names = samples.dtype.names
+    ids = samples[f"{CAN_FRAME_CHANNEL}.ID"].astype("<u4")
+    if f"{CAN_FRAME_CHANNEL}.IDE" in names:
+        ide = samples[f"{CAN_FRAME_CHANNEL}.IDE"].astype("<u1")
+    else:
+        ide = ((ids & 0x80000000) >> 31).astype("<u1")
+    ids = ids & 0x1FFFFFFF
+    bus = samples[f"{CAN_FRAME_CHANNEL}.BusChannel"].astype("<u1")
+    payload = samples[f"{CAN_FRAME_CHANNEL}.DataBytes"].astype("<u1")
+    return chunk.timestamps, bus, ids, ide, payload
+
+
+def export_index(
+    timestamps: np.ndarray, origin: float, start_time, export_settings: Dict
+) -> pd.Index:
+    if export_settings["timestamps_as_date"]:
+        index = start_time + pd.to_timedelta(timestamps, unit="s")
+    else:
+        index = pd.Index(timestamps - origin)
+    index.name = "timestamps"
+    return index
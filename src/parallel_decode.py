@@ -0,0 +1,140 @@
+"""
+Decoding one block of raw frames on several processes.
+
+Whichever engine is used, a single log is decoded on one core. With `decoding.workers`
+above 1, a `ParallelDecoder` sorts the frames of a block by (bus, IDE, arbitration id),
+as `decoder.group_frames` does, copies them in that order into one shared memory block
+and cuts it into contiguous partitions of about the same number of frames. Each worker
+process maps the arrays of its partition, decodes them with the engine's
+`decode_frames` and only sends the decoded table back, so the raw frames are never
+pickled. A partition holds whole ID groups, except at its edges where one group may be
+split in time, which decodes the same. The tables come back in key order, so merging
+them gives the same result as decoding the whole block in one go.
+
+The DBC tables are handed to the workers once, when the pool starts. Blocks too small
+to give every worker `MIN_PARTITION_FRAMES` frames are decoded in this process.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import src.decoder as decoder
+
+MIN_PARTITION_FRAMES = 25_000
+
+# Order of the frame arrays taken by every `decode_frames`.
+FIELDS = ("t", "bus", "ids", "ide", "payload")
+
+# Set in each worker by `_init_worker`.
+_worker: Dict = {}
+
+# name -> (dtype, shape, byte offset) of the arrays in a shared memory block
+Layout = Dict[str, Tuple[str, Tuple[int, ...], int]]
+
+
+def _init_worker(decode: Callable, databases) -> None:
+    _worker["decode"] = decode
+    _worker["databases"] = databases
+
+
+def _views(block: shared_memory.SharedMemory, layout: Layout) -> Dict[str, np.ndarray]:
+    return {
+        name: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+        for name, (dtype, shape, offset) in layout.items()
+    }
+
+
+def _decode_partition(
+    block_name: str, layout: Layout, start: int, stop: int
+) -> pd.DataFrame:
+    block = shared_memory.SharedMemory(name=block_name)
+    views = _views(block, layout)
+    try:
+        # The decoders pick the frames of each message with fancy indexing, so the
+        # result holds copies and nothing points into the block once it returns.
+        return _worker["decode"](
+            *(views[name][start:stop] for name in FIELDS), _worker["databases"]
+        )
+    finally:
+        del views
+        block.close()
+
+
+class ParallelDecoder:
+    """
+    Drop-in for a `decode_frames(t, bus, ids, ide, payload, databases)` function that
+    decodes large blocks over `workers` processes. Use it as a context manager, or
+    `close` it, to stop the workers.
+    """
+
+    def __init__(self, decode: Callable, databases, workers: int):
+        self.decode_frames = decode
+        self.databases = databases
+        self.workers = workers
+        self.pool = None
+        if workers > 1:
+            # Workers forked before the resource tracker runs would each start their
+            # own, which then unlinks the shared blocks they attached to on exit.
+            resource_tracker.ensure_running()
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(decode, databases),
+            )
+            # Start the workers now, before the conversion starts any thread of its
+            # own, rather than forking them from a pipeline thread later on.
+            self.pool.submit(int).result()
+
+    def decode(
+        self,
+        t: np.ndarray,
+        bus: np.ndarray,
+        ids: np.ndarray,
+        ide: np.ndarray,
+        payload: np.ndarray,
+        databases=None,
+    ) -> pd.DataFrame:
+        """Same as the wrapped `decode_frames`, with the DBCs given to the workers."""
+        n_partitions = min(self.workers, len(t) // MIN_PARTITION_FRAMES)
+        if self.pool is None or n_partitions <= 1:
+            return self.decode_frames(t, bus, ids, ide, payload, self.databases)
+
+        order = np.argsort(decoder.frame_codes(bus, ids, ide), kind="stable")
+        arrays = dict(zip(FIELDS, (t, bus, ids, ide, payload)))
+        layout, size = {}, 0
+        for name, array in arrays.items():
+            layout[name] = (array.dtype.str, array.shape, size)
+            size += -(-array.nbytes // 8) * 8
+        block = shared_memory.SharedMemory(create=True, size=size)
+        try:
+            views = _views(block, layout)
+            try:
+                for name, array in arrays.items():
+                    np.take(array, order, axis=0, out=views[name])
+            finally:
+                del views
+            bounds = np.linspace(0, len(t), n_partitions + 1).astype(int)
+            futures = [
+                self.pool.submit(_decode_partition, block.name, layout, start, stop)
+                for start, stop in zip(bounds[:-1], bounds[1:])
+            ]
+            frames: List[pd.DataFrame] = [future.result() for future in futures]
+        finally:
+            block.close()
+            block.unlink()
+        return decoder.merge_message_frames([df for df in frames if len(df)])
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,169 @@
+"""
+Overlapping the stages of a conversion.
+
+Without a pipeline every chunk is read, decoded, formatted and written before the next
+one is read, so the disk waits while the CPU decodes and the other way round. A
+`Pipeline` runs each stage on its own thread, joined to the next by a queue holding at
+most `depth` chunks. Reading the next chunk, decoding the current one and writing the
+previous one then happen at the same time, and a conversion takes about as long as its
+slowest stage instead of the sum of them all. NumPy, pandas, pyarrow and file writes
+release the GIL for most of their work, so threads are enough and the chunks never
+have to be copied between processes.
+
+Stages form a tree: `pipeline.stage(...)` adds a stage fed with every item passed to
+`pipeline.put`, and `stage.then(...)` one fed with whatever its parent returns (nothing
+when it returns None). Every stage handles its items in order. With `pipeline.depth`
+set to 0 in the settings no thread is started and `put` runs the stages one after
+another.
+
+    with Pipeline(depth=2) as pipeline:
+        decoded = pipeline.stage("decode", decode_chunk)
+        decoded.then("write", write_decoded)
+        for chunk in chunks:
+            pipeline.put(chunk)
+
+The first exception raised in a stage is raised again by the next `put`, `drain` or on
+leaving the `with` block.
+"""
+
+import queue
+import threading
+from typing import Callable, Dict, List, Optional
+
+from rich import print
+
+_DONE = object()
+
+
+def get_pipeline_settings(config: Dict) -> Dict:
+    settings = config.get("pipeline", {})
+    if type(settings) is not dict:
+        print("[red]Config file has bad pipeline settings. Using defaults instead.")
+        settings = {}
+    return {"depth": max(int(settings.get("depth", 2)), 0)}
+
+
+class Stage:
+    def __init__(self, pipeline: "Pipeline", name: str, function: Callable):
+        self.pipeline = pipeline
+        self.name = name
+        self.function = function
+        self.downstream: List["Stage"] = []
+        self.queue = queue.Queue(maxsize=pipeline.depth) if pipeline.depth else None
+        self.thread: Optional[threading.Thread] = None
+
+    def then(self, name: str, function: Callable) -> "Stage":
+        """Add a stage handling what this one returns."""
+        stage = self.pipeline._add(name, function)
+        self.downstream.append(stage)
+        return stage
+
+    def put(self, item) -> None:
+        if self.queue is None:
+            self._run(item)
+        else:
+            self.queue.put(item)
+
+    def _run(self, item) -> None:
+        result = self.function(item)
+        if result is not None:
+            for stage in self.downstream:
+                stage.put(result)
+
+    def _work(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _DONE:
+                    return
+                # After a failure the queue is still emptied, so nothing upstream
+                # blocks on it, but the items are dropped.
+                if not self.pipeline.failed.is_set():
+                    self._run(item)
+            except BaseException as e:
+                self.pipeline._fail(e)
+            finally:
+                self.queue.task_done()
+
+
+class Pipeline:
+    """Stages on their own threads, joined by queues of at most `depth` items."""
+
+    def __init__(self, depth: int = 2):
+        self.depth = max(int(depth), 0)
+        self.stages: List[Stage] = []
+        self.roots: List[Stage] = []
+        self.failed = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.started = False
+        self._lock = threading.Lock()
+
+    def _add(self, name: str, function: Callable) -> Stage:
+        if self.started:
+            raise RuntimeError("Cannot add a stage to a running pipeline")
+        stage = Stage(self, name, function)
+        self.stages.append(stage)
+        return stage
+
+    def stage(self, name: str, function: Callable) -> Stage:
+        """Add a stage handling every item passed to `put`."""
+        stage = self._add(name, function)
+        self.roots.append(stage)
+        return stage
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            if self.error is None:
+                self.error = error
+        self.failed.set()
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def start(self) -> None:
+        """Start the stage threads, done by the first `put`."""
+        if self.started:
+            return
+        self.started = True
+        if not self.depth:
+            return
+        for stage in self.stages:
+            stage.thread = threading.Thread(
+                target=stage._work, name=f"pipeline-{stage.name}", daemon=True
+            )
+            stage.thread.start()
+
+    def put(self, item) -> None:
+        self.start()
+        self.check()
+        for stage in self.roots:
+            stage.put(item)
+
+    def drain(self) -> None:
+        """Wait until every item put so far went through every stage."""
+        if self.depth and self.started:
+            # Stages are added after the stage feeding them, so once the queues
+            # before a stage are done nothing more can reach it.
+            for stage in self.stages:
+                stage.queue.join()
+        self.check()
+
+    def close(self) -> None:
+        """Let every stage finish its items and stop the threads."""
+        for stage in self.stages:
+            if stage.thread is not None:
+                stage.queue.put(_DONE)
+                stage.thread.join()
+                stage.thread = None
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            # Already failing, drop the queued items rather than handle them.
+            self.failed.set()
+        self.close()
+        if exc_type is None:
+            self.check()
@@ -0,0 +1,168 @@
+"""
+Named signal profiles.
+
+Most jobs only look at a few signals: the dashboard uses the `BMS_*`, `NLG_*` and
+`EMB_*` ones, a thermal review only the temperatures. A profile names such a set in the
+`[profiles]` section of `settings.toml` as shell-style patterns on signal names:
+
+    [profiles]
+    dashboard = ["BMS_*", "NLG_*", "EMB_*"]
+    thermal = ["*Temperature*"]
+
+With `decoding.profiles = ["dashboard"]` (or `--profile dashboard`) the DBC messages are
+narrowed down to those holding a matching signal before anything is decoded, and only
+the matching signals of those messages are decoded and exported. The other frames are
+skipped without being looked at. The helpers below narrow each kind of parsed DBC the
+decoders use: the NumPy decoder's lookup, canmatrix databases and the message tables of
+the streaming decoder.
+"""
+
+import copy
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, List, Optional
+
+from asammdf.blocks.utils import load_can_database
+from canmatrix import CanMatrix
+from rich import print
+
+
+def get_profile_settings(config: Dict) -> Dict:
+    profiles = config.get("profiles", {})
+    if type(profiles) is not dict:
+        print("[red]Config file has bad profiles settings. Using defaults instead.")
+        profiles = {}
+    profiles = {
+        name: [patterns] if isinstance(patterns, str) else list(patterns)
+        for name, patterns in profiles.items()
+    }
+    decoding = config.get("decoding", {})
+    active = decoding.get("profiles", []) if type(decoding) is dict else []
+    return {
+        "profiles": profiles,
+        "active": [active] if isinstance(active, str) else list(active),
+    }
+
+
+def profile_patterns(config: Dict, names: Iterable[str]) -> List[str]:
+    """Patterns of the named profiles together. Unknown names are reported and skipped."""
+    profiles = get_profile_settings(config)["profiles"]
+    patterns = []
+    for name in names:
+        if name not in profiles:
+            print(f"[red]Unknown signal profile '{name}'. Skipping it.")
+            continue
+        patterns.extend(p for p in profiles[name] if p not in patterns)
+    return patterns
+
+
+def active_patterns(config: Dict) -> Optional[List[str]]:
+    """Patterns of the profiles selected for decoding, None to decode every signal."""
+    active = get_profile_settings(config)["active"]
+    if not active:
+        return None
+    return profile_patterns(config, active) or None
+
+
+def matches(name: str, patterns: Iterable[str]) -> bool:
+    return any(fnmatchcase(name, pattern) for pattern in patterns)
+
+
+def expand(signal_names: Iterable[str], patterns: Iterable[str]) -> List[str]:
+    """
+    Signal names matching the patterns: grouped by pattern in the order given, in the
+    order of `signal_names` within a pattern.
+    """
+    signal_names = list(signal_names)
+    expanded = []
+    for pattern in patterns:
+        expanded.extend(
+            name
+            for name in signal_names
+            if fnmatchcase(name, pattern) and name not in expanded
+        )
+    return expanded
+
+
+def narrow_lookup(lookup: Dict, patterns: Optional[Iterable[str]]) -> Dict:
+    """
+    Part of a `decoder.message_lookup` needed for the patterns: the messages holding a
+    matching signal, with only those signals and the multiplexers they depend on.
+    """
+    if patterns is None:
+        return lookup
+    patterns = list(patterns)
+    narrowed = {}
+    for key, candidates in lookup.items():
+        for message in candidates:
+            multiplexers = {s["multiplexer_signal"] for s in message["signals"]}
+            kept = [
+                s
+                for s in message["signals"]
+                if matches(s["name"], patterns) or s["name"] in multiplexers
+            ]
+            if not any(matches(s["name"], patterns) for s in kept):
+                continue
+            narrowed.setdefault(key, []).append(dict(message, signals=kept))
+    return narrowed
+
+
+def narrow_frame(frame, patterns: List[str]):
+    """Copy of a canmatrix frame with only the matching signals, None if there are none."""
+    if not any(matches(s.name, patterns) for s in frame.signals):
+        return None
+    multiplexers = {s.muxer_for_signal for s in frame.signals if s.muxer_for_signal}
+    narrowed = copy.copy(frame)
+    narrowed.signals = [
+        s
+        for s in frame.signals
+        if matches(s.name, patterns)
+        or s.multiplex == "Multiplexor"
+        or s.name in multiplexers
+    ]
+    return narrowed
+
+
+def narrow_messages(messages: Dict, patterns: Optional[Iterable[str]]) -> Dict:
+    """Narrow a dict of canmatrix frames, such as the streaming decoder's tables."""
+    if patterns is None:
+        return messages
+    patterns = list(patterns)
+    narrowed = {}
+    for key, frame in messages.items():
+        frame = narrow_frame(frame, patterns)
+        if frame is not None:
+            narrowed[key] = frame
+    return narrowed
+
+
+def narrow_canmatrix(db: CanMatrix, patterns: List[str]) -> CanMatrix:
+    narrowed = copy.copy(db)
+    narrowed.frames = [
+        frame
+        for frame in (narrow_frame(f, patterns) for f in db.frames)
+        if frame is not None
+    ]
+    narrowed.frames_dict_name = {}
+    narrowed.frames_dict_id = {}
+    return narrowed
+
+
+def narrow_dbcs(dbcs: Dict, patterns: Optional[Iterable[str]]) -> Dict:
+    """
+    Narrow a database mapping for `MDF.extract_bus_logging`. DBCs given by path are
+    parsed here, as asammdf only takes a narrowed database as a `CanMatrix`.
+    """
+    if patterns is None:
+        return dbcs
+    patterns = list(patterns)
+    narrowed = {}
+    for bus_type, files in dbcs.items():
+        narrowed[bus_type] = []
+        for dbc, bus_channel in files:
+            if not isinstance(dbc, CanMatrix):
+                name, dbc = dbc, load_can_database(dbc)
+                if dbc is None:
+                    print(f"[yellow]⚠️Could not load DBC: {name}")
+                    continue
+            narrowed[bus_type].append((narrow_canmatrix(dbc, patterns), bus_channel))
+    return narrowed
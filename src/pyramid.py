@@ -0,0 +1,256 @@
+"""
+Multi-resolution (level of detail) summaries of the decoded exports.
+
+With `lod_pyramid.enabled` every conversion also writes a `lod_<name>/` folder next to the
+exports. Level `k` holds, for every numeric signal, the min, max, mean and count of the
+samples in each time bucket of `base_resolution * 2**k` seconds:
+
+    lod_<name>/meta.json        resolutions, time span and signals of the levels
+    lod_<name>/level_<k>.parquet one row per non-empty bucket, columns "<signal>.<stat>"
+
+Levels are added until one has no more than `min_buckets` buckets. The dashboard opens the
+coarsest level that still gives a point per pixel of the visible range, so showing a
+day-long log only reads a few kilobytes. Once zoomed in further than the finest level,
+it reads the samples of the visible range from the export itself.
+
+Only the finest level is accumulated during the conversion (chunk by chunk when
+streaming). The coarser levels are reduced from it when the pyramid is written.
+This module only depends on pandas and pyarrow so that the dashboard can import it.
+"""
+
+import json
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rich import print
+
+INDEX_NAME = "timestamps"
+
+
+def get_pyramid_settings(config: Dict) -> Dict:
+    lod = config.get("lod_pyramid", {})
+    if type(lod) is not dict:
+        print("[red]Config file has bad lod_pyramid settings. Using defaults instead.")
+        lod = {}
+    enabled = bool(lod.get("enabled", False))
+    export_settings = config.get("export_settings", {})
+    if enabled and type(export_settings) is dict:
+        if export_settings.get("timestamps_as_date", False):
+            print("[yellow]The LOD pyramid needs timestamps in seconds, skipping it.")
+            enabled = False
+    return {
+        "enabled": enabled,
+        "base_resolution": float(lod.get("base_resolution", 0.1)),
+        "min_buckets": int(lod.get("min_buckets", 256)),
+    }
+
+
+def pyramid_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f"lod_{name}")
+
+
+def pyramid_for_export(export_file: str) -> Optional[str]:
+    """The pyramid written alongside a `filtered_<name>` export, if there is one."""
+    base = os.path.splitext(os.path.basename(export_file))[0]
+    name = re.sub(r"^filtered_", "", base)
+    directory = pyramid_path(os.path.dirname(export_file), name)
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        return directory
+    return None
+
+
+class PyramidBuilder:
+    """
+    Accumulate per-bucket min, max, sum and count at the finest resolution, one decoded
+    dataframe (or chunk of one) at a time. Partial results are merged as they come in,
+    so memory follows the number of buckets rather than the number of samples.
+    """
+
+    def __init__(self, base_resolution: float = 0.1, min_buckets: int = 256):
+        self.base_resolution = base_resolution
+        self.min_buckets = min_buckets
+        self.signals: List[str] = []
+        self._parts: List[pd.DataFrame] = []
+
+    def add(self, df: pd.DataFrame) -> None:
+        numeric = df.select_dtypes("number")
+        if not len(numeric) or not len(numeric.columns):
+            return
+        for name in numeric.columns:
+            if name not in self.signals:
+                self.signals.append(name)
+        bucket = np.floor(
+            np.asarray(numeric.index, dtype=np.float64) / self.base_resolution
+        ).astype(np.int64)
+        grouped = numeric.groupby(bucket)
+        self._parts.append(
+            pd.concat(
+                {
+                    "min": grouped.min(),
+                    "max": grouped.max(),
+                    "sum": grouped.sum(min_count=1),
+                    "count": grouped.count(),
+                },
+                axis=1,
+            )
+        )
+        if len(self._parts) >= 16:
+            self._parts = [self._merge(self._parts)]
+
+    @staticmethod
+    def _merge(parts: List[pd.DataFrame], shift: int = 0) -> pd.DataFrame:
+        """Combine partial aggregates, optionally into buckets `2**shift` times wider."""
+        df = pd.concat(parts)
+        key = df.index.values >> shift
+        combined = {
+            "min": df["min"].groupby(key).min(),
+            "max": df["max"].groupby(key).max(),
+            "sum": df["sum"].groupby(key).sum(min_count=1),
+            "count": df["count"].groupby(key).sum(),
+        }
+        return pd.concat(combined, axis=1)
+
+    def levels(self) -> List[pd.DataFrame]:
+        """Aggregates of every level, finest first, each indexed by bucket number."""
+        if not self._parts:
+            return []
+        levels = [self._merge(self._parts)]
+        while len(levels[-1]) > self.min_buckets and len(levels) < 32:
+            levels.append(self._merge([levels[-1]], shift=1))
+        return levels
+
+    def write(self, directory: str) -> str:
+        os.makedirs(directory, exist_ok=True)
+        meta = {
+            "base_resolution": self.base_resolution,
+            "signals": self.signals,
+            "levels": [],
+        }
+        for k, level in enumerate(self.levels()):
+            resolution = self.base_resolution * 2**k
+            columns = {}
+            for name in self.signals:
+                count = level["count"][name] if name in level["count"] else None
+                if count is None:
+                    continue
+                columns[f"{name}.min"] = level["min"][name]
+                columns[f"{name}.max"] = level["max"][name]
+                columns[f"{name}.mean"] = level["sum"][name] / count.replace(0, np.nan)
+                columns[f"{name}.count"] = count.astype(np.uint32)
+            df = pd.DataFrame(columns)
+            df.index = pd.Index(df.index.values * resolution, name=INDEX_NAME)
+            file_name = f"level_{k}.parquet"
+            pq.write_table(
+                pa.Table.from_pandas(df, preserve_index=True),
+                os.path.join(directory, file_name),
+                compression="zstd",
+            )
+            meta["levels"].append(
+                {
+                    "level": k,
+                    "resolution": resolution,
+                    "buckets": len(df),
+                    "file": file_name,
+                    "start": float(df.index[0]) if len(df) else 0.0,
+                    "end": float(df.index[-1] + resolution) if len(df) else 0.0,
+                }
+            )
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        return directory
+
+
+def build_pyramid(df: pd.DataFrame, directory: str, settings: Dict) -> str:
+    builder = PyramidBuilder(settings["base_resolution"], settings["min_buckets"])
+    builder.add(df)
+    return builder.write(directory)
+
+
+# Reads rows of an export: (columns, (start, end)) -> dataframe indexed by timestamps.
+RawReader = Callable[[List[str], Optional[Tuple[float, float]]], pd.DataFrame]
+
+
+class LodSource:
+    """
+    Plot source backed by a pyramid. `fetch` returns a min/max envelope of a signal over
+    the visible range from the coarsest level with at least `n_points / 2` buckets in
+    view, or the raw samples from `read_raw` once no level is fine enough.
+    """
+
+    def __init__(self, directory: str, read_raw: RawReader, n_points: int = 1500):
+        self.directory = directory
+        self.read_raw = read_raw
+        self.n_points = n_points
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self.meta["signals"])
+
+    def __len__(self) -> int:
+        levels = self.meta["levels"]
+        return levels[-1]["buckets"] if levels else 0
+
+    def full_range(self) -> Tuple[float, float]:
+        level = self.meta["levels"][-1]
+        return level["start"], level["end"]
+
+    def pick_level(self, x_range: Optional[Tuple[float, float]]) -> Optional[Dict]:
+        """Coarsest level that still fits the view, None when the raw data is needed."""
+        if x_range is None or None in x_range:
+            x_range = self.full_range()
+        span = max(x_range[1] - x_range[0], 0.0)
+        for level in reversed(self.meta["levels"]):
+            if span / level["resolution"] >= self.n_points / 2:
+                return level
+        return None
+
+    def read_level(
+        self,
+        level: Dict,
+        columns: List[str],
+        x_range: Optional[Tuple[float, float]] = None,
+    ) -> pd.DataFrame:
+        filters = None
+        if x_range is not None and None not in x_range:
+            filters = [
+                (INDEX_NAME, ">=", x_range[0] - level["resolution"]),
+                (INDEX_NAME, "<=", x_range[1]),
+            ]
+        path = os.path.join(self.directory, level["file"])
+        available = set(pq.read_schema(path).names)
+        columns = [c for c in columns if c in available]
+        return pd.read_parquet(path, columns=columns, filters=filters)
+
+    def fetch(
+        self, name: str, x_range: Optional[Tuple[float, float]] = None
+    ) -> pd.Series:
+        level = self.pick_level(x_range)
+        if level is None:
+            return self.read_raw([name], x_range)[name].dropna()
+
+        df = self.read_level(level, [f"{name}.min", f"{name}.max"], x_range).dropna()
+        # Min at the start and max at the middle of each bucket keeps the envelope
+        # drawn in time order.
+        t = df.index.values
+        times = np.column_stack([t, t + level["resolution"] / 2]).ravel()
+        values = np.column_stack(
+            [df[f"{name}.min"].values, df[f"{name}.max"].values]
+        ).ravel()
+        return pd.Series(values, index=pd.Index(times, name=INDEX_NAME), name=name)
+
+    def fetch_frame(
+        self, names: List[str], x_range: Optional[Tuple[float, float]] = None
+    ) -> pd.DataFrame:
+        """Bucket means of several signals side by side, or the raw rows when zoomed in."""
+        level = self.pick_level(x_range)
+        if level is None:
+            return self.read_raw(names, x_range)
+        df = self.read_level(level, [f"{n}.mean" for n in names], x_range)
+        return df.rename(columns=lambda c: c.rsplit(".", 1)[0])
@@ -0,0 +1,265 @@
+"""
+Time-window and signal-subset queries on MF4 logs.
+
+Looking at a few seconds around a fault should not mean loading and decoding the whole
+log. `query_mf4` takes a file, a list of DBC signal names and a time range, and reads
+only the records of that range from the CAN data groups. It then decodes only the
+messages that hold the requested signals.
+
+To find the records of a range, each log gets a sparse time index the first time it is
+queried. For every CAN data group it keeps the timestamp of every `index_stride`-th
+record. A range is then two binary searches away from a record offset and count, and
+asammdf only reads and inflates the data blocks of those records. The index is kept in
+a `diskcache.Cache` under `paths.cache_dir`, and is rebuilt whenever the file's mtime or
+size changes.
+
+Times are in seconds from the first frame of the log, like the `timestamps` column of
+the exports. Decoding uses the NumPy decoder (`src.decoder`). Try it with:
+
+    python -m src.query <file.mf4> --signals EMB_Speed1,BMS_Pack_Current --start 120 --end 130
+    python -m src.query <file.mf4> --profile thermal --start 120 --end 130
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from asammdf import MDF
+from diskcache import Cache
+from rich import print
+
+import src.dbc_cache as dbc_cache
+import src.decoder as decoder
+import src.exporters as exporters
+import src.mf4_helpers as mf4_helpers
+import src.profiles as profiles
+import src.streaming as streaming
+
+# Bump when the layout of the cached index changes so old entries are not reused.
+INDEX_VERSION = 1
+
+
+def get_query_settings(config: Dict) -> Dict:
+    query = config.get("query", {})
+    if type(query) is not dict:
+        print("[red]Config file has bad query settings. Using defaults instead.")
+        query = {}
+    return {
+        "index_stride": max(int(query.get("index_stride", 8192)), 1),
+        "cache_index": bool(query.get("cache_index", True)),
+        "directory": os.path.join(
+            mf4_helpers.get_paths(config)["cache_dir"], "mf4_index"
+        ),
+    }
+
+
+def build_time_index(mdf: MDF, stride: int, chunk_records: int = 500_000) -> Dict:
+    """
+    Timestamp of every `stride`-th record of each CAN data group, and of its last
+    record. The master channel is read in chunks, so building it takes little memory.
+    """
+    index = {}
+    for group in mf4_helpers.can_data_groups(mdf):
+        cycles = mdf.groups[group].channel_group.cycles_nr
+        offsets, times = [], []
+        monotonic = True
+        previous = -np.inf
+        for record_offset in range(0, cycles, chunk_records):
+            master = mdf.get_master(
+                group,
+                record_offset=record_offset,
+                record_count=min(chunk_records, cycles - record_offset),
+            )
+            if not len(master):
+                continue
+            monotonic &= bool(master[0] >= previous) and bool(
+                np.all(np.diff(master) >= 0)
+            )
+            previous = master[-1]
+            first = -record_offset % stride
+            offsets.append(np.arange(first, len(master), stride) + record_offset)
+            times.append(master[first::stride])
+        offsets = np.concatenate(offsets) if offsets else np.array([], dtype=np.int64)
+        times = np.concatenate(times) if times else np.array([])
+        index[group] = {
+            "cycles": cycles,
+            "offsets": offsets,
+            "times": times,
+            "end": float(previous),
+            "monotonic": monotonic,
+        }
+    return index
+
+
+def load_time_index(mdf: MDF, mf4_file: str, settings: Dict) -> Dict:
+    """The file's time index, from the cache while the file is unchanged."""
+    if not settings["cache_index"]:
+        return build_time_index(mdf, settings["index_stride"])
+
+    stat = os.stat(mf4_file)
+    key = (INDEX_VERSION, os.path.abspath(mf4_file))
+    with Cache(settings["directory"]) as cache:
+        entry = cache.get(key)
+        if entry is not None and (entry["mtime"], entry["size"], entry["stride"]) == (
+            stat.st_mtime_ns,
+            stat.st_size,
+            settings["index_stride"],
+        ):
+            return entry["index"]
+        index = build_time_index(mdf, settings["index_stride"])
+        cache.set(
+            key,
+            {
+                "mtime": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "stride": settings["index_stride"],
+                "index": index,
+            },
+        )
+    return index
+
+
+def record_range(entry: Dict, t_start: float, t_end: float) -> Tuple[int, int]:
+    """Offset and count of the records that can hold timestamps in [t_start, t_end]."""
+    cycles = entry["cycles"]
+    if not entry["monotonic"] or not len(entry["times"]):
+        return 0, cycles
+    if t_start > entry["end"] or t_end < entry["times"][0]:
+        return 0, 0
+    times, offsets = entry["times"], entry["offsets"]
+    # Last indexed record at or before the start, first indexed record after the end.
+    lo = np.searchsorted(times, t_start, side="right") - 1
+    hi = np.searchsorted(times, t_end, side="right")
+    first = int(offsets[lo]) if lo >= 0 else 0
+    last = int(offsets[hi]) if hi < len(offsets) else cycles
+    return first, last - first
+
+
+def query_mf4(
+    mf4_file: str,
+    signals: List[str],
+    time_range: Optional[Tuple[Optional[float], Optional[float]]] = None,
+    config: Optional[Dict] = None,
+    dbcs: Optional[Dict] = None,
+    lookup: Optional[Dict] = None,
+) -> pd.DataFrame:
+    """
+    Decoded `signals` of an MF4 log between `time_range` (seconds from the first frame,
+    either end may be None), one column per signal. Signals can also be given as
+    patterns like the ones of the signal profiles. Only the records of the range and
+    the messages holding the signals are read and decoded.
+
+    Pass `lookup` (a `decoder.message_lookup`) to reuse parsed DBCs over many queries,
+    otherwise the DBCs of `dbcs` or of `paths.dbcs_dir` are used.
+    """
+    config = config or {}
+    settings = get_query_settings(config)
+    export_settings = mf4_helpers.get_export_settings(config)
+    if lookup is None:
+        if dbcs is None:
+            dbcs = mf4_helpers.load_dbc_files(mf4_helpers.get_paths(config)["dbcs_dir"])
+        lookup = decoder.message_lookup(
+            decoder.compile_dbc_files(dbcs, dbc_cache.open_cache(config))
+        )
+    lookup = profiles.narrow_lookup(lookup, signals)
+    known = [s["name"] for ms in lookup.values() for m in ms for s in m["signals"]]
+    missing = [s for s in signals if not profiles.expand(known, [s])]
+    if missing:
+        print(f"[yellow]⚠️Signals not found in the DBCs: {', '.join(missing)}")
+    columns = profiles.expand(known, signals)
+    wanted_ids = np.array(sorted({key[0] for key in lookup}), dtype="<u4")
+    chunk_records = streaming.get_streaming_settings(config)["chunk_records"]
+
+    start, end = time_range if time_range is not None else (None, None)
+    # Skip asammdf's scan of every CAN ID at open, it reads the whole log.
+    mdf = MDF(mf4_file, process_bus_logging=False)
+    try:
+        groups = mf4_helpers.can_data_groups(mdf)
+        origin = mf4_helpers.first_timestamp(mdf, groups)
+        t_start = origin + start if start is not None else -np.inf
+        t_end = origin + end if end is not None else np.inf
+        index = load_time_index(mdf, mf4_file, settings) if columns else {}
+
+        frames = []
+        for group in groups if columns else []:
+            offset, count = record_range(index[group], t_start, t_end)
+            for record_offset in range(offset, offset + count, chunk_records):
+                chunk = mdf.get(
+                    mf4_helpers.CAN_FRAME_CHANNEL,
+                    group=group,
+                    record_offset=record_offset,
+                    record_count=min(chunk_records, offset + count - record_offset),
+                )
+                t, bus, ids, ide, payload = mf4_helpers.frame_arrays(chunk)
+                keep = (t >= t_start) & (t <= t_end) & np.isin(ids, wanted_ids)
+                if keep.any():
+                    frames.append(
+                        decoder.decode_frames(
+                            t[keep],
+                            bus[keep],
+                            ids[keep],
+                            ide[keep],
+                            payload[keep],
+                            lookup,
+                        )
+                    )
+        df = decoder.merge_message_frames(frames).reindex(columns=columns)
+        df = df.dropna(how="all") if len(df) else df.astype("float64")
+        df.index = mf4_helpers.export_index(
+            df.index.values, origin, mdf.start_time, export_settings
+        )
+    finally:
+        mdf.close()
+    return df
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Decode some signals of an MF4 log over a time range."
+    )
+    parser.add_argument("mf4_file")
+    parser.add_argument(
+        "--signals",
+        default="",
+        help="Comma separated DBC signal names or patterns such as 'BMS_*'.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="append",
+        default=[],
+        help="Add the signals of a profile from the [profiles] settings.",
+    )
+    parser.add_argument("--start", type=float, default=None, help="Seconds from start.")
+    parser.add_argument("--end", type=float, default=None, help="Seconds from start.")
+    parser.add_argument(
+        "--out", default=None, help="Save the result (.parquet, .feather or .csv)."
+    )
+    parser.add_argument("--config", default="./settings.toml")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = mf4_helpers.get_config(args.config)
+    started = time.perf_counter()
+    signals = [s.strip() for s in args.signals.split(",") if s.strip()]
+    signals += profiles.profile_patterns(config, args.profile)
+    if not signals:
+        raise SystemExit("Give the signals to read with --signals or --profile.")
+    df = query_mf4(
+        args.mf4_file,
+        signals,
+        (args.start, args.end),
+        config,
+    )
+    print(
+        f"[green]{len(df)} rows of {len(df.columns)} signals "
+        f"in {time.perf_counter() - started:.3f}s"
+    )
+    print(df)
+    if args.out:
+        exporters.write_table(df, args.out)
+        print(f"[green]Saved to: [bold]{args.out}")
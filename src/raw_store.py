@@ -0,0 +1,284 @@
+"""
+Compact, memory-mappable store of the raw CAN frames of a log.
+
+The raw frames are saved as one `.npy` file per field in a `raw_frames_<name>/` folder
+next to the other exports:
+
+    timestamps.npy   float64 (N,)     MF4 master timestamps
+    bus.npy          uint8   (N,)     bus channel
+    ids.npy          uint32  (N,)     arbitration id
+    ide.npy          uint8   (N,)     extended id flag
+    dlc.npy          uint8   (N,)     data length code
+    payload.npy      uint8   (N, 64)  data bytes, zero padded to the CAN FD width
+    meta.json                         source file, start time and timestamp origin
+    id_order.npy     int64   (N,)     frame positions sorted by ID, then time
+    id_groups.npy    (K,)             per ID: frame key, first position, count
+
+`np.load(..., mmap_mode="r")` opens these without reading them, so the frames can be
+decoded again with new or updated DBCs straight from the store, a chunk at a time,
+without needing the original MF4.
+
+The two ID index files let `src.frame_search` find the frames of one arbitration ID
+without scanning the log. They are written once the store is complete, and rebuilt by
+`src.frame_search` when missing or older than the frames.
+
+Enable it with `raw_frame_store = true` in the `[export_settings]` section.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from asammdf import MDF, Signal
+from rich import print
+
+import src.decoder as decoder
+import src.indicators as indicators
+import src.mf4_helpers as mf4_helpers
+import src.profiles as profiles
+import src.pyramid as pyramid
+import src.stats_index as stats_index
+
+FIELDS = {
+    "timestamps": np.float64,
+    "bus": np.uint8,
+    "ids": np.uint32,
+    "ide": np.uint8,
+    "dlc": np.uint8,
+}
+
+ORDER_FILE = "id_order.npy"
+GROUPS_FILE = "id_groups.npy"
+GROUP_DTYPE = np.dtype([("key", "<u8"), ("start", "<i8"), ("count", "<i8")])
+
+
+def store_enabled(config: Dict) -> bool:
+    export_settings = config.get("export_settings", {})
+    if type(export_settings) is not dict:
+        return False
+    return bool(export_settings.get("raw_frame_store", False))
+
+
+def store_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f"raw_frames_{name}")
+
+
+class RawStoreWriter:
+    """
+    Fill a raw frame store chunk by chunk. The frame count is known up front from the
+    MF4 channel groups, so every field is preallocated as a memory-mapped `.npy` file
+    and each chunk is copied straight into place.
+    """
+
+    def __init__(self, directory: str, mdf: MDF, source: str, resume_frames: int = 0):
+        """With `resume_frames`, continue an existing store after that many frames."""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        groups = mf4_helpers.can_data_groups(mdf)
+        n_frames = sum(mdf.groups[g].channel_group.cycles_nr for g in groups)
+        self.meta = {
+            "source": os.path.abspath(source),
+            "start_time": mdf.start_time.isoformat(),
+            "origin": mf4_helpers.first_timestamp(mdf, groups),
+            "frames": n_frames,
+        }
+        mode = "r+" if resume_frames else "w+"
+        self.arrays = {
+            name: np.lib.format.open_memmap(
+                os.path.join(directory, f"{name}.npy"),
+                mode=mode,
+                dtype=dtype,
+                shape=(n_frames,),
+            )
+            for name, dtype in FIELDS.items()
+        }
+        self.arrays["payload"] = np.lib.format.open_memmap(
+            os.path.join(directory, "payload.npy"),
+            mode=mode,
+            dtype=np.uint8,
+            shape=(n_frames, decoder.PAYLOAD_WIDTH),
+        )
+        self.position = resume_frames
+
+    def write(self, chunk: Signal) -> None:
+        t, bus, ids, ide, payload = mf4_helpers.frame_arrays(chunk)
+        start, stop = self.position, self.position + len(t)
+        self.arrays["timestamps"][start:stop] = t
+        self.arrays["bus"][start:stop] = bus
+        self.arrays["ids"][start:stop] = ids
+        self.arrays["ide"][start:stop] = ide
+        self.arrays["dlc"][start:stop] = chunk.samples[
+            f"{mf4_helpers.CAN_FRAME_CHANNEL}.DLC"
+        ]
+        width = min(payload.shape[1], decoder.PAYLOAD_WIDTH)
+        self.arrays["payload"][start:stop, :width] = payload[:, :width]
+        self.position = stop
+
+    def flush(self) -> None:
+        for array in self.arrays.values():
+            array.flush()
+
+    def close(self) -> None:
+        self.flush()
+        complete = self.position == self.meta["frames"]
+        if complete:
+            build_id_index(self.directory, self.arrays)
+        self.arrays = {}
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_id_index(directory: str, arrays: Dict[str, np.ndarray]) -> None:
+    """Sort the frames of a store by (bus, IDE, arbitration id, time) and save that order."""
+    codes = decoder.frame_codes(arrays["bus"], arrays["ids"], arrays["ide"])
+    order = np.lexsort((arrays["timestamps"], codes))
+    keys, starts, counts = np.unique(
+        codes[order], return_index=True, return_counts=True
+    )
+    groups = np.empty(len(keys), dtype=GROUP_DTYPE)
+    groups["key"], groups["start"], groups["count"] = keys, starts, counts
+    # Saved under temporary names first, so a half written index is never used.
+    for name, array in ((ORDER_FILE, order), (GROUPS_FILE, groups)):
+        temporary = os.path.join(directory, f"{name}.tmp.npy")
+        np.save(temporary, array)
+        os.replace(temporary, os.path.join(directory, name))
+
+
+def write_store(mdf: MDF, directory: str, source: str, chunk_records: int) -> str:
+    with RawStoreWriter(directory, mdf, source) as writer:
+        for chunk in mf4_helpers.iter_raw_chunks(mdf, chunk_records):
+            writer.write(chunk)
+    return directory
+
+
+def load_store(directory: str) -> Tuple[Dict[str, np.ndarray], Dict]:
+    """Memory-map every field of a store. Nothing is read until it is indexed."""
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    arrays = {
+        name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+        for name in (*FIELDS, "payload")
+    }
+    return arrays, meta
+
+
+def iter_store_chunks(
+    arrays: Dict[str, np.ndarray], chunk_records: int
+) -> Iterator[Tuple[np.ndarray, ...]]:
+    """Yield (t, bus, ids, ide, payload) blocks in the order `decode_frames` takes."""
+    n_frames = len(arrays["timestamps"])
+    for start in range(0, n_frames, chunk_records):
+        stop = min(start + chunk_records, n_frames)
+        yield tuple(
+            np.asarray(arrays[name][start:stop])
+            for name in ("timestamps", "bus", "ids", "ide", "payload")
+        )
+
+
+def decode_store(
+    directory: str,
+    dbcs: Dict,
+    config: Dict,
+    export_path: str,
+    chunk_records: Optional[int] = None,
+) -> str:
+    """
+    Decode a raw frame store with the current DBCs into a new filtered export, one
+    chunk of frames at a time.
+    """
+    import src.alignment as alignment
+    import src.dbc_cache as dbc_cache
+    import src.exporters as exporters
+    import src.parallel_decode as parallel_decode
+    import src.streaming as streaming
+
+    arrays, meta = load_store(directory)
+    if chunk_records is None:
+        chunk_records = streaming.get_streaming_settings(config)["chunk_records"]
+    export_settings = mf4_helpers.get_export_settings(config)
+    export_format = exporters.get_file_format(config)
+    start_time = datetime.fromisoformat(meta["start_time"])
+
+    lookup = decoder.message_lookup(
+        decoder.compile_dbc_files(dbcs, dbc_cache.open_cache(config))
+    )
+    lookup = profiles.narrow_lookup(lookup, profiles.active_patterns(config))
+    keys = set()
+    for _, bus, ids, ide, _ in iter_store_chunks(arrays, chunk_records):
+        keys |= decoder.frame_keys(bus, ids, ide)
+    columns = decoder.signal_columns(lookup, keys)
+    derived = alignment.DerivedChannels(alignment.get_derived_settings(config), columns)
+    columns += derived.names
+
+    indicator_settings = indicators.get_indicator_settings(config)
+    accumulator = None
+    if indicator_settings["enabled"]:
+        accumulator = indicators.accumulator_from_settings(indicator_settings)
+    lod_settings = pyramid.get_pyramid_settings(config)
+    lod_builder = None
+    if lod_settings["enabled"]:
+        lod_builder = pyramid.PyramidBuilder(
+            lod_settings["base_resolution"], lod_settings["min_buckets"]
+        )
+    stats_settings = stats_index.get_stats_settings(config)
+    stats_builder = None
+    if stats_settings["enabled"]:
+        stats_builder = stats_index.StatsIndexBuilder(stats_settings["resolution"])
+
+    signal_counts = pd.Series(dtype="int64")
+    workers = decoder.get_decoding_settings(config)["workers"]
+    with exporters.TableWriter(
+        export_path, compression=export_format["compression"]
+    ) as writer, parallel_decode.ParallelDecoder(
+        decoder.decode_frames, lookup, workers
+    ) as parallel:
+        for frames in iter_store_chunks(arrays, chunk_records):
+            df = parallel.decode(*frames)
+            if not len(df):
+                continue
+            df = streaming.align_decoded_chunk(
+                df, columns, meta["origin"], start_time, export_settings
+            )
+            derived.apply(df)
+            writer.write(df)
+            if lod_builder is not None:
+                lod_builder.add(df)
+            if stats_builder is not None:
+                stats_builder.add(df)
+            if accumulator is not None:
+                accumulator.update(df)
+            signal_counts = signal_counts.add(
+                df.select_dtypes("number").count(), fill_value=0
+            )
+
+        if not writer.rows:
+            print(f"[yellow]No frames in {directory} matched the DBCs")
+            writer.write(streaming.empty_decoded(columns))
+
+    name = os.path.basename(os.path.normpath(directory)).removeprefix("raw_frames_")
+    export_dir = os.path.dirname(export_path)
+    if lod_builder is not None:
+        lod_builder.write(pyramid.pyramid_path(export_dir, name))
+    if stats_builder is not None:
+        stats_builder.write(stats_index.stats_path(export_dir, name), export_path)
+    if accumulator is not None:
+        accumulator.save(indicators.indicators_path(export_dir, name))
+    streaming.record_conversion(
+        config,
+        export_dir,
+        meta["source"],
+        export_path,
+        start_time=start_time,
+        signal_counts=signal_counts,
+        accumulator=accumulator,
+    )
+    return export_path
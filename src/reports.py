@@ -0,0 +1,405 @@
+"""
+Static PNG or PDF reports of converted logs, rendered in bulk.
+
+Each report is one page per log with its indicators (runtime, energy, distance, CO2 and
+diesel saved, as in the dashboard cards) and plots of the temperatures, the battery and
+generator power and the state of charge:
+
+    python -m src.reports                               # every log of paths.export_dir
+    python -m src.reports processed_files --since 2024-06-01 --vehicle truck_1
+    python -m src.reports processed_files/filtered_log.parquet --format pdf
+
+Reports are drawn with matplotlib's Agg backend, so no display is needed, and the logs
+are rendered in parallel over a process pool (`reports.workers`). Every line holds at most
+a min and a max per pixel column of its plot: the coarsest level of the LOD pyramid that
+is fine enough when the log has one, so long logs are not read at full resolution, else
+the samples of the export decimated with `visualisation.minmax_decimate`. The indicators
+come from `indicators_<name>.json` when the converter saved it.
+
+A report is only rendered again when its export or indicators changed since (or with
+`--force`), so a nightly run over a fleet only renders the new logs.
+"""
+
+import argparse
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import matplotlib
+
+# Set before pyplot is first imported (by src.visualisation too), so no GUI is needed.
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
+import pandas as pd
+from rich import print
+from rich.console import Console
+from rich.progress import Progress
+from rich.table import Table
+
+import src.alignment as alignment
+import src.catalog as catalog
+import src.exporters as exporters
+import src.indicators as indicators
+import src.mf4_helpers as mf4_helpers
+import src.pyramid as pyramid
+import src.visualisation as vis
+
+console = Console()
+
+FORMATS = ("png", "pdf")
+EXPORT_EXTENSIONS = (".parquet", ".feather", ".arrow", ".csv")
+
+# A4 portrait, in inches.
+PAGE_SIZE = (8.27, 11.69)
+
+
+def get_report_settings(config: Dict) -> Dict:
+    reports = config.get("reports", {})
+    if type(reports) is not dict:
+        print("[red]Config file has bad reports settings. Using defaults instead.")
+        reports = {}
+    file_format = str(reports.get("format", "png")).lower().lstrip(".")
+    if file_format not in FORMATS:
+        print(f"[red]Unknown report format {file_format}, using png instead.")
+        file_format = "png"
+    workers = reports.get("workers", 0)
+    return {
+        "format": file_format,
+        "dpi": int(reports.get("dpi", 150)),
+        "workers": int(workers) if workers else (os.cpu_count() or 1),
+        "output_dir": reports.get("output_dir", ""),
+        "soc_col": reports.get("soc_col", "BMS_Pack_SOC"),
+        "temperature_cols": list(
+            reports.get("temperature_cols", vis.TEMPERATURE_COLUMNS)
+        ),
+    }
+
+
+def report_path(output_dir: str, export_file: str, file_format: str) -> str:
+    base = os.path.splitext(os.path.basename(export_file))[0]
+    name = base.removeprefix("filtered_")
+    return os.path.join(output_dir, f"report_{name}.{file_format}")
+
+
+def find_exports(paths: List[str]) -> List[str]:
+    """The filtered exports among `paths`, and in the folders among them."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            candidates = sorted(glob.glob(os.path.join(path, "filtered_*")))
+        else:
+            candidates = [path]
+        files += [f for f in candidates if f.lower().endswith(EXPORT_EXTENSIONS)]
+    return files
+
+
+def is_up_to_date(export_file: str, output: str) -> bool:
+    """True when the report is newer than the export and the indicators it shows."""
+    if not os.path.exists(output):
+        return False
+    inputs = [export_file, indicators.indicators_for_export(export_file)]
+    newest = max(os.path.getmtime(path) for path in inputs if path is not None)
+    return os.path.getmtime(output) >= newest
+
+
+class ReportData:
+    """
+    The signals of one log for a report, read at about `n_points` points per signal:
+    from the LOD pyramid when the export has one, else from the export itself.
+    """
+
+    def __init__(self, export_file: str, columns: List[str], n_points: int):
+        self.export_file = export_file
+        available = set(exporters.read_columns(export_file))
+        self.columns = [c for c in dict.fromkeys(columns) if c in available]
+        self.lod = None
+        self.df = None
+        directory = pyramid.pyramid_for_export(export_file)
+        if directory is not None:
+            self.lod = pyramid.LodSource(directory, self.read_raw, n_points=n_points)
+        else:
+            self.df = exporters.read_table(export_file, columns=self.columns)
+
+    def read_raw(self, columns: List[str], time_range=None) -> pd.DataFrame:
+        return exporters.read_table(self.export_file, columns, time_range)
+
+    def series(self, name: str) -> Optional[pd.Series]:
+        if name not in self.columns:
+            return None
+        if self.lod is not None:
+            return self.lod.fetch(name)
+        return self.df[name].dropna()
+
+    def power(self, power_col: str, voltage_col: str, current_col: str):
+        """Power in kW, from a derived power channel or voltage and current as-of."""
+        if power_col in self.columns:
+            series = self.series(power_col)
+        elif voltage_col in self.columns and current_col in self.columns:
+            if self.lod is not None:
+                frame = self.lod.fetch_frame([voltage_col, current_col])
+            else:
+                frame = alignment.align(self.df, [voltage_col, current_col])
+            series = (frame[voltage_col] * frame[current_col]).dropna()
+        else:
+            return None
+        return series / 1000
+
+
+def log_indicators(export_file: str, settings: Dict) -> Dict[str, float]:
+    """Indicator values of a log, from the state saved at conversion when there is one."""
+    saved = indicators.indicators_for_export(export_file)
+    if saved is not None:
+        accumulator = indicators.IndicatorAccumulator.load(saved)
+    else:
+        accumulator = indicators.accumulator_from_settings(settings)
+        columns = [accumulator.columns[key] for key in indicators.DEFAULT_COLUMNS]
+        accumulator.update(exporters.read_table(export_file, columns=columns))
+    return accumulator.results(diesel_cost_per_litre=settings["diesel_cost_per_litre"])
+
+
+def indicator_rows(results: Dict[str, float]) -> List[List[str]]:
+    """Label and formatted value of each indicator, as on the dashboard cards."""
+    hours, remainder = divmod(results["runtime_s"], 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return [
+        ["Total Runtime", f"{int(hours)}h {int(minutes)}m {int(seconds)}s"],
+        ["Power Consumed (kWh)", f"{results['consumed_kwh']:,.3f}"],
+        ["Power Generated (kWh)", f"{results['generated_kwh']:,.6f}"],
+        ["Distance Travelled (km)", f"{results['distance_km']:,.2f}"],
+        ["CO2 Emmisions Saved (kg)", f"{results['co2_saved_kg']:,.2f}"],
+        ["Diesel Saved (l)", f"{results['diesel_saved_l']:,.2f}"],
+        ["Diesel Cost Saved (chf)", f"{results['diesel_cost_saved']:,.2f}"],
+    ]
+
+
+def report_figure(
+    export_file: str, settings: Dict, indicator_settings: Dict
+) -> plt.Figure:
+    """One page report of a log."""
+    fig = plt.figure(figsize=PAGE_SIZE, dpi=settings["dpi"])
+    grid = fig.add_gridspec(4, 1, height_ratios=[1.1, 2, 2, 2], hspace=0.45)
+    summary = fig.add_subplot(grid[0])
+    axes = [fig.add_subplot(grid[i]) for i in (1, 2, 3)]
+    for ax in axes[1:]:
+        ax.sharex(axes[0])
+    # Width of the plots in pixels, so every line has one min and max per pixel column.
+    n_pixels = max(int(axes[0].get_window_extent().width), 1)
+
+    columns = indicator_settings
+    power_sources = [
+        (
+            "Battery",
+            columns["power_col"],
+            columns["voltage_col"],
+            columns["current_col"],
+        ),
+        (
+            "Generator",
+            columns["gen_power_col"],
+            columns["gen_vol_col"],
+            columns["gen_cur_col"],
+        ),
+    ]
+    wanted = [*settings["temperature_cols"], settings["soc_col"]]
+    for _, *power_columns in power_sources:
+        wanted += power_columns
+    data = ReportData(export_file, wanted, n_points=2 * n_pixels)
+
+    name = os.path.splitext(os.path.basename(export_file))[0].removeprefix("filtered_")
+    fig.suptitle(name, fontsize=14, fontweight="bold")
+    summary.axis("off")
+    table = summary.table(
+        cellText=indicator_rows(log_indicators(export_file, indicator_settings)),
+        colWidths=[0.45, 0.3],
+        loc="center",
+        cellLoc="left",
+    )
+    table.auto_set_font_size(False)
+    table.set_fontsize(9)
+
+    plots = [
+        (
+            axes[0],
+            "Temperature ( ºC )",
+            [(c, data.series(c)) for c in settings["temperature_cols"]],
+        ),
+        (
+            axes[1],
+            "Power (kW)",
+            [(label, data.power(*columns)) for label, *columns in power_sources],
+        ),
+        (axes[2], "SOC (%)", [(settings["soc_col"], data.series(settings["soc_col"]))]),
+    ]
+    for ax, ylabel, lines in plots:
+        drawn = 0
+        for label, series in lines:
+            if series is not None and len(series):
+                vis.static_line(ax, series, n_pixels, label=label, linewidth=0.6)
+                drawn += 1
+        ax.set_ylabel(ylabel)
+        ax.grid(True)
+        if drawn:
+            ax.legend(loc="upper right", fontsize=7)
+        else:
+            ax.text(
+                0.5, 0.5, "No data", ha="center", va="center", transform=ax.transAxes
+            )
+    axes[-1].set_xlabel("Time (s)")
+    return fig
+
+
+def render_report(
+    export_file: str, output: str, settings: Dict, indicator_settings: Dict
+) -> str:
+    fig = report_figure(export_file, settings, indicator_settings)
+    try:
+        fig.savefig(output, format=settings["format"], dpi=settings["dpi"])
+    finally:
+        plt.close(fig)
+    return output
+
+
+def _report_job(
+    export_file: str, output: str, settings: Dict, indicator_settings: Dict
+) -> Dict:
+    """Worker entry point. Never raises, so one bad log does not stop the others."""
+    start = time.perf_counter()
+    report = {"file": export_file, "status": "ok", "output": output, "error": None}
+    try:
+        render_report(export_file, output, settings, indicator_settings)
+    except Exception as e:
+        report["status"] = "failed"
+        report["error"] = f"{type(e).__name__}: {e}"
+        report["traceback"] = traceback.format_exc()
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+
+def render_reports(
+    export_files: List[str],
+    config: Dict,
+    output_dir: str,
+    workers: Optional[int] = None,
+    force: bool = False,
+) -> List[Dict]:
+    """Render the report of every export over a process pool, skipping up-to-date ones."""
+    settings = get_report_settings(config)
+    indicator_settings = indicators.get_indicator_settings(config)
+    workers = workers or settings["workers"]
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = {f: report_path(output_dir, f, settings["format"]) for f in export_files}
+    if not force:
+        jobs = {f: out for f, out in jobs.items() if not is_up_to_date(f, out)}
+    skipped = len(export_files) - len(jobs)
+    if skipped:
+        print(f"[dim]{skipped} reports already up to date")
+    if not jobs:
+        return []
+
+    workers = max(min(workers, len(jobs)), 1)
+    print(f"[bold yellow]Rendering {len(jobs)} reports with {workers} workers")
+    reports = []
+    with Progress(console=console) as progress, ProcessPoolExecutor(
+        max_workers=workers
+    ) as pool:
+        task = progress.add_task("Rendering", total=len(jobs))
+        futures = [
+            pool.submit(_report_job, f, out, settings, indicator_settings)
+            for f, out in jobs.items()
+        ]
+        for future in as_completed(futures):
+            report = future.result()
+            reports.append(report)
+            if report["status"] == "ok":
+                progress.console.print(
+                    f"[green]✅ {report['output']} ({report['seconds']:.1f}s)"
+                )
+            else:
+                progress.console.print(
+                    f"[red bold]❌ {report['file']}: {report['error']}"
+                )
+            progress.advance(task)
+    reports.sort(key=lambda r: r["file"])
+    return reports
+
+
+def print_report_summary(reports: List[Dict]) -> None:
+    table = Table(title="Reports")
+    table.add_column("Log")
+    table.add_column("Status")
+    table.add_column("Time (s)", justify="right")
+    table.add_column("Error")
+    for report in reports:
+        status = "[green]ok" if report["status"] == "ok" else "[red]failed"
+        table.add_row(
+            os.path.basename(report["file"]),
+            status,
+            f"{report['seconds']:.1f}",
+            report["error"] or "",
+        )
+    console.print(table)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Render a PNG or PDF report of every converted log."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        help="Filtered exports or folders of them. Defaults to paths.export_dir.",
+    )
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--out", default=None, help="Output folder. Defaults to reports.output_dir."
+    )
+    parser.add_argument("--vehicle", default=None, help="Only the logs of a vehicle.")
+    parser.add_argument("--since", default=None, help="Logs started on or after.")
+    parser.add_argument("--until", default=None, help="Logs started on or before.")
+    parser.add_argument(
+        "--force", action="store_true", help="Render the up-to-date reports again."
+    )
+    parser.add_argument("--config", default="./settings.toml")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    config = mf4_helpers.get_config(args.config)
+    if args.format:
+        config.setdefault("reports", {})["format"] = args.format
+    export_dir = mf4_helpers.get_paths(config)["export_dir"]
+    files = find_exports(args.paths or [export_dir])
+
+    if args.vehicle or args.since or args.until:
+        # Narrow down to the logs of the catalog matching the filters.
+        catalog_path = catalog.get_catalog_settings(config, export_dir)["path"]
+        logs = catalog.list_logs(
+            catalog_path, vehicle=args.vehicle, since=args.since, until=args.until
+        )
+        wanted = {os.path.abspath(f) for f in logs["export_file"]}
+        files = [f for f in files if os.path.abspath(f) in wanted]
+
+    output_dir = (
+        args.out
+        or get_report_settings(config)["output_dir"]
+        or os.path.join(export_dir, "reports")
+    )
+    started = time.perf_counter()
+    reports = render_reports(
+        files, config, output_dir, workers=args.workers, force=args.force
+    )
+    if reports:
+        print_report_summary(reports)
+    n_failed = sum(r["status"] != "ok" for r in reports)
+    colour = "red" if n_failed else "green"
+    print(
+        f"[{colour}]{len(reports) - n_failed}/{len(reports)} reports rendered in "
+        f"{time.perf_counter() - started:.1f}s to: [bold]{output_dir}"
+    )
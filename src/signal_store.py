@@ -0,0 +1,151 @@
+"""
+Sparse per-signal storage of decoded logs.
+
+The decoded exports put every signal on one shared timestamp index, so with signals
+logged at different rates most cells of the table are NaN. A `SignalStore` instead keeps
+each signal as its own pair of (timestamps, values) arrays, holding only the samples that
+were actually received:
+
+- Values are stored in the narrowest dtype that holds them exactly: the smallest integer
+  type for integer valued signals, float32 when that round-trips, float64 otherwise.
+- Signals of the same CAN message are received together, so they share one timestamps
+  array instead of each keeping a copy.
+
+`store["BMS_Pack_SOC"]` gives a float64 series without NaNs, equal to
+`df["BMS_Pack_SOC"].dropna()` on the wide table, and `store.columns` / `len(store)` behave
+like the dataframe's, so the plots and indicators take either. `to_dataframe()` builds the
+wide table again when it is really needed.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def narrow_dtype(values: np.ndarray) -> np.ndarray:
+    """Smallest dtype that holds every value exactly. Non numeric values are kept as-is."""
+    if values.dtype.kind not in "fiu" or not len(values):
+        return values
+    if values.dtype.kind == "f":
+        if np.isfinite(values).all() and (values == np.round(values)).all():
+            lo, hi = values.min(), values.max()
+            if -(2**63) <= lo and hi < 2**63:
+                int_dtype = np.result_type(
+                    np.min_scalar_type(int(lo)), np.min_scalar_type(int(hi))
+                )
+                if int_dtype.kind in "iu":
+                    return values.astype(int_dtype)
+        as_float32 = values.astype(np.float32)
+        if np.array_equal(as_float32, values, equal_nan=True):
+            return as_float32
+        return values
+    int_dtype = np.result_type(
+        np.min_scalar_type(values.min()), np.min_scalar_type(values.max())
+    )
+    return values.astype(int_dtype)
+
+
+class SignalStore:
+    """
+    Decoded signals keyed by name, each a (timestamps, values) pair of compact arrays.
+    """
+
+    def __init__(self, index_name: Optional[str] = "timestamps"):
+        self.index_name = index_name
+        self._signals: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "SignalStore":
+        """Split a wide, NaN padded table into one compact series per column."""
+        store = cls(index_name=df.index.name)
+        index = df.index.values
+        shared = {}
+        for name in df.columns:
+            column = df[name].values
+            present = pd.notna(column)
+            if not present.any():
+                continue
+            # Columns received in the same rows come from the same message.
+            key = np.packbits(present).tobytes()
+            if key not in shared:
+                shared[key] = index[present]
+            store.add(name, shared[key], column[present])
+        return store
+
+    @classmethod
+    def merge(cls, stores: Iterable["SignalStore"]) -> "SignalStore":
+        """One store of the signals of all `stores`, sharing their arrays."""
+        merged = None
+        for store in stores:
+            if merged is None:
+                merged = cls(index_name=store.index_name)
+            merged._signals.update(store._signals)
+        return merged if merged is not None else cls()
+
+    def select(self, names: Iterable[str]) -> "SignalStore":
+        """The given signals only, sharing this store's arrays. Missing ones are skipped."""
+        store = SignalStore(index_name=self.index_name)
+        store._signals = {n: self._signals[n] for n in names if n in self._signals}
+        return store
+
+    def add(self, name: str, timestamps: np.ndarray, values: np.ndarray) -> None:
+        self._signals[name] = (np.asarray(timestamps), narrow_dtype(np.asarray(values)))
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._signals)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._signals
+
+    def __len__(self) -> int:
+        """Number of samples across all signals, zero when the store is empty."""
+        return sum(len(t) for t, _ in self._signals.values())
+
+    def raw(self, name: str) -> Tuple[np.ndarray, np.ndarray]:
+        """The compact (timestamps, values) arrays of a signal."""
+        return self._signals[name]
+
+    def __getitem__(self, name: str) -> pd.Series:
+        timestamps, values = self._signals[name]
+        if values.dtype.kind in "fiu":
+            values = values.astype(np.float64)
+        return pd.Series(
+            values, index=pd.Index(timestamps, name=self.index_name), name=name
+        )
+
+    def time_range(self) -> Tuple[float, float]:
+        """First and last timestamp over all signals."""
+        starts = [t[0] for t, _ in self._signals.values() if len(t)]
+        ends = [t[-1] for t, _ in self._signals.values() if len(t)]
+        return min(starts), max(ends)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the arrays, counting shared timestamp arrays once."""
+        seen = {}
+        for timestamps, values in self._signals.values():
+            seen[id(timestamps)] = timestamps.nbytes
+            seen[id(values)] = values.nbytes
+        return sum(seen.values())
+
+    def to_dataframe(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """Wide table of the given signals (all by default) on their joint timestamps."""
+        if columns is None:
+            columns = self.columns
+        columns = [c for c in columns if c in self._signals]
+
+        # One frame per shared timestamps array, joined on the union of timestamps.
+        groups: Dict[int, List[str]] = {}
+        for name in columns:
+            groups.setdefault(id(self._signals[name][0]), []).append(name)
+        frames = [
+            pd.DataFrame({name: self[name] for name in names})
+            for names in groups.values()
+        ]
+        if not frames:
+            return pd.DataFrame(index=pd.Index([], name=self.index_name))
+        df = pd.concat(frames, axis=1).sort_index()
+        df.index.name = self.index_name
+        return df[columns]
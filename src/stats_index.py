@@ -0,0 +1,468 @@
+"""
+Per-bucket statistics of the decoded signals, and event search on top of them.
+
+With `stats_index.enabled` every conversion also writes `stats_<name>.parquet` next to
+the exports. For every signal and every `resolution` seconds bucket holding samples it
+has one row with the min, max, mean, standard deviation and count of the samples, and
+`max_rate`, the largest |dv/dt| between a sample and the one before it:
+
+    signal, start, min, max, mean, std, count, max_rate
+
+Rows are sorted by signal and time and stored in small row groups, so the Parquet
+statistics let a query skip everything but the row groups of one signal that can match.
+
+`search` finds events in one log without reading it whole. The index gives the buckets
+that can hold an event, adjacent ones are merged into windows, and only those windows
+are read from the export at full resolution to find the exact events:
+
+    above / below   runs of samples above or below a threshold
+    rate            samples changing faster than `rate` units per second
+    sigma           runs of samples further than `sigma` standard deviations from the
+                    signal's mean over the whole log (outliers)
+
+`search_collection` does the same over every indexed log of an export folder. From the
+command line:
+
+    python -m src.stats_index processed_files/filtered_log.parquet --signal BMS_Pack_Current --rate 200
+    python -m src.stats_index processed_files --signal EMB_InverterTemperature1 --above 80
+
+Like the pyramid, this module only depends on pandas and pyarrow so that the dashboard
+can import it. The exports are read through a `RawReader` handed in by the caller.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from rich import print
+from rich.console import Console
+
+INDEX_NAME = "timestamps"
+ROW_GROUP_ROWS = 16_384
+# Candidate windows are read from the export in at most this many time ranges.
+MAX_READS = 32
+KINDS = ("above", "below", "rate", "sigma")
+
+# Reads rows of an export: (columns, (start, end)) -> dataframe indexed by timestamps.
+RawReader = Callable[[List[str], Optional[Tuple[float, float]]], pd.DataFrame]
+
+INDEX_COLUMNS = ["signal", "start", "min", "max", "mean", "std", "count", "max_rate"]
+EVENT_COLUMNS = ["signal", "kind", "start", "end", "peak", "samples"]
+
+
+def get_stats_settings(config: Dict) -> Dict:
+    stats = config.get("stats_index", {})
+    if type(stats) is not dict:
+        print("[red]Config file has bad stats_index settings. Using defaults instead.")
+        stats = {}
+    enabled = bool(stats.get("enabled", True))
+    export_settings = config.get("export_settings", {})
+    if enabled and type(export_settings) is dict:
+        if export_settings.get("timestamps_as_date", False):
+            print("[yellow]The stats index needs timestamps in seconds, skipping it.")
+            enabled = False
+    return {
+        "enabled": enabled,
+        "resolution": float(stats.get("resolution", 1.0)),
+    }
+
+
+def stats_path(export_dir: str, name: str) -> str:
+    return os.path.join(export_dir, f"stats_{name}.parquet")
+
+
+def stats_for_export(export_file: str) -> Optional[str]:
+    """The stats index written alongside a `filtered_<name>` export, if there is one."""
+    base = os.path.splitext(os.path.basename(export_file))[0]
+    name = re.sub(r"^filtered_", "", base)
+    path = stats_path(os.path.dirname(export_file), name)
+    return path if os.path.exists(path) else None
+
+
+class StatsIndexBuilder:
+    """
+    Accumulate per-bucket min, max, sum, sum of squares, count and max rate of every
+    numeric signal, one decoded dataframe (or chunk of one) at a time. The last sample
+    of each signal is kept, so the rate across two chunks is counted as well.
+    """
+
+    def __init__(self, resolution: float = 1.0):
+        self.resolution = resolution
+        self.signals: List[str] = []
+        self._parts: List[pd.DataFrame] = []
+        self._last: Dict[str, Tuple[float, float]] = {}
+
+    def add(self, df: pd.DataFrame) -> None:
+        numeric = df.select_dtypes("number")
+        if not len(numeric) or not len(numeric.columns):
+            return
+        t = np.asarray(numeric.index, dtype=np.float64)
+        bucket = np.floor(t / self.resolution).astype(np.int64)
+        parts = []
+        for name in numeric.columns:
+            values = numeric[name].to_numpy(np.float64)
+            present = ~np.isnan(values)
+            if not present.any():
+                continue
+            if name not in self.signals:
+                self.signals.append(name)
+            ts, vs, bs = t[present], values[present], bucket[present]
+
+            last = self._last.get(name)
+            previous_t = np.concatenate(
+                [[np.nan if last is None else last[0]], ts[:-1]]
+            )
+            previous_v = np.concatenate(
+                [[np.nan if last is None else last[1]], vs[:-1]]
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rate = np.abs(vs - previous_v) / (ts - previous_t)
+            rate[~np.isfinite(rate)] = np.nan
+            self._last[name] = (float(ts[-1]), float(vs[-1]))
+
+            # The samples are in time order, so each bucket is one run of them.
+            starts = np.flatnonzero(np.diff(bs, prepend=bs[0] - 1))
+            parts.append(
+                pd.DataFrame(
+                    {
+                        "signal": name,
+                        "bucket": bs[starts],
+                        "min": np.minimum.reduceat(vs, starts),
+                        "max": np.maximum.reduceat(vs, starts),
+                        "sum": np.add.reduceat(vs, starts),
+                        "sumsq": np.add.reduceat(vs * vs, starts),
+                        "count": np.diff(np.append(starts, len(vs))),
+                        "max_rate": np.fmax.reduceat(rate, starts),
+                    }
+                )
+            )
+        if parts:
+            self._parts.append(pd.concat(parts, ignore_index=True))
+        if len(self._parts) >= 16:
+            self._parts = [self._merge(self._parts)]
+
+    @staticmethod
+    def _merge(parts: List[pd.DataFrame]) -> pd.DataFrame:
+        """Combine partial aggregates of buckets split over several chunks."""
+        df = pd.concat(parts, ignore_index=True)
+        return df.groupby(["signal", "bucket"], sort=False, as_index=False).agg(
+            {
+                "min": "min",
+                "max": "max",
+                "sum": "sum",
+                "sumsq": "sum",
+                "count": "sum",
+                "max_rate": "max",
+            }
+        )
+
+    def table(self) -> pd.DataFrame:
+        """The index rows, sorted by signal and time."""
+        if not self._parts:
+            return pd.DataFrame(columns=INDEX_COLUMNS)
+        df = self._merge(self._parts).sort_values(
+            ["signal", "bucket"], ignore_index=True
+        )
+        mean = df["sum"] / df["count"]
+        variance = (df["sumsq"] / df["count"] - mean * mean).clip(lower=0)
+        return pd.DataFrame(
+            {
+                "signal": df["signal"],
+                "start": df["bucket"] * self.resolution,
+                "min": df["min"],
+                "max": df["max"],
+                "mean": mean,
+                "std": np.sqrt(variance),
+                "count": df["count"].astype(np.uint32),
+                "max_rate": df["max_rate"],
+            }
+        )
+
+    def write(self, path: str, export_file: Optional[str] = None) -> str:
+        table = pa.Table.from_pandas(self.table(), preserve_index=False)
+        meta = {
+            "resolution": self.resolution,
+            "export": export_file and os.path.basename(export_file),
+        }
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}), b"stats_index": json.dumps(meta)}
+        )
+        pq.write_table(table, path, compression="zstd", row_group_size=ROW_GROUP_ROWS)
+        return path
+
+
+def build_stats_index(
+    df: pd.DataFrame, path: str, settings: Dict, export_file: Optional[str] = None
+) -> str:
+    builder = StatsIndexBuilder(settings["resolution"])
+    builder.add(df)
+    return builder.write(path, export_file)
+
+
+def index_meta(path: str) -> Dict:
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata.get(b"stats_index", b"{}"))
+
+
+def signal_summary(path: str, signal: str) -> Dict[str, float]:
+    """Mean, standard deviation, min, max and count of a signal over the whole log."""
+    df = pq.read_table(
+        path,
+        columns=["min", "max", "mean", "std", "count"],
+        filters=[("signal", "==", signal)],
+    ).to_pandas()
+    count = df["count"].astype(np.float64)
+    n = count.sum()
+    if not n:
+        return {"mean": np.nan, "std": np.nan, "min": np.nan, "max": np.nan, "count": 0}
+    mean = (df["mean"] * count).sum() / n
+    squares = ((df["std"] ** 2 + df["mean"] ** 2) * count).sum() / n
+    return {
+        "mean": float(mean),
+        "std": float(np.sqrt(max(squares - mean * mean, 0.0))),
+        "min": float(df["min"].min()),
+        "max": float(df["max"].max()),
+        "count": int(n),
+    }
+
+
+def _bounds(path: str, signal: str, kind: str, value: float) -> Dict[str, float]:
+    """The thresholds a search stands for: "above" and/or "below", or "rate"."""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown search kind {kind!r}, use one of {KINDS}")
+    if kind == "sigma":
+        summary = signal_summary(path, signal)
+        spread = value * summary["std"]
+        return {
+            "above": summary["mean"] + spread,
+            "below": summary["mean"] - spread,
+        }
+    return {kind: float(value)}
+
+
+def candidate_windows(
+    path: str, signal: str, bounds: Dict[str, float]
+) -> List[Tuple[float, float]]:
+    """
+    Time windows of the buckets that can hold an event, with adjacent buckets merged.
+    Only the row groups whose statistics allow a match are read.
+    """
+    # One AND-list per bound, OR-ed together.
+    column = {"above": "max", "below": "min", "rate": "max_rate"}
+    operator = {"above": ">", "below": "<", "rate": ">"}
+    filters = [
+        [("signal", "==", signal), (column[b], operator[b], v)]
+        for b, v in bounds.items()
+        if not np.isnan(v)
+    ]
+    if not filters:
+        return []
+    resolution = index_meta(path)["resolution"]
+    starts = (
+        pq.read_table(path, columns=["start"], filters=filters)
+        .column("start")
+        .to_numpy()
+    )
+    if not len(starts):
+        return []
+    starts = np.unique(starts)
+    # A new window wherever a bucket does not directly follow the one before.
+    breaks = np.flatnonzero(np.diff(starts) > resolution * 1.5) + 1
+    first = starts[np.concatenate([[0], breaks])]
+    last = starts[np.concatenate([breaks - 1, [len(starts) - 1]])]
+    return list(zip(first, last + resolution))
+
+
+def _coalesce(
+    windows: List[Tuple[float, float]], max_reads: int
+) -> List[Tuple[float, float]]:
+    """
+    Join the windows separated by the smallest gaps until at most `max_reads` are
+    left. The samples in between cannot match, so finding events over the joined
+    range gives the same events, and a few larger reads are faster than many small.
+    """
+    if len(windows) <= max_reads:
+        return windows
+    starts, ends = np.array(windows).T
+    gaps = starts[1:] - ends[:-1]
+    breaks = np.sort(np.argsort(gaps, kind="stable")[len(gaps) - (max_reads - 1) :])
+    first = starts[np.concatenate([[0], breaks + 1])]
+    last = ends[np.concatenate([breaks, [len(ends) - 1]])]
+    return list(zip(first, last))
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """First and last position of every run of True in `mask`."""
+    edges = np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+
+
+def _window_events(
+    t: np.ndarray, v: np.ndarray, signal: str, kind: str, bounds: Dict[str, float]
+) -> List[Dict]:
+    events = []
+    if kind == "rate":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = np.abs(np.diff(v)) / np.diff(t)
+        for i in np.flatnonzero(rate > bounds["rate"]):
+            events.append(
+                {
+                    "signal": signal,
+                    "kind": kind,
+                    "start": t[i],
+                    "end": t[i + 1],
+                    "peak": float(rate[i]),
+                    "samples": 2,
+                }
+            )
+        return events
+
+    for bound, value in bounds.items():
+        outside = v > value if bound == "above" else v < value
+        for first, last in zip(*_runs(outside)):
+            run = v[first : last + 1]
+            events.append(
+                {
+                    "signal": signal,
+                    "kind": kind,
+                    "start": t[first],
+                    "end": t[last],
+                    "peak": float(run.max() if bound == "above" else run.min()),
+                    "samples": int(last - first + 1),
+                }
+            )
+    return events
+
+
+def search(
+    path: str, read_raw: RawReader, signal: str, kind: str, value: float
+) -> pd.DataFrame:
+    """
+    Events of one signal in the log indexed at `path`: runs of samples `above` or
+    `below` `value`, changes faster than `value` per second (`rate`), or runs further
+    than `value` standard deviations from the mean (`sigma`).
+    """
+    bounds = _bounds(path, signal, kind, value)
+    windows = _coalesce(candidate_windows(path, signal, bounds), MAX_READS)
+    resolution = index_meta(path)["resolution"] if windows else 0.0
+    events = []
+    for start, end in windows:
+        if kind == "rate":
+            # The rate of the first sample is counted from the sample before it.
+            t, v = _read_signal(read_raw, signal, (start - resolution, end))
+            look_back = resolution
+            while len(t) and t[0] >= start and look_back < start:
+                look_back *= 4
+                t, v = _read_signal(read_raw, signal, (start - look_back, end))
+            keep = np.flatnonzero(t >= start)
+            if len(keep):
+                t, v = t[max(keep[0] - 1, 0) :], v[max(keep[0] - 1, 0) :]
+        else:
+            t, v = _read_signal(read_raw, signal, (start, end))
+        events.extend(_window_events(t, v, signal, kind, bounds))
+    return pd.DataFrame(events, columns=EVENT_COLUMNS)
+
+
+def _read_signal(
+    read_raw: RawReader, signal: str, time_range: Tuple[float, float]
+) -> Tuple[np.ndarray, np.ndarray]:
+    df = read_raw([signal], time_range)
+    if signal not in df.columns:
+        return np.array([]), np.array([])
+    s = df[signal].dropna()
+    return s.index.values.astype(np.float64), s.values.astype(np.float64)
+
+
+def indexed_logs(export_dir: str) -> Dict[str, str]:
+    """Stats index -> export of every indexed log in an export folder."""
+    logs = {}
+    for path in sorted(glob.glob(os.path.join(export_dir, "stats_*.parquet"))):
+        export = index_meta(path).get("export")
+        if export and os.path.exists(os.path.join(export_dir, export)):
+            logs[path] = os.path.join(export_dir, export)
+    return logs
+
+
+def search_collection(
+    export_dir: str,
+    read_table: Callable[..., pd.DataFrame],
+    signal: str,
+    kind: str,
+    value: float,
+) -> pd.DataFrame:
+    """
+    `search` over every indexed log of `export_dir`, with an `export_file` column.
+    `read_table(path, columns, time_range)` reads an export, e.g. `exporters.read_table`.
+    Logs without the signal are skipped from their index alone.
+    """
+    frames = []
+    for path, export in indexed_logs(export_dir).items():
+        events = search(
+            path,
+            lambda columns, time_range, export=export: read_table(
+                export, columns=columns, time_range=time_range
+            ),
+            signal,
+            kind,
+            value,
+        )
+        if len(events):
+            events.insert(0, "export_file", export)
+            frames.append(events)
+    if not frames:
+        return pd.DataFrame(columns=["export_file", *EVENT_COLUMNS])
+    return pd.concat(frames, ignore_index=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Find events in converted logs from their stats index."
+    )
+    parser.add_argument("path", help="A filtered_<name> export or an export folder.")
+    parser.add_argument("--signal", required=True)
+    kinds = parser.add_mutually_exclusive_group(required=True)
+    kinds.add_argument("--above", type=float, help="Runs of samples above this.")
+    kinds.add_argument("--below", type=float, help="Runs of samples below this.")
+    kinds.add_argument(
+        "--rate", type=float, help="Changes faster than this per second."
+    )
+    kinds.add_argument(
+        "--sigma", type=float, help="Samples this many std from the mean."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import src.exporters as exporters
+
+    args = parse_args()
+    kind = next(k for k in KINDS if getattr(args, k) is not None)
+    value = getattr(args, kind)
+    if os.path.isdir(args.path):
+        events = search_collection(
+            args.path, exporters.read_table, args.signal, kind, value
+        )
+    else:
+        index = stats_for_export(args.path)
+        if index is None:
+            raise SystemExit(f"No stats index next to {args.path}")
+        events = search(
+            index,
+            lambda columns, time_range: exporters.read_table(
+                args.path, columns=columns, time_range=time_range
+            ),
+            args.signal,
+            kind,
+            value,
+        )
+    if len(events):
+        # Without markup, so brackets in the table are printed as they are.
+        Console().print(events.to_string(index=False), markup=False)
+    print(f"[green]{len(events)} events")
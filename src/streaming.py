@@ -0,0 +1,535 @@
+"""
+Chunked, bounded-memory conversion of large MF4 files.
+
+The default conversion loads the whole log with `MDF.to_dataframe()` and decodes it with
+`MDF.extract_bus_logging()`, so both the raw and the decoded tables sit in RAM together.
+Here the raw `CAN_DataFrame` records are read `chunk_records` at a time, each chunk is
+decoded with the same asammdf signal extraction that `extract_bus_logging` uses, and both
+tables are appended to the export files. Peak memory is set by the chunk size rather
+than by the size of the log.
+
+Reading, decoding, formatting and writing run on their own threads (see `src.pipeline`)
+with at most `pipeline.depth` chunks waiting between two of them, so the next
+chunk is read and decoded while the previous one is written. With `decoding.workers`
+above 1 each chunk is also decoded over several processes (see `src.parallel_decode`).
+
+Messages are matched on arbitration ID and IDE flag. J1939 PGN matching is only
+available in the default (non-streaming) conversion. With `decoding.engine = "numpy"`
+the chunks are decoded by `src.decoder` instead.
+
+The decoded export is written before the whole log has been read, so its columns are
+every signal of the DBC messages (narrowed by the active profiles), including messages
+the log never holds, whose columns stay empty.
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from asammdf import MDF, Signal
+from asammdf.blocks.bus_logging_utils import extract_mux
+from asammdf.blocks.utils import UniqueDB, components, load_can_database
+from diskcache import Cache
+from rich import print
+
+import src.alignment as alignment
+import src.catalog as catalog
+import src.dbc_cache as dbc_cache
+import src.decoder as decoder
+import src.exporters as exporters
+import src.indicators as indicators
+import src.manifest as manifest
+import src.metrics as metrics
+import src.mf4_helpers as mf4_helpers
+import src.parallel_decode as parallel_decode
+import src.pipeline as pipeline
+import src.profiles as profiles
+import src.pyramid as pyramid
+import src.raw_store as raw_store
+import src.stats_index as stats_index
+
+# (messages keyed by (arbitration id, is extended), valid bus channel)
+CanDatabase = Tuple[Dict[Tuple[int, bool], object], int]
+
+
+def get_streaming_settings(config: Dict) -> Dict:
+    streaming = config.get("streaming", {})
+    if type(streaming) is not dict:
+        print("[red]Config file has bad streaming settings. Using defaults instead.")
+        streaming = {}
+    return {
+        "enabled": bool(streaming.get("enabled", False)),
+        "chunk_records": int(streaming.get("chunk_records", 500_000)),
+    }
+
+
+def raw_chunk_to_df(
+    chunk: Signal, origin: float, start_time, export_settings: Dict
+) -> pd.DataFrame:
+    """Same columns as `mf4_helpers.mdf_to_df` gives for the raw frames of a log."""
+    index = mf4_helpers.export_index(
+        chunk.timestamps, origin, start_time, export_settings
+    )
+    df = pd.DataFrame(
+        dict(
+            components(
+                chunk.samples,
+                chunk.name,
+                UniqueDB(),
+                master=index,
+                only_basenames=export_settings["only_basenames"],
+            )
+        ),
+        index=index,
+    )
+    return mf4_helpers.add_date_column(df, start_time)
+
+
+def load_can_databases(dbcs: Dict, cache: Optional[Cache] = None) -> List[CanDatabase]:
+    databases = []
+    for dbc_name, bus_channel in dbcs.get("CAN", []):
+        dbc = dbc_cache.cached_parse(cache, dbc_name, "canmatrix", load_can_database)
+        if dbc is None:
+            print(f"[yellow]⚠️Could not load DBC: {dbc_name}")
+            continue
+        messages = {
+            (message.arbitration_id.id, bool(message.arbitration_id.extended)): message
+            for message in dbc
+        }
+        databases.append((messages, bus_channel))
+    return databases
+
+
+def _find_message(databases: List[CanDatabase], key: decoder.FrameKey):
+    bus_id, msg_id, is_extended = key
+    for messages, bus_channel in databases:
+        if bus_channel and bus_channel != bus_id:
+            continue
+        message = messages.get((msg_id, bool(is_extended)))
+        if message is not None:
+            return message
+    return None
+
+
+def decoded_columns(
+    databases: List[CanDatabase], keys: Optional[Iterable] = None
+) -> List[str]:
+    """
+    Signal names, in DBC order, of the messages seen under the given frame keys, or of
+    every message when `keys` is None.
+    """
+    present = None
+    if keys is not None:
+        present = set()
+        for key in keys:
+            message = _find_message(databases, key)
+            if message is not None:
+                present.add(message.name)
+
+    columns = []
+    for messages, _ in databases:
+        for message in messages.values():
+            if present is None or message.name in present:
+                columns.extend(s.name for s in message if s.name not in columns)
+    return columns
+
+
+def decode_frames(
+    t: np.ndarray,
+    bus: np.ndarray,
+    ids: np.ndarray,
+    ide: np.ndarray,
+    payload: np.ndarray,
+    databases: List[CanDatabase],
+) -> pd.DataFrame:
+    """Decode a block of raw frames into one row per timestamp, one column per signal."""
+    frames = []
+    for key, idx in decoder.group_frames(bus, ids, ide):
+        message = _find_message(databases, key)
+        if message is None:
+            continue
+        bus_id, msg_id, is_extended = key
+        extracted = extract_mux(
+            payload[idx],
+            message,
+            msg_id,
+            bus_id,
+            t[idx],
+            is_extended=bool(is_extended),
+        )
+        for signals in extracted.values():
+            if not signals:
+                continue
+            index = next(iter(signals.values()))["t"]
+            frames.append(
+                pd.DataFrame(
+                    {name: s["samples"] for name, s in signals.items()}, index=index
+                )
+            )
+    return decoder.merge_message_frames(frames)
+
+
+def align_decoded_chunk(
+    df: pd.DataFrame, columns: List[str], origin: float, start_time, export_settings
+) -> pd.DataFrame:
+    """
+    Give a decoded chunk the same columns and float dtypes as every other chunk, so they
+    can be appended to one Parquet/Arrow file whichever messages each one holds.
+    """
+    df = df.reindex(columns=columns)
+    for col in columns:
+        if df[col].dtype.kind in "iub":
+            df[col] = df[col].astype("float64")
+    df.index = mf4_helpers.export_index(
+        df.index.values, origin, start_time, export_settings
+    )
+    return mf4_helpers.add_date_column(df, start_time)
+
+
+def empty_decoded(columns: List[str]) -> pd.DataFrame:
+    """Header-only decoded export for logs where no frame matched the DBCs."""
+    empty = pd.DataFrame(
+        columns=columns, dtype="float64", index=pd.Index([], name="timestamps")
+    )
+    empty["date"] = pd.Series(dtype="datetime64[ns, UTC]")
+    return empty
+
+
+def record_conversion(
+    config: Dict,
+    export_dir: str,
+    mf4_file: str,
+    export_file: str,
+    start_time,
+    signal_counts: pd.Series,
+    accumulator=None,
+) -> None:
+    """Add a converted log to the catalog in the export directory, if enabled."""
+    settings = catalog.get_catalog_settings(config, export_dir)
+    if not settings["enabled"]:
+        return
+    catalog.record_log(
+        settings["path"],
+        mf4_file,
+        export_file,
+        vehicle=catalog.vehicle_for(
+            mf4_file, mf4_helpers.get_paths(config)["data_files"]
+        ),
+        start_time=start_time,
+        signal_counts=signal_counts.to_dict(),
+        accumulator=accumulator,
+    )
+
+
+class SegmentWriter:
+    """
+    `TableWriter` for one export of a streaming conversion. With a checkpoint the
+    export is written as segments in the checkpoint folder, cut at every checkpoint and
+    joined into the export by `finish`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stage: str,
+        compression: Optional[str],
+        checkpoint: Optional[manifest.Checkpoint] = None,
+    ):
+        self.path = path
+        self.stage = stage
+        self.compression = compression
+        self.checkpoint = checkpoint
+        self.writer = None
+        if checkpoint is None:
+            self.writer = exporters.TableWriter(path, compression=compression)
+
+    def has_rows(self) -> bool:
+        written = self.writer is not None and self.writer.rows
+        return bool(written or (self.checkpoint and self.checkpoint.parts(self.stage)))
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.writer is None:
+            segment = self.checkpoint.segment_path(
+                self.stage, os.path.splitext(self.path)[1].lower()
+            )
+            self.writer = exporters.TableWriter(segment, compression=self.compression)
+        self.writer.write(df)
+
+    def cut(self) -> Optional[str]:
+        """Close the current segment, returning its path if anything was written."""
+        if self.checkpoint is None or self.writer is None:
+            return None
+        self.writer.close()
+        segment, self.writer = self.writer.path, None
+        return segment
+
+    def finish(self) -> str:
+        if self.checkpoint is None:
+            self.writer.close()
+        else:
+            exporters.concat_files(
+                self.checkpoint.parts(self.stage), self.path, self.compression
+            )
+        return self.path
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+
+def stream_convert_file(
+    mf4_file: str,
+    dbcs: Dict,
+    config: Dict,
+    export_dir: str,
+    run_metrics: Optional[metrics.Metrics] = None,
+    log_manifest: Optional[manifest.Manifest] = None,
+) -> Dict[str, str]:
+    """
+    Streaming counterpart of `converter.convert_file`. Writes the same raw bytes and
+    filtered exports, one chunk at a time, with the stages of consecutive chunks
+    overlapping. The stages of every chunk add up in `run_metrics`.
+
+    Only the stages in `log_manifest.todo` are redone. When the log has to be read,
+    progress is checkpointed so that an interrupted conversion resumes after its last
+    saved chunk. The indicators, LOD pyramid and stats index of the chunks written
+    before are rebuilt from the saved segments, or from the filtered export when only
+    they changed.
+    """
+    name_input = os.path.splitext(os.path.basename(mf4_file))[0]
+    if run_metrics is None:
+        run_metrics = metrics.Metrics(name_input, sample_memory=False)
+    if log_manifest is None:
+        log_manifest = manifest.Manifest(mf4_file, dbcs, config, export_dir)
+    todo = log_manifest.todo
+    export_settings = mf4_helpers.get_export_settings(config)
+    chunk_records = get_streaming_settings(config)["chunk_records"]
+    if "filtered" in todo:
+        cache = dbc_cache.open_cache(config)
+        patterns = profiles.active_patterns(config)
+        with run_metrics.stage("dbc_load"):
+            if decoder.get_decoding_settings(config)["engine"] == "numpy":
+                databases = decoder.message_lookup(
+                    decoder.compile_dbc_files(dbcs, cache)
+                )
+                databases = profiles.narrow_lookup(databases, patterns)
+                decode, columns_for = decoder.decode_frames, decoder.signal_columns
+            else:
+                databases = [
+                    (profiles.narrow_messages(messages, patterns), bus_channel)
+                    for messages, bus_channel in load_can_databases(dbcs, cache)
+                ]
+                decode, columns_for = decode_frames, decoded_columns
+
+    export_format = exporters.get_file_format(config)
+    outputs = {stage: log_manifest.outputs[stage] for stage in todo}
+    with run_metrics.stage("mf4_load"):
+        mdf = MDF(mf4_file)
+    groups = mf4_helpers.can_data_groups(mdf)
+    source_stages = todo & set(manifest.SOURCE_STAGES)
+    checkpoint = None
+    if source_stages:
+        n_chunks = sum(
+            -(-mdf.groups[group].channel_group.cycles_nr // chunk_records)
+            for group in groups
+        )
+        checkpoint = log_manifest.checkpoint(chunk_records, n_chunks)
+    writers = {
+        stage: SegmentWriter(
+            outputs[stage], stage, export_format["compression"], checkpoint
+        )
+        for stage in ("raw_bytes", "filtered")
+        if stage in todo
+    }
+    store_writer = None
+    parallel = None
+    signal_counts = pd.Series(dtype="int64")
+    accumulator = None
+    if "indicators" in todo:
+        accumulator = indicators.accumulator_from_settings(
+            indicators.get_indicator_settings(config)
+        )
+    lod_builder = None
+    if "lod" in todo:
+        lod_settings = pyramid.get_pyramid_settings(config)
+        lod_builder = pyramid.PyramidBuilder(
+            lod_settings["base_resolution"], lod_settings["min_buckets"]
+        )
+    stats_builder = None
+    if "stats" in todo:
+        stats_builder = stats_index.StatsIndexBuilder(
+            stats_index.get_stats_settings(config)["resolution"]
+        )
+
+    def add_decoded(df_decoded: pd.DataFrame) -> None:
+        nonlocal signal_counts
+        if lod_builder is not None:
+            with run_metrics.stage("lod"):
+                lod_builder.add(df_decoded)
+        if stats_builder is not None:
+            with run_metrics.stage("stats"):
+                stats_builder.add(df_decoded)
+        if accumulator is not None:
+            with run_metrics.stage("indicators"):
+                accumulator.update(df_decoded)
+        signal_counts = signal_counts.add(
+            df_decoded.select_dtypes("number").count(), fill_value=0
+        )
+
+    chunks_done = checkpoint.chunks if checkpoint is not None else 0
+    frames_done = checkpoint.frames if checkpoint is not None else 0
+
+    def save_progress() -> None:
+        with run_metrics.stage("checkpoint"):
+            segments = {}
+            for stage, writer in writers.items():
+                segment = writer.cut()
+                if segment is not None:
+                    segments[stage] = segment
+            if store_writer is not None:
+                store_writer.flush()
+            checkpoint.commit(chunks_done, frames_done, segments)
+
+    try:
+        if "raw_frames" in todo:
+            store_writer = raw_store.RawStoreWriter(
+                outputs["raw_frames"], mdf, mf4_file, resume_frames=frames_done
+            )
+        with run_metrics.stage("scan"):
+            origin = mf4_helpers.first_timestamp(mdf, groups)
+            if "filtered" in todo:
+                # Every signal of the (profile narrowed) DBC messages, known before
+                # the first chunk is read, so the log is only read once.
+                columns = columns_for(databases)
+                derived = alignment.DerivedChannels(
+                    alignment.get_derived_settings(config), columns
+                )
+                columns += derived.names
+                run_metrics.count("decode", signals=len(columns))
+                run_metrics.count("filtered", signals=len(columns))
+
+        if "filtered" in todo:
+            parallel = parallel_decode.ParallelDecoder(
+                decode, databases, decoder.get_decoding_settings(config)["workers"]
+            )
+
+        if checkpoint is not None and "filtered" in todo:
+            for segment in checkpoint.parts("filtered"):
+                with run_metrics.stage("resume"):
+                    df_decoded = exporters.read_table(segment)
+                derived.observe(df_decoded)
+                add_decoded(df_decoded)
+
+        def format_raw(chunk: Signal) -> pd.DataFrame:
+            with run_metrics.stage("format_raw", frames=len(chunk)):
+                df_raw = raw_chunk_to_df(chunk, origin, mdf.start_time, export_settings)
+                return mf4_helpers.mdf_to_raw_bytes(df_mf4=df_raw, config=config)
+
+        def write_raw(df_raw: pd.DataFrame) -> None:
+            with run_metrics.stage("raw_bytes", frames=len(df_raw)):
+                writers["raw_bytes"].write(df_raw)
+
+        def store_raw(chunk: Signal) -> None:
+            with run_metrics.stage("raw_frames", frames=len(chunk)):
+                store_writer.write(chunk)
+
+        def decode_chunk(chunk: Signal) -> Optional[pd.DataFrame]:
+            with run_metrics.stage("decode", frames=len(chunk)):
+                t, bus, ids, ide, payload = mf4_helpers.frame_arrays(chunk)
+                df_decoded = parallel.decode(t, bus, ids, ide, payload)
+            return df_decoded if len(df_decoded) else None
+
+        def format_decoded(df_decoded: pd.DataFrame) -> pd.DataFrame:
+            with run_metrics.stage("format_filtered"):
+                df_decoded = align_decoded_chunk(
+                    df_decoded, columns, origin, mdf.start_time, export_settings
+                )
+            if derived.names:
+                with run_metrics.stage("derived"):
+                    derived.apply(df_decoded)
+            return df_decoded
+
+        def write_decoded(df_decoded: pd.DataFrame) -> pd.DataFrame:
+            with run_metrics.stage("filtered"):
+                writers["filtered"].write(df_decoded)
+            return df_decoded
+
+        with pipeline.Pipeline(
+            pipeline.get_pipeline_settings(config)["depth"]
+        ) as stages:
+            if "raw_bytes" in todo:
+                stages.stage("format_raw", format_raw).then("write_raw", write_raw)
+            if store_writer is not None:
+                stages.stage("raw_frames", store_raw)
+            if "filtered" in todo:
+                stages.stage("decode", decode_chunk).then(
+                    "format_filtered", format_decoded
+                ).then("write_filtered", write_decoded).then("derive", add_decoded)
+
+            chunks = mf4_helpers.iter_raw_chunks(
+                mdf, chunk_records, groups=groups, start_chunk=chunks_done
+            )
+            for chunk in run_metrics.iterate("read", chunks) if source_stages else ():
+                if checkpoint is not None and checkpoint.due(chunks_done):
+                    # The segments can only be cut once every chunk before is written.
+                    stages.drain()
+                    save_progress()
+                chunks_done += 1
+                frames_done += len(chunk)
+                run_metrics.count("read", frames=len(chunk))
+                stages.put(chunk)
+
+        if "filtered" in todo and not writers["filtered"].has_rows():
+            writers["filtered"].write(empty_decoded(columns))
+        if checkpoint is not None:
+            save_progress()
+        for stage, writer in writers.items():
+            with run_metrics.stage(stage):
+                writer.finish()
+
+        if "filtered" not in todo and (
+            accumulator is not None
+            or lod_builder is not None
+            or stats_builder is not None
+        ):
+            # Only the derived outputs changed, rebuild them from the export.
+            for df_decoded in run_metrics.iterate(
+                "read_filtered", exporters.iter_table(log_manifest.outputs["filtered"])
+            ):
+                add_decoded(df_decoded)
+        if lod_builder is not None:
+            with run_metrics.stage("lod"):
+                lod_builder.write(outputs["lod"])
+        if stats_builder is not None:
+            with run_metrics.stage("stats"):
+                stats_builder.write(
+                    outputs["stats"], export_file=log_manifest.outputs["filtered"]
+                )
+        if accumulator is not None:
+            with run_metrics.stage("indicators"):
+                accumulator.save(outputs["indicators"])
+        if "filtered" in todo or "indicators" in todo:
+            with run_metrics.stage("catalog"):
+                record_conversion(
+                    config,
+                    export_dir,
+                    mf4_file,
+                    log_manifest.outputs["filtered"],
+                    start_time=mdf.start_time,
+                    signal_counts=signal_counts,
+                    accumulator=accumulator,
+                )
+        if checkpoint is not None:
+            checkpoint.finish()
+    finally:
+        with run_metrics.stage("close"):
+            for writer in writers.values():
+                writer.close()
+            if store_writer is not None:
+                store_writer.close()
+            mdf.close()
+            if parallel is not None:
+                parallel.close()
+
+    return outputs
@@ -0,0 +1,317 @@
+"""
+Synthetic CAN logs for benchmarks and tests, so no recorded vehicle data is needed.
+
+`build_database` generates a DBC with the messages the dashboard reads (battery, motor
+and charger signals with realistic ranges) plus any number of filler messages.
+`write_log` then writes an MF4 log of it with the same `CAN_DataFrame` layout as the
+loggers and python-can's `MF4Writer`. Three settings shape the log: its duration, the
+bus load in frames per second, and the message mix. Messages are sent with cycle times
+from 10 ms to 1 s, and some use extended IDs. Every signal follows a slow wave plus
+noise, so the data compresses and plots like real signals.
+
+Everything is generated from `seed`, so the same arguments always give the same files:
+
+    python -m src.synthetic --out synthetic/ --duration 600 --rate 2000 --messages 40
+"""
+
+import argparse
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import cantools
+import numpy as np
+from asammdf import MDF, Signal
+from asammdf.blocks.v4_blocks import SourceInformation
+from asammdf.blocks.v4_constants import BUS_TYPE_CAN, SOURCE_BUS
+from cantools.database import Database, Message
+from cantools.database import Signal as DbcSignal
+from cantools.database.conversion import LinearConversion
+from rich import print
+
+# Same record layout as python-can's MF4Writer.
+FRAME_DTYPE = np.dtype(
+    [
+        ("CAN_DataFrame.BusChannel", "<u1"),
+        ("CAN_DataFrame.ID", "<u4"),
+        ("CAN_DataFrame.IDE", "<u1"),
+        ("CAN_DataFrame.DLC", "<u1"),
+        ("CAN_DataFrame.DataLength", "<u1"),
+        ("CAN_DataFrame.DataBytes", "(64,)u1"),
+        ("CAN_DataFrame.Dir", "<u1"),
+        ("CAN_DataFrame.EDL", "<u1"),
+        ("CAN_DataFrame.BRS", "<u1"),
+        ("CAN_DataFrame.ESI", "<u1"),
+    ]
+)
+
+CYCLE_TIMES = (0.01, 0.02, 0.05, 0.1, 0.1, 0.2, 0.5, 1.0)
+
+# name, start byte, bits, signed, scale, offset, physical min, physical max
+SignalSpec = Tuple[str, int, int, bool, float, float, float, float]
+
+# The signals used by the dashboard indicators and plots.
+DASHBOARD_MESSAGES: Dict[str, Tuple[int, float, List[SignalSpec]]] = {
+    "BMS_1": (
+        0x100,
+        0.01,
+        [
+            ("BMS_Pack_Inst_Voltage", 0, 16, False, 0.1, 0, 340, 420),
+            ("BMS_Pack_Current", 2, 16, True, 0.1, 0, -80, 250),
+            ("BMS_Pack_SOC", 4, 8, False, 0.5, 0, 20, 95),
+            ("BMS_Avg_Temperature", 5, 8, False, 1, -40, 15, 45),
+        ],
+    ),
+    "EMB_1": (
+        0x200,
+        0.02,
+        [
+            ("EMB_Speed1", 0, 16, True, 1, 0, -500, 3000),
+            ("EMB_InverterTemperature1", 2, 8, False, 1, -40, 20, 70),
+            ("EMB_ElectricMachineTemperature1", 3, 8, False, 1, -40, 20, 90),
+            ("EMB_Voltage", 4, 16, False, 0.1, 0, 340, 420),
+        ],
+    ),
+    "NLG_1": (
+        0x300,
+        0.1,
+        [
+            ("NLG_DcHvVoltAct", 0, 16, False, 0.1, 0, 0, 420),
+            ("NLG_DcHvCurrAct", 2, 16, True, 0.1, 0, -5, 30),
+        ],
+    ),
+}
+
+
+def _filler_signals(index: int, rng: np.random.Generator) -> List[SignalSpec]:
+    specs = []
+    for k, (start, bits) in enumerate(((0, 16), (2, 16), (4, 8), (5, 8), (6, 16))):
+        signed = bool(rng.integers(0, 2)) and bits == 16
+        scale = float(rng.choice([1, 0.1, 0.01, 0.5]))
+        span = (2 ** (bits - 1) if signed else 2**bits) * scale * 0.9
+        low = -span if signed else 0.0
+        specs.append(
+            (f"SYN_{index:03d}_Signal{k}", start, bits, signed, scale, 0, low, span)
+        )
+    return specs
+
+
+def message_specs(
+    n_messages: int = 40, extended_fraction: float = 0.25, seed: int = 0
+) -> List[Dict]:
+    """
+    The dashboard messages and `n_messages` filler messages, each with its ID, cycle
+    time and signals.
+    """
+    rng = np.random.default_rng(seed)
+    specs = [
+        {
+            "name": name,
+            "frame_id": frame_id,
+            "extended": False,
+            "cycle_time": cycle,
+            "signals": signals,
+        }
+        for name, (frame_id, cycle, signals) in DASHBOARD_MESSAGES.items()
+    ]
+    for i in range(n_messages):
+        extended = bool(rng.random() < extended_fraction)
+        specs.append(
+            {
+                "name": f"SYN_{i:03d}",
+                "frame_id": (0x18F00000 + i) if extended else (0x400 + i),
+                "extended": extended,
+                "cycle_time": float(CYCLE_TIMES[i % len(CYCLE_TIMES)]),
+                "signals": _filler_signals(i, rng),
+            }
+        )
+    return specs
+
+
+def build_database(specs: List[Dict]) -> Database:
+    messages = []
+    for spec in specs:
+        signals = [
+            DbcSignal(
+                name,
+                start=start * 8,
+                length=bits,
+                byte_order="little_endian",
+                is_signed=signed,
+                conversion=LinearConversion(scale, offset, False),
+                minimum=low,
+                maximum=high,
+            )
+            for name, start, bits, signed, scale, offset, low, high in spec["signals"]
+        ]
+        messages.append(
+            Message(
+                spec["frame_id"],
+                spec["name"],
+                8,
+                signals,
+                is_extended_frame=spec["extended"],
+                cycle_time=int(spec["cycle_time"] * 1000),
+            )
+        )
+    return Database(messages)
+
+
+def write_dbc(specs: List[Dict], path: str) -> str:
+    cantools.database.dump_file(build_database(specs), path)
+    return path
+
+
+def _payloads(
+    spec: Dict, t: np.ndarray, rng: np.random.Generator, phase: float
+) -> np.ndarray:
+    """(N, 8) payloads of one message at times `t`: a slow wave plus noise per signal."""
+    payload = np.zeros((len(t), 8), dtype=np.uint8)
+    for k, (_, start, bits, signed, scale, offset, low, high) in enumerate(
+        spec["signals"]
+    ):
+        middle, half = (low + high) / 2, (high - low) / 2
+        period = 60.0 * (k + 1) + 17 * phase
+        physical = middle + half * 0.8 * np.sin(2 * np.pi * t / period + phase * 7)
+        physical += rng.normal(0, half * 0.02, len(t))
+        raw = np.round((np.clip(physical, low, high) - offset) / scale)
+        raw = raw.astype(np.int64) & ((1 << bits) - 1)
+        width = bits // 8
+        payload[:, start : start + width] = (
+            raw.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :width]
+        )
+    return payload
+
+
+def frame_schedule(specs: List[Dict], frames_per_s: float) -> List[Tuple[float, float]]:
+    """
+    Cycle time and phase of each message, the cycle times scaled so that the whole bus
+    carries about `frames_per_s`.
+    """
+    nominal = sum(1 / spec["cycle_time"] for spec in specs)
+    scale = nominal / frames_per_s
+    return [
+        (spec["cycle_time"] * scale, (i * 0.6180339887) % 1.0)
+        for i, spec in enumerate(specs)
+    ]
+
+
+def write_log(
+    path: str,
+    specs: List[Dict],
+    duration: float = 600,
+    frames_per_s: float = 2000,
+    seed: int = 0,
+    compression: int = 2,
+    chunk_seconds: float = 30,
+    start_time: Optional[datetime] = None,
+) -> int:
+    """
+    Write a synthetic MF4 log and return the number of frames in it. The log is built
+    `chunk_seconds` at a time, so memory does not grow with its duration.
+    """
+    rng = np.random.default_rng(seed)
+    schedule = frame_schedule(specs, frames_per_s)
+    mdf = MDF(version="4.10")
+    mdf.header.start_time = start_time or datetime(2024, 1, 1, tzinfo=timezone.utc)
+    mdf.append(
+        Signal(
+            name="CAN_DataFrame",
+            samples=np.array([], dtype=FRAME_DTYPE),
+            timestamps=np.array([], dtype="<f8"),
+            source=SourceInformation(source_type=SOURCE_BUS, bus_type=BUS_TYPE_CAN),
+        )
+    )
+    total = 0
+    for chunk_start in np.arange(0, duration, chunk_seconds):
+        chunk_end = min(chunk_start + chunk_seconds, duration)
+        times, records = [], []
+        for spec, (cycle, phase) in zip(specs, schedule):
+            first = np.ceil((chunk_start - phase * cycle) / cycle)
+            n = int(np.ceil((chunk_end - phase * cycle) / cycle) - first)
+            if n <= 0:
+                continue
+            t = (first + np.arange(n)) * cycle + phase * cycle
+            # A little jitter, as on a real bus.
+            t += rng.uniform(0, min(cycle * 0.05, 0.001), n)
+            t = t[(t >= chunk_start) & (t < chunk_end)]
+            frames = np.zeros(len(t), dtype=FRAME_DTYPE)
+            frames["CAN_DataFrame.BusChannel"] = 1
+            frames["CAN_DataFrame.ID"] = spec["frame_id"]
+            frames["CAN_DataFrame.IDE"] = int(spec["extended"])
+            frames["CAN_DataFrame.DLC"] = 8
+            frames["CAN_DataFrame.DataLength"] = 8
+            frames["CAN_DataFrame.DataBytes"][:, :8] = _payloads(spec, t, rng, phase)
+            times.append(t)
+            records.append(frames)
+        if not times:
+            continue
+        t = np.concatenate(times)
+        order = np.argsort(t, kind="stable")
+        mdf.extend(0, [(t[order], None), (np.concatenate(records)[order], None)])
+        total += len(t)
+
+    mdf.save(path, overwrite=True, compression=compression)
+    mdf.close()
+    return total
+
+
+def generate(
+    out_dir: str,
+    duration: float = 600,
+    frames_per_s: float = 2000,
+    n_messages: int = 40,
+    extended_fraction: float = 0.25,
+    seed: int = 0,
+    compression: int = 2,
+) -> Dict:
+    """Write `synthetic.dbc` and `synthetic.mf4` to `out_dir` and describe them."""
+    os.makedirs(out_dir, exist_ok=True)
+    specs = message_specs(n_messages, extended_fraction, seed)
+    dbc_file = write_dbc(specs, os.path.join(out_dir, "synthetic.dbc"))
+    mf4_file = os.path.join(out_dir, "synthetic.mf4")
+    frames = write_log(mf4_file, specs, duration, frames_per_s, seed, compression)
+    return {
+        "dbc_file": dbc_file,
+        "mf4_file": mf4_file,
+        "frames": frames,
+        "messages": len(specs),
+        "signals": sum(len(spec["signals"]) for spec in specs),
+        "duration_s": duration,
+        "frames_per_s": frames_per_s,
+        "extended_fraction": extended_fraction,
+        "seed": seed,
+        "compression": compression,
+        "size_bytes": os.path.getsize(mf4_file),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic CAN log.")
+    parser.add_argument("--out", default="./synthetic/")
+    parser.add_argument("--duration", type=float, default=600, help="Seconds.")
+    parser.add_argument("--rate", type=float, default=2000, help="Frames per second.")
+    parser.add_argument("--messages", type=int, default=40, help="Filler messages.")
+    parser.add_argument("--extended", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--compression", type=int, default=2, help="0 none, 1 deflate, 2 transposed."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    info = generate(
+        args.out,
+        duration=args.duration,
+        frames_per_s=args.rate,
+        n_messages=args.messages,
+        extended_fraction=args.extended,
+        seed=args.seed,
+        compression=args.compression,
+    )
+    print(
+        f"[green]✅ {info['frames']:,} frames of {info['messages']} messages "
+        f"({info['size_bytes'] / 1024**2:.1f} MB) written to: [bold]{info['mf4_file']}"
+    )
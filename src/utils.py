@@ -1,36 +1,24 @@
+from typing import Optional, Union
 import pandas as pd
 import panel as pn
+import alignment
 import styling
-from math import pi
-
-
-# VEHICLE_EFFICIENCY = 0.25  # for a litres per kwh of 0.459 for the vehicle.
-VEHICLE_EFFICIENCY = 0.4  # for an engine of good efficiency
-DIESEL_KWH_P_LITRE = 9.8
-GEAR_RATIO = 2 * pi / 60 / (6 * 2.741 * 4.75) * 0.5 * 3.6
-ELECTRICITY_COST_CHF_PER_KWh = 98 / 1000
-
-
-def litres_diesel_to_co2_kg(litres: float):
-    """
-    From: https://connectedfleet.michelin.com/blog/calculate-co2-emissions/#:~:text=One%20litre%20of%20diesel%20creates,has%20emitted%20in%20a%20month.
-        - One litre of diesel creates 2.54kg of CO2. So you can simply multiply the number of litres you’ve used by 2.54 to work out how many kilograms of CO2 your fleet has emitted in a month
-    """
-    return litres * 2.54
-
-
-def kwh_to_l_diesel(kilowatt_hours: float):
-    # 9,8 kWh/Liter
-    return kilowatt_hours / (DIESEL_KWH_P_LITRE * VEHICLE_EFFICIENCY)
-
-
-def kwh_to_co2_saved(kilowatt_hours):
-    return litres_diesel_to_co2_kg(
-        litres=kwh_to_l_diesel(kilowatt_hours=kilowatt_hours)
-    )
-
-
-def distance_from_speed(df: pd.DataFrame, speed_column: str, gear_ratio: float):
+from signal_store import SignalStore
+from indicators import (
+    VEHICLE_EFFICIENCY,
+    DIESEL_KWH_P_LITRE,
+    GEAR_RATIO,
+    ELECTRICITY_COST_CHF_PER_KWh,
+    IndicatorAccumulator,
+    litres_diesel_to_co2_kg,
+    kwh_to_l_diesel,
+    kwh_to_co2_saved,
+)
+
+
+def distance_from_speed(
+    df: Union[pd.DataFrame, SignalStore], speed_column: str, gear_ratio: float
+):
     """
     Calculate the distance travelled using speed data over time.
 
@@ -58,9 +46,15 @@ def distance_from_speed(df: pd.DataFrame, speed_column: str, gear_ratio: float):
     return total_distance
 
 
-def get_total_power_kwh(df: pd.DataFrame, voltage_column, current_column):
-    inst_power = df[voltage_column] * df[current_column]
-    timestamps = df.index
+def get_total_power_kwh(
+    df: Union[pd.DataFrame, SignalStore], voltage_column, current_column
+):
+    # Voltage and current come in different messages, so they are matched as-of on
+    # the times either was received. Each power sample is held until the next one,
+    # as in distance_from_speed.
+    aligned = alignment.align(df, [voltage_column, current_column])
+    inst_power = (aligned[voltage_column] * aligned[current_column]).dropna()
+    timestamps = inst_power.index
     time_diffs = timestamps.diff().fillna(0)
     power = inst_power * time_diffs
     total_power = power.fillna(0).sum()
@@ -69,49 +63,42 @@ def get_total_power_kwh(df: pd.DataFrame, voltage_column, current_column):
 
 
 def get_indicators(
-    df: pd.DataFrame,
+    df: Union[pd.DataFrame, SignalStore, None],
     diesel_cost_per_litre=2,
     voltage_col="BMS_Pack_Inst_Voltage",
     current_col="BMS_Pack_Current",
     gen_vol_col="NLG_DcHvVoltAct",
     gen_cur_col="NLG_DcHvCurrAct",
     debug: bool = False,
+    accumulator: Optional[IndicatorAccumulator] = None,
 ):
-    total_power_kwh = -1
-    total_distance = -1
-    running_cost = -1
-    time_string = "Empty data"
-    generated_kwh = -1
+    """
+    Indicator cards for a log. All indicators are computed in one pass by an
+    `IndicatorAccumulator`, or taken from `accumulator` when one was saved at
+    conversion time, in which case `df` is not needed.
+    """
+    if accumulator is None:
+        accumulator = IndicatorAccumulator(
+            voltage_col=voltage_col,
+            current_col=current_col,
+            gen_vol_col=gen_vol_col,
+            gen_cur_col=gen_cur_col,
+        ).update(df)
+    results = accumulator.results(diesel_cost_per_litre=diesel_cost_per_litre)
+    if debug:
+        print(f"DEBUG: indicators = {results}")
 
-    if len(df.index):
-        if debug:
-            print("Getting runtime for log:")
-        if debug:
-            print(f"DEBUG: runtime = {df.index[-1]} - {df.index[0]}")
-        runtime = df.index[-1] - df.index[0]
-        hours, remainder = divmod(runtime, 3600)
+    time_string = "Empty data"
+    if accumulator.logs:
+        hours, remainder = divmod(results["runtime_s"], 3600)
         minutes, seconds = divmod(remainder, 60)
         time_string = f"{int(hours)}h {int(minutes)}m {int(seconds)}s"
+    if results["distance_km"] < 0:
+        print("Speed1 not in columns, skipping card update")
 
-        if debug:
-            print(f"DEBUG: total_power = ")
-
-        if voltage_col in df.columns and current_col in df.columns:
-            total_power_kwh = get_total_power_kwh(
-                df, voltage_column=voltage_col, current_column=current_col
-            )
-
-        if gen_cur_col in df.columns and gen_vol_col in df.columns:
-            generated_kwh = get_total_power_kwh(
-                df=df, voltage_column=gen_vol_col, current_column=gen_cur_col
-            )
-
-        if "EMB_Speed1" in df.columns:
-            total_distance = distance_from_speed(
-                df, speed_column="EMB_Speed1", gear_ratio=GEAR_RATIO
-            )
-        else:
-            print("Speed1 not in columns, skipping card update")
+    total_power_kwh = results["consumed_kwh"]
+    generated_kwh = results["generated_kwh"]
+    total_distance = results["distance_km"]
 
     indicators = pn.FlexBox(
         pn.indicators.String(
@@ -142,7 +129,7 @@ def get_indicators(
             font_size="48pt",
         ),
         pn.indicators.Number(
-            value=kwh_to_co2_saved(total_power_kwh),
+            value=results["co2_saved_kg"],
             name="CO2 Emmisions Saved (kg)",
             format="{value:,.2f}",
             styles=styling.CARD_STYLE,
@@ -156,7 +143,7 @@ def get_indicators(
         #     font_size="48pt",
         # ),
         pn.indicators.Number(
-            value=kwh_to_l_diesel(total_power_kwh) * diesel_cost_per_litre,
+            value=results["diesel_cost_saved"],
             name="Diesel Cost Saved (chf)",
             format="{value:,.2f}",
             styles=styling.CARD_STYLE,
@@ -1,5 +1,7 @@
-from typing import List
+from typing import Callable, List, Optional, Tuple
+import holoviews as hv
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 import panel as pn
 import seaborn as sns
@@ -13,12 +15,13 @@ empty_plot = pn.Spacer(
 )
 
 
-def plot_lines(sampled_df: pd.DataFrame, interesting_cols: List[str], fig_path=None):
+def plot_lines(
+    sampled_df: pd.DataFrame, interesting_cols: List[str], fig_path=None, show=True
+):
     # Plotting the interesting columns with improved performance and cleaner rendering for high density of points
     fig, ax = plt.subplots(figsize=(10, 6))
     for col in interesting_cols:
-        subset = sampled_df[pd.notna(sampled_df[col])]
-        ax.plot(subset.index, subset[col], label=col, linewidth=0.5)
+        static_line(ax, sampled_df[col], label=col, linewidth=0.5)
         # ax.scatter(sampled_df.index, sampled_df[col], label=col)
 
     ax.set_xlabel("Timestamps")
@@ -33,12 +36,16 @@ def plot_lines(sampled_df: pd.DataFrame, interesting_cols: List[str], fig_path=N
         fig.savefig(
             fig_path, format="png", dpi=300
         )  # Save as high-resolution image if path is provided
-    plt.show()
+    if show:
+        plt.show()
     return fig
 
 
 def multi_plot_line(
-    sampled_df: pd.DataFrame, columns_sets_per_plot: List[List[str]], fig_path=None
+    sampled_df: pd.DataFrame,
+    columns_sets_per_plot: List[List[str]],
+    fig_path=None,
+    show=True,
 ):
     fig, axes = plt.subplots(
         nrows=len(columns_sets_per_plot),
@@ -52,7 +59,7 @@ def multi_plot_line(
 
     for ax, cols in zip(axes, columns_sets_per_plot):
         for col in cols:
-            ax.plot(sampled_df.index, sampled_df[col], label=col)
+            static_line(ax, sampled_df[col], label=col)
         ax.set_xlabel("Timestamps")
         ax.set_ylabel(", ".join(cols))
         ax.set_title("Plot of " + ", ".join(cols))
@@ -65,7 +72,9 @@ def multi_plot_line(
         fig.savefig(
             fig_path, format="png", dpi=300
         )  # Save as high-resolution image if path is provided
-    plt.show()
+    if show:
+        plt.show()
+    return fig
 
 
 import contextlib
@@ -105,6 +114,139 @@ def rich_display_dataframe(
     print(table)
 
 
+# Most points sent to the browser per series. About one min and one max per pixel of a
+# full width plot, so the browser payload stays the same whatever the log length.
+PIXEL_BUDGET = 1500
+DECIMATION_METHOD = "minmax"  # or "lttb"
+
+
+def minmax_decimate(
+    t: np.ndarray, v: np.ndarray, n_bins: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the samples into `n_bins` runs of equal length and keep the minimum and the
+    maximum of each, in time order. Spikes survive, unlike with plain striding.
+    """
+    n = len(v)
+    if n <= 2 * n_bins:
+        return t, v
+    size = -(-n // n_bins)
+    padded = np.concatenate([v, np.full(size * n_bins - n, v[-1])]).reshape(n_bins, -1)
+    offsets = np.arange(n_bins) * size
+    idx = np.concatenate(
+        [[0, n - 1], offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)]
+    )
+    idx = np.unique(np.minimum(idx, n - 1))
+    return t[idx], v[idx]
+
+
+def lttb_decimate(
+    t: np.ndarray, v: np.ndarray, n_out: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last sample and, from each of
+    `n_out - 2` buckets in between, the sample forming the largest triangle with the
+    previously kept sample and the mean of the next bucket.
+    """
+    n = len(v)
+    if n <= n_out or n_out < 3:
+        return t, v
+    x = np.asarray(t, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    kept = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        if b + 2 < len(edges):
+            next_x = x[hi : edges[b + 2]].mean()
+            next_v = v[hi : edges[b + 2]].mean()
+        else:
+            next_x, next_v = x[-1], v[-1]
+        area = np.abs(
+            (x[kept] - next_x) * (v[lo:hi] - v[kept])
+            - (x[kept] - x[lo:hi]) * (next_v - v[kept])
+        )
+        kept = lo + int(area.argmax())
+        idx[b + 1] = kept
+    return t[idx], v[idx]
+
+
+def static_line(ax, series: pd.Series, n_pixels: Optional[int] = None, **kwargs):
+    """
+    Draw a series on a matplotlib axes with at most a min and a max per pixel column
+    of the axes, which looks the same as drawing every sample at a fraction of the cost.
+    Keyword arguments go to `ax.plot`.
+    """
+    series = series.dropna()
+    if n_pixels is None:
+        n_pixels = max(int(ax.get_window_extent().width), 1)
+    t, v = minmax_decimate(series.index.values, series.values, n_pixels)
+    return ax.plot(t, v, **kwargs)
+
+
+def decimate_series(
+    series: pd.Series,
+    x_range: Optional[Tuple[float, float]] = None,
+    n_pixels: int = PIXEL_BUDGET,
+    method: str = DECIMATION_METHOD,
+) -> pd.Series:
+    """
+    The samples of a sorted, NaN free series that fall in `x_range` (the whole series
+    when None), reduced to about `n_pixels` points.
+    """
+    t, v = series.index.values, series.values
+    if x_range is not None and None not in x_range:
+        # One sample either side so lines run to the edges of the view.
+        lo = max(np.searchsorted(t, x_range[0], side="left") - 1, 0)
+        hi = min(np.searchsorted(t, x_range[1], side="right") + 1, len(t))
+        t, v = t[lo:hi], v[lo:hi]
+    if method == "lttb":
+        t, v = lttb_decimate(t, v, n_pixels)
+    else:
+        t, v = minmax_decimate(t, v, n_pixels // 2)
+    return pd.Series(v, index=pd.Index(t, name=series.index.name), name=series.name)
+
+
+def range_plot(
+    fetch: Callable[[Optional[Tuple[float, float]]], pd.Series],
+    render: Callable[[pd.Series], hv.Element],
+) -> hv.DynamicMap:
+    """
+    Plot `render(fetch(x_range))`. A RangeX stream follows the visible x range, so the
+    data is fetched again for the visible part whenever the plot is zoomed or panned.
+    """
+
+    def callback(x_range):
+        return render(fetch(x_range))
+
+    return hv.DynamicMap(callback, streams=[hv.streams.RangeX()])
+
+
+def decimated_plot(
+    series: pd.Series, render: Callable[[pd.Series], hv.Element]
+) -> hv.DynamicMap:
+    """
+    Plot `render(series)` with the series decimated to the pixel budget. Zooming in
+    re-renders the visible part of the series at full resolution once few enough
+    samples are in view.
+    """
+    series = series.sort_index()
+    return range_plot(lambda x_range: decimate_series(series, x_range), render)
+
+
+def signal_plot(df, name: str, render: Callable[[pd.Series], hv.Element]):
+    """
+    Decimated plot of one signal of a DataFrame or SignalStore, or of a
+    `pyramid.LodSource`, which reads only the level of detail the view needs.
+    """
+    if hasattr(df, "fetch"):
+        return range_plot(
+            lambda x_range: decimate_series(df.fetch(name, x_range), x_range), render
+        )
+    return decimated_plot(df[name].dropna(), render)
+
+
 def hvplot_df_by_col(df: pd.DataFrame, cols: List[str], xlabel="", ylabel=""):
     """
     Recursively plot data from a DataFrame using Holoviews for each specified column.
@@ -114,7 +256,8 @@ def hvplot_df_by_col(df: pd.DataFrame, cols: List[str], xlabel="", ylabel=""):
     columns. The function handles missing data by dropping NA values before plotting.
 
     Args:
-        df (pd.DataFrame): The DataFrame containing the data to plot.
+        df (pd.DataFrame): The DataFrame containing the data to plot. A
+                           `signal_store.SignalStore` works too and needs no NA filtering.
         cols (List[str]): A list of column names to be plotted. The function plots
                           the first column and then recursively calls itself to plot
                           the remaining columns, overlaying each subsequent plot.
@@ -134,14 +277,15 @@ def hvplot_df_by_col(df: pd.DataFrame, cols: List[str], xlabel="", ylabel=""):
         print(f"[yellow bold]🚧WARNING: Could not find {name} in data... skipping.")
         name = cols.pop(0)
 
+    plot = signal_plot(
+        df,
+        name,
+        lambda s: s.hvplot(alpha=0.7, grid=True, xlabel=xlabel, ylabel=ylabel),
+    )
     if len(cols) > 0:
-        return df[name].dropna().hvplot(
-            alpha=0.7, grid=True, xlabel=xlabel, ylabel=ylabel
-        ) * hvplot_df_by_col(df, cols, xlabel=xlabel, ylabel=ylabel)
+        return plot * hvplot_df_by_col(df, cols, xlabel=xlabel, ylabel=ylabel)
     else:
-        return (
-            df[name].dropna().hvplot(alpha=0.7, grid=True, xlabel=xlabel, ylabel=ylabel)
-        )
+        return plot
 
 
 def battery_soc_plot(df: pd.DataFrame, soc_column: str = "BMS_Pack_SOC"):
@@ -149,15 +293,19 @@ def battery_soc_plot(df: pd.DataFrame, soc_column: str = "BMS_Pack_SOC"):
         return empty_plot
 
     if soc_column in df.columns:
-        return df[soc_column].hvplot.area(
-            ylabel="Power (kW)",
-            color="lightgreen",
-            alpha=0.7,
-            grid=True,
-            line_color="green",
-            line_alpha=0.6,
-            ylim=(0, 100),
-            xlabel="Time (s)",
+        return signal_plot(
+            df,
+            soc_column,
+            lambda s: s.hvplot.area(
+                ylabel="Power (kW)",
+                color="lightgreen",
+                alpha=0.7,
+                grid=True,
+                line_color="green",
+                line_alpha=0.6,
+                ylim=(0, 100),
+                xlabel="Time (s)",
+            ),
         )
 
 
@@ -169,9 +317,43 @@ def power_plot(
     color: str = "green",
     line_color: str = "darkgreen",
     label="",
+    power_col: Optional[str] = None,
 ):
+    """
+    Power in kW. Plots `power_col` when the log has it, a derived channel matching
+    voltage and current as-of at conversion, else the product of the two columns.
+    """
     if len(df) == 0:
         return empty_plot
+    if power_col is not None and power_col not in df.columns:
+        power_col = None
+
+    def render(s: pd.Series):
+        return s.hvplot.area(
+            ylabel=ylabel,
+            color=color,
+            alpha=0.7,
+            grid=True,
+            line_color=line_color,
+            line_alpha=0.6,
+            xlabel="Time (s)",
+            label=label,
+        )
+
+    if hasattr(df, "fetch_frame"):
+        # Level of detail source: bucket means of voltage and current when zoomed out.
+        def fetch(x_range):
+            if power_col is not None:
+                power = df.fetch_frame([power_col], x_range)[power_col].dropna() / 1000
+                return decimate_series(power, x_range)
+            frame = df.fetch_frame([voltage_col, current_col], x_range)
+            power = (frame[voltage_col] * frame[current_col]).dropna() / 1000
+            return decimate_series(power, x_range)
+
+        return range_plot(fetch, render)
+
+    if power_col is not None:
+        return decimated_plot(df[power_col].dropna() / 1000, render)
 
     power = df[voltage_col] * df[current_col]
 
@@ -179,31 +361,25 @@ def power_plot(
     power = power[pd.notna(power)] / 1000
 
     # render plot:
-    return power.hvplot.area(
-        ylabel=ylabel,
-        color=color,
-        alpha=0.7,
-        grid=True,
-        line_color=line_color,
-        line_alpha=0.6,
-        xlabel="Time (s)",
-        label=label,
-    )
+    return decimated_plot(power, render)
+
+
+TEMPERATURE_COLUMNS = [
+    # "TempCurrCool1",
+    # "TempCurr1",
+    # "ElectricMachineTemperature1",
+    # "InverterTemperature1",
+    # "TempCurrRotor1",
+    "BMS_Avg_Temperature",
+    "EMB_ElectricMachineTemperature1",
+    "EMB_InverterTemperature1",
+]
 
 
 def plot_temperatures(
     df: pd.DataFrame,
 ):
-    temp_cols = [
-        # "TempCurrCool1",
-        # "TempCurr1",
-        # "ElectricMachineTemperature1",
-        # "InverterTemperature1",
-        # "TempCurrRotor1",
-        "BMS_Avg_Temperature",
-        "EMB_ElectricMachineTemperature1",
-        "EMB_InverterTemperature1",
-    ]
+    temp_cols = list(TEMPERATURE_COLUMNS)
 
     print("Plotting temperatures: ", temp_cols)
     return hvplot_df_by_col(
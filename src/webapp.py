@@ -1,11 +1,26 @@
 import io
+import os
+import threading
 from typing import List
 import panel as pn
+import param
 import hvplot.pandas
 import pandas as pd
 import numpy as np
+import toml
+import holoviews as hv
 import visualisation as vis
 import utils
+import alignment
+import catalog
+import dataset_cache
+import live
+import exporters
+import metrics
+import indicators
+import pyramid
+import stats_index
+from signal_store import SignalStore
 from rich import print
 
 pn.extension()
@@ -14,27 +29,275 @@ pn.extension()
 
 # File selector GUI added for user to select or upload a file.
 # file_input = pn.widgets.FileInput(accept=".csv", name="Upload CSV File")
+# Lists the decoded exports in any format (.parquet, .feather/.arrow or .csv).
 file_input = pn.widgets.FileSelector(
-    name="Upload CSV File", directory="processed_files", file_pattern="*.csv"
+    name="Select Log File", directory="processed_files", file_pattern="filtered_*"
 )
 
+# Parsed logs are shared by every session served by this process. Least recently used
+# logs are dropped once they take more than this many bytes.
+DATASET_CACHE_BYTES = 2 * 1024**3
+datasets = pn.state.cache.setdefault(
+    "datasets", dataset_cache.DatasetCache(DATASET_CACHE_BYTES)
+)
+cache_stats = pn.pane.Markdown(sizing_mode="stretch_width")
+
+# Latency of the dashboard callbacks, over every session served by this process.
+# Resident memory is shared by the sessions, so it is not sampled per callback.
+dashboard_metrics = pn.state.cache.setdefault(
+    "dashboard_metrics", metrics.Metrics("dashboard", sample_memory=False)
+)
+latency_stats = pn.pane.Markdown(sizing_mode="stretch_width")
+
+CONFIG_PATH = "settings.toml"
+config = toml.load(CONFIG_PATH) if os.path.exists(CONFIG_PATH) else {}
+
+# Index of the converted logs, filled in by the converter.
+CATALOG_PATH = os.path.join(file_input.directory, "catalog.sqlite")
+
+# Channels derived from the decoded signals, such as power. The converter stores them
+# with the signals, and they are derived when the log is opened for older exports.
+DERIVED_SETTINGS = alignment.get_derived_settings(config)
+DERIVED_COLUMNS = (
+    list(DERIVED_SETTINGS["channels"]) if DERIVED_SETTINGS["enabled"] else []
+)
+INDICATOR_SETTINGS = indicators.get_indicator_settings(config)
+
+# Only these columns are read when a log is opened. The rest are read on demand when
+# they are picked in the column selector.
+INDICATOR_COLUMNS = [
+    "BMS_Pack_Inst_Voltage",
+    "BMS_Pack_Current",
+    "NLG_DcHvVoltAct",
+    "NLG_DcHvCurrAct",
+    "EMB_Speed1",
+    *DERIVED_COLUMNS,
+]
+DASHBOARD_COLUMNS = [
+    *INDICATOR_COLUMNS,
+    "BMS_Pack_SOC",
+    *vis.TEMPERATURE_COLUMNS,
+]
+
 
 # # Assuming df_mdf_filtered is the DataFrame you want to display and interact with
 
 
+@dashboard_metrics.timed("load_signals")
+def load_signals(file: str, columns: List[str]) -> SignalStore:
+    """
+    The given columns of an export. Each signal is parsed once and cached on its own, so
+    repeat views and overlapping column selections share one copy of it.
+    """
+    keys = {name: dataset_cache.file_key(file, "signal", name) for name in columns}
+    missing = [name for name, key in keys.items() if key not in datasets]
+    parsed = read_signals(file, missing) if missing else SignalStore()
+
+    def load(name: str) -> SignalStore:
+        # Evicted by another session since `missing` was worked out: read it again.
+        store = parsed if name in missing else read_signals(file, [name])
+        return store.select([name])
+
+    return SignalStore.merge(
+        datasets.get(key, lambda name=name: load(name)) for name, key in keys.items()
+    )
+
+
+def read_signals(file: str, columns: List[str]) -> SignalStore:
+    """
+    The given columns of an export, with the derived ones it does not have computed from
+    their inputs, which are read as well.
+    """
+    available = set(exporters.read_columns(file))
+    read = list(columns)
+    for name in read:
+        if name in DERIVED_COLUMNS and name not in available:
+            inputs = DERIVED_SETTINGS["channels"][name]["inputs"]
+            read.extend(i for i in inputs if i not in read)
+    store = SignalStore.from_dataframe(exporters.read_table(file, columns=read))
+    return with_derived(store)
+
+
+def with_derived(store: SignalStore) -> SignalStore:
+    """Add the derived channels the export does not have but has the inputs of."""
+    derived = alignment.DerivedChannels(DERIVED_SETTINGS, store.columns)
+    for name, (t, values) in derived.compute(store).items():
+        like = store.raw(derived.channels[name]["inputs"][0])[0]
+        store.add(name, alignment.from_seconds(t, like), values)
+    return store
+
+
+def refresh_cache_stats():
+    stats = datasets.stats()
+    cache_stats.object = (
+        f"**Dataset cache** {stats['entries']} datasets, "
+        f"{stats['bytes'] / 1024**2:,.0f} / {stats['max_bytes'] / 1024**2:,.0f} MB  \n"
+        f"hits {stats['hits']} · misses {stats['misses']} · "
+        f"evictions {stats['evictions']} · hit rate {stats['hit_rate']:.0%}"
+    )
+    if dashboard_metrics.stages:
+        latency_stats.object = "**Callbacks**  \n" + dashboard_metrics.summary()
+
+
+def events_view(signals: List[str], search_events, open_export=None):
+    """
+    Find threshold crossings, fast changes and outliers of a signal with
+    `search_events(signal, kind, value)`. Only the time windows the stats index points
+    to are read at full resolution. With `open_export`, clicking an event opens its log.
+    """
+    signal = pn.widgets.Select(name="Signal", options=signals)
+    kind = pn.widgets.Select(
+        name="Find",
+        options={
+            "Above": "above",
+            "Below": "below",
+            "Changing faster than (per s)": "rate",
+            "Outliers (std from the mean)": "sigma",
+        },
+    )
+    value = pn.widgets.FloatInput(name="Value", value=3.0)
+    button = pn.widgets.Button(name="Search", button_type="primary")
+    results = pn.Column(sizing_mode="stretch_width")
+
+    @dashboard_metrics.timed("event_search")
+    def run_search(event):
+        if not signal.value:
+            return
+        events = search_events(signal.value, kind.value, value.value)
+        table = pn.widgets.Tabulator(
+            events,
+            hidden_columns=["export_file"],
+            pagination="remote",
+            page_size=20,
+            disabled=True,
+            sizing_mode="stretch_width",
+        )
+        if open_export is not None and "export_file" in events.columns:
+            table.on_click(lambda e: open_export(events["export_file"].iloc[e.row]))
+        results.objects = [f"**{len(events)} events**", table]
+
+    button.on_click(run_search)
+    return pn.Card(
+        pn.Row(signal, kind, value, button),
+        results,
+        title="Find events 🔎",
+        collapsed=True,
+        sizing_mode="stretch_width",
+    )
+
+
+def catalog_view(catalog_path: str = CATALOG_PATH):
+    """
+    Browse the converted logs from the catalog alone: filter by vehicle, name or signal,
+    sort by any column and see the fleet totals of the logs shown. Clicking a log opens
+    it in the dashboard.
+    """
+    if not os.path.exists(catalog_path):
+        return file_input
+
+    vehicle = pn.widgets.Select(
+        name="Vehicle", options=["All", *catalog.vehicles(catalog_path)]
+    )
+    search = pn.widgets.TextInput(name="Log name", placeholder="Search logs")
+    signal = pn.widgets.TextInput(name="Has signal", placeholder="e.g. EMB_Speed1")
+
+    @pn.depends(vehicle.param.value, search.param.value, signal.param.value)
+    @dashboard_metrics.timed("logs_table")
+    def logs_table(vehicle_name: str, search_text: str, signal_name: str):
+        filters = dict(
+            vehicle=None if vehicle_name == "All" else vehicle_name,
+            search=search_text.strip() or None,
+            signal=signal_name.strip() or None,
+        )
+        logs = catalog.list_logs(catalog_path, **filters)
+        table = pn.widgets.Tabulator(
+            logs.reset_index(drop=True),
+            hidden_columns=["export_file", "source_file"],
+            pagination="remote",
+            page_size=25,
+            disabled=True,
+            sizing_mode="stretch_width",
+        )
+
+        def open_log(event):
+            file_input.value = [logs["export_file"].iloc[event.row]]
+
+        table.on_click(open_log)
+        fleet = indicators.merge_states(
+            catalog.indicator_states(catalog_path, **filters)
+        )
+        if fleet is None:
+            return table
+        return pn.Column(
+            f"### Fleet totals ({fleet.logs} logs)",
+            utils.get_indicators(
+                df=None,
+                accumulator=fleet,
+                diesel_cost_per_litre=INDICATOR_SETTINGS["diesel_cost_per_litre"],
+            ),
+            table,
+        )
+
+    def open_export(export_file: str):
+        file_input.value = [export_file]
+
+    return pn.Column(
+        "# Logs 🗂️\n---",
+        pn.Row(vehicle, search, signal),
+        logs_table,
+        events_view(
+            catalog.signal_names(catalog_path),
+            lambda name, kind, value: stats_index.search_collection(
+                os.path.dirname(catalog_path), exporters.read_table, name, kind, value
+            ),
+            open_export=open_export,
+        ),
+        pn.Card(file_input, title="Browse export files", collapsed=True),
+        sizing_mode="stretch_width",
+    )
+
+
+@dashboard_metrics.timed("create_app")
 def create_app(file_list=None):
     if file_list is not None and file_list != []:
         # df = pd.read_csv(io.BytesIO(file))
         file = file_list[0]
         print("[yellow bold]Reloading the file")
-        df = pd.read_csv(file)
-        df.set_index("timestamps", inplace=True)
+        lod_dir = pyramid.pyramid_for_export(file)
+        indicators_file = indicators.indicators_for_export(file)
+        accumulator = None
+        if indicators_file is not None:
+            accumulator = indicators.IndicatorAccumulator.load(indicators_file)
+
+        if lod_dir is not None:
+            # The plots read the level of detail pyramid, so only the indicator
+            # signals are loaded in full, and only if they were not saved with the log.
+            df = None
+            if accumulator is None:
+                df = load_signals(file, INDICATOR_COLUMNS)
+            plot_source = pyramid.LodSource(
+                lod_dir,
+                read_raw=lambda columns, time_range: exporters.read_table(
+                    file, columns=columns, time_range=time_range
+                ),
+                n_points=vis.PIXEL_BUDGET,
+            )
+        else:
+            # Each signal is kept as its own compact (timestamps, values) arrays rather
+            # than as one mostly-NaN table.
+            df = load_signals(file, DASHBOARD_COLUMNS)
+            plot_source = df
 
         # df = pd.read_csv(io.BytesIO(df_mdf_filtered))
         # df.set_index("timestamps", inplace=True)
-        indicators = utils.get_indicators(df=df)
+        indicator_cards = utils.get_indicators(
+            df=df,
+            accumulator=accumulator,
+            diesel_cost_per_litre=INDICATOR_SETTINGS["diesel_cost_per_litre"],
+        )
+        refresh_cache_stats()
 
-        cols = list(df)
+        cols = exporters.read_columns(file)
 
         # Create a checkbox group for selecting columns to plot
         column_selector = pn.widgets.CheckBoxGroup(
@@ -45,18 +308,42 @@ def create_app(file_list=None):
 
         # Function to update the plot based on selected columns
         @pn.depends(column_selector.param.value)
+        @dashboard_metrics.timed("update_plot")
         def update_plot(selected_columns: List[str]):
             if not selected_columns:
                 return "Please select at least one column to plot."
-            return vis.hvplot_df_by_col(df=df, cols=selected_columns, xlabel="Time (s)")
+            if lod_dir is not None:
+                df_selected = plot_source
+            else:
+                df_selected = load_signals(file, selected_columns)
+            return vis.hvplot_df_by_col(
+                df=df_selected, cols=list(selected_columns), xlabel="Time (s)"
+            )
+
+        # Event search reads only the windows the stats index points to.
+        stats_file = stats_index.stats_for_export(file)
+        events = pn.Column()
+        if stats_file is not None:
+            events = events_view(
+                cols,
+                lambda name, kind, value: stats_index.search(
+                    stats_file,
+                    lambda columns, time_range: exporters.read_table(
+                        file, columns=columns, time_range=time_range
+                    ),
+                    name,
+                    kind,
+                    value,
+                ),
+            )
 
         # Layout the components
         app_layout = pn.GridBox(
-            pn.Row(pn.panel(indicators)),
+            pn.Row(pn.panel(indicator_cards)),
             pn.Row(
                 pn.Column(
                     "# Temperatures 🌡️\n---",
-                    vis.plot_temperatures(df=df),
+                    vis.plot_temperatures(df=plot_source),
                     "---",
                     "# Interactive Data Visualiser 📈 \n---",
                     update_plot,
@@ -66,44 +353,187 @@ def create_app(file_list=None):
                         max_height=100,
                         collapsed=True,
                     ),
+                    events,
                 ),
                 pn.Column(
                     "# Power Consumption ⚡️\n---",
                     pn.panel(
                         vis.power_plot(
-                            df=df,
-                            voltage_col="BMS_Pack_Current",
-                            current_col="BMS_Pack_Inst_Voltage",
+                            df=plot_source,
+                            voltage_col="BMS_Pack_Inst_Voltage",
+                            current_col="BMS_Pack_Current",
+                            power_col=INDICATOR_SETTINGS["power_col"],
                             ylabel="Power Used (kW)",
                             color="yellow",
                             line_color="orange",
                             label="Battery",
                         )
                         * vis.power_plot(
-                            df=df,
+                            df=plot_source,
                             voltage_col="NLG_DcHvVoltAct",
                             current_col="NLG_DcHvCurrAct",
+                            power_col=INDICATOR_SETTINGS["gen_power_col"],
                             ylabel="Generated Power (kW)",
                             label="Generator",
                         )
                     ),
                     "---",
                     "# Battery Charge 🔋\n---",
-                    vis.battery_soc_plot(df=df, soc_column="BMS_Pack_SOC"),
+                    vis.battery_soc_plot(df=plot_source, soc_column="BMS_Pack_SOC"),
                 ),
             ),
         )
         return app_layout
 
     else:
-        return file_input  # Return an empty DataFrame if no file is selected
+        return catalog_view()  # List the converted logs if no file is selected
+
+
+def live_session() -> live.LiveSession:
+    """One live bus session per server process, shared by every browser session."""
+    if "live_session" not in pn.state.cache:
+        settings = live.get_live_settings(config)
+        pn.state.cache["live_session"] = live.LiveSession(
+            live.find_dbc_files(settings["dbcs_dir"]),
+            interface=settings["interface"],
+            channel=settings["channel"],
+            bitrate=settings["bitrate"],
+            capacity=settings["buffer_samples"],
+        )
+    return pn.state.cache["live_session"]
+
+
+def live_view():
+    """
+    Plot signals decoded from the live bus. Every `live.update_ms` only the samples
+    that arrived since the last update are streamed to the browser, and the plots keep
+    at most one ring buffer's worth of samples per signal.
+    """
+    settings = live.get_live_settings(config)
+    session = live_session()
+    if not session.signals:
+        return f"No DBC signals found in {settings['dbcs_dir']}"
+
+    start = pn.widgets.Toggle(
+        name="Stop" if session.running else "Start",
+        value=session.running,
+        button_type="primary",
+    )
+    simulate = pn.widgets.Checkbox(
+        name="Simulate traffic (virtual bus)",
+        value=False,
+        disabled=settings["interface"] != "virtual",
+    )
+    signals = pn.widgets.MultiChoice(
+        name="Signals", options=session.signals, value=session.signals[:3]
+    )
+    stats = pn.pane.Markdown()
+    simulation = {"stop": None}
+    updates = {"callback": None}
+
+    def toggle(event):
+        if event.new:
+            session.start()
+            if simulate.value:
+                simulation["stop"] = threading.Event()
+                live.simulate_traffic(
+                    session.messages.values(),
+                    channel=settings["channel"],
+                    stop=simulation["stop"],
+                )
+        else:
+            if simulation["stop"] is not None:
+                simulation["stop"].set()
+            session.stop()
+        # A widget's name is a constant parameter, but it is the button's label.
+        with param.edit_constant(start):
+            start.name = "Stop" if event.new else "Start"
+
+    start.param.watch(toggle, "value")
+
+    @pn.depends(signals.param.value)
+    def plots(names: List[str]):
+        if not names:
+            return "Select signals to plot."
+        buffers, cursors = {}, {}
+        curves = []
+        for name in names:
+            buffers[name] = hv.streams.Buffer(
+                pd.DataFrame({"t": [], "value": []}),
+                length=session.capacity,
+                index=False,
+            )
+            cursors[name] = max(session.buffers[name].written - session.capacity, 0)
+            curves.append(
+                hv.DynamicMap(
+                    lambda data, name=name: hv.Curve(data, "t", "value", label=name),
+                    streams=[buffers[name]],
+                )
+            )
+
+        def push():
+            for name, buffer in buffers.items():
+                t, v, cursors[name] = session.buffers[name].since(cursors[name])
+                if len(t):
+                    buffer.send(pd.DataFrame({"t": t, "value": v}))
+            s = session.stats()
+            stats.object = (
+                f"{s['frames']:,} frames · {s['frames_per_s']:,.0f} frames/s · "
+                f"latency {s['latency_ms']:.1f} ms · buffers {s['buffer_mb']:.1f} MB"
+            )
 
+        # One update loop per view: replace the one of the previous signal selection.
+        if updates["callback"] is not None:
+            updates["callback"].stop()
+        updates["callback"] = pn.state.add_periodic_callback(
+            push, settings["update_ms"]
+        )
+        return hv.Overlay(curves).opts(
+            hv.opts.Curve(
+                responsive=True,
+                height=500,
+                show_grid=True,
+                xlabel="Time (s)",
+                ylabel="",
+            )
+        )
+
+    def stop_updates(*_):
+        """Stop the plot updates and the simulated traffic of this view."""
+        if updates["callback"] is not None:
+            updates["callback"].stop()
+            updates["callback"] = None
+        if simulation["stop"] is not None:
+            simulation["stop"].set()
+
+    # The view is built again each time the live toggle is switched on, so this one
+    # stops when it is switched off or the browser session ends.
+    def hide(event):
+        if not event.new:
+            stop_updates()
+            live_toggle.param.unwatch(hidden)
+
+    hidden = live_toggle.param.watch(hide, "value")
+    pn.state.on_session_destroyed(stop_updates)
+    return pn.Column(
+        "# Live Bus 📡\n---",
+        pn.Row(start, simulate, signals),
+        stats,
+        plots,
+        sizing_mode="stretch_width",
+    )
+
+
+live_toggle = pn.widgets.Toggle(name="Live bus 📡", value=False)
 
 sidebar = [
     "# IREX Dashboard\n---",
     pn.Spacer(sizing_mode="stretch_both"),
     # file_input,
+    live_toggle,
     pn.Spacer(sizing_mode="stretch_both"),
+    cache_stats,
+    latency_stats,
     pn.panel(
         "https://static.wixstatic.com/media/7429ff_c332d4103e494ce0b1149da82afde237~mv2.png/v1/fill/w_248,h_72,al_c,q_85,usm_0.66_1.00_0.01,enc_auto/Copy%20of%20NewLogo_rectangle_4QT.png"
     ),
@@ -114,7 +544,13 @@ sidebar = [
 #   Rendering
 ######################
 
-interactive_app = pn.bind(create_app, file_input)
+interactive_app = pn.bind(
+    lambda file_list, show_live: live_view() if show_live else create_app(file_list),
+    file_input,
+    live_toggle,
+)
+refresh_cache_stats()
+pn.state.onload(lambda: pn.state.add_periodic_callback(refresh_cache_stats, 5000))
 template = pn.template.FastListTemplate(
     title="4QT IREX Log Parser",
     sidebar=sidebar,